@@ -0,0 +1,71 @@
+"""
+
+- EMOS 'build.py' Source Code -
+
+(C) Cubeflix 2021 (EMOS)
+
+"""
+
+
+# Imports
+import os
+import sys
+import argparse
+import emos.parse
+
+
+def main(args):
+
+	"""Compile EMOS code from the host command line.
+	   Args: args -> the command line arguments"""
+
+	argparser = argparse.ArgumentParser(prog='python -m emos.build', description='Compile EMOS code into executables.')
+	argparser.add_argument('sources', nargs='+', help='source files, or directories of .cpu files')
+	argparser.add_argument('-o', '--outdir', help='directory to write the executables to, instead of next to each source')
+	argparser.add_argument('-O', '--optimize', action='store_true', help='optimize the code')
+	argparser.add_argument('-v2', dest='encoding', action='store_const', const=2, default=1, help='use the compact encoding')
+	argparser.add_argument('--stack', type=int, default=0, help='bytes of stack to reserve when the executables are loaded')
+	argparser.add_argument('--heap', type=int, default=0, help='size of the heap arena to preallocate when the executables are loaded')
+	argparser.add_argument('--entry', help='label to start running at')
+	argparser.add_argument('-j', '--processes', type=int, help='number of processes to compile with')
+	args = argparser.parse_args(args)
+
+	# Find the source files
+	paths = []
+	for path in args.sources:
+		if os.path.isdir(path):
+			paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.cpu'))
+		else:
+			paths.append(path)
+
+	sources = []
+	results = {}
+	for path in paths:
+		try:
+			with open(path, 'r') as f:
+				sources.append((path, f.read()))
+		except OSError as e:
+			results[path] = (32, str(e))
+
+	results.update(emos.parse.compile_batch(sources, optimize=args.optimize, encoding=args.encoding, processes=args.processes, stack_size=args.stack, heap_size=args.heap, entry=args.entry))
+
+	# Write the executables
+	failed = 0
+	for path in paths:
+		exitcode, output = results[path]
+		if exitcode != 0:
+			sys.stderr.write(path + ': ' + output + '\n')
+			failed += 1
+			continue
+		outpath = os.path.splitext(path)[0] + '.cbf'
+		if args.outdir:
+			outpath = os.path.join(args.outdir, os.path.basename(outpath))
+		with open(outpath, 'wb') as f:
+			f.write(output)
+
+	print('Compiled ' + str(len(paths) - failed) + ' of ' + str(len(paths)) + ' files.')
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1 : ]))
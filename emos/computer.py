@@ -16,76 +16,486 @@ class FileSystem:
 
 	"""A hard drive managed by the OS."""
 
-	def __init__(self, computer, outfile):
+	def __init__(self, computer, outfile, durability='async', flush_interval=FLUSH_INTERVAL, compression=None):
 
 		"""Create the hard drive.
 		   Args: computer -> the computer the hard drive is attached to
-		         outfile -> the name of the output file/virtual hard disk"""
+		         outfile -> the name of the output file/virtual hard disk
+		         durability -> when changes are written to disk. 'sync' writes each change before returning, 'async' writes changes in the background as soon as possible, and 'interval' writes them in the background every flush_interval seconds
+		         flush_interval -> the number of seconds between background writes for the 'interval' durability
+		         compression -> the compression to store file data with, either None, 'zlib' or 'lzma'"""
 
 		self.computer = computer
 		self.outfile = outfile
 		self.filesystem = {}
+		# Content-addressed file data, stored as reference-counted chunks keyed by their hash. Chunks that are not in the disk image yet are kept
+		# with their compression method, stored data and length
+		self.blobs = {}
+		self.blob_refs = {}
+		self.compression = compression
+		# The memory-mapped disk image, and the offset, stored length, compression method and length of each chunk in it
+		self.image = None
+		self.image_file = None
+		self.blob_extents = {}
+		# Recently used chunks, decompressed
+		self.blob_cache = collections.OrderedDict()
+		self.blob_cache_size = 0
+		self.blob_cache_max_size = BLOB_CACHE_SIZE
+		# Cached path lookups, mapping each path to its names from the root, the directory containing it and its final name
+		self.path_cache = {}
+		# Mounted host directories, by the names of the path they are mounted at
+		self.mounts = {}
+
+		# Journal of operations applied since the output file was last compacted
+		self.journal_file = outfile + '.journal'
+		self.journal = None
+		self.journal_size = 0
+		self.journal_max_size = JOURNAL_MAX_SIZE
+		self.generation = 0
+		self.replaying = False
+
+		# Journal records waiting to be written by the write-back thread
+		self.durability = durability
+		self.flush_interval = flush_interval
+		self.pending = []
+		self.flush_request = threading.Event()
+		self.flusher = None
+		self.flusher_running = False
+		self.lock = threading.RLock()
+
+	def _blob_put(self, data, compression=None):
+
+		"""Store data in the blob store, returning the hashes of its chunks.
+		   Args: data -> the data to store
+		         compression -> the compression to store new chunks with, either None, 'zlib' or 'lzma'. Defaults to the file system's compression"""
+
+		method = COMPRESSION_METHODS[compression if compression else self.compression]
+		chunks = []
+		for i in range(0, len(data), BLOB_CHUNK_SIZE):
+			chunk = bytes(data[i : i + BLOB_CHUNK_SIZE])
+			digest = hashlib.sha256(chunk).digest()
+			# Identical chunks share storage
+			if not digest in self.blob_refs:
+				self.blobs[digest] = self._blob_encode(chunk, method)
+				self.blob_refs[digest] = 0
+				self._blob_cache(digest, chunk)
+			self.blob_refs[digest] += 1
+			chunks.append(digest)
+		return tuple(chunks)
+
+	def _blob_encode(self, chunk, method):
+
+		"""Compress a chunk, returning the compression method used, the stored data and the length of the chunk. Chunks that do not get smaller are stored uncompressed.
+		   Args: chunk -> the chunk
+		         method -> the compression method"""
+
+		if method == 1:
+			stored = zlib.compress(chunk)
+		elif method == 2:
+			stored = lzma.compress(chunk)
+		if method == 0 or len(stored) >= len(chunk):
+			return (0, chunk, len(chunk))
+		return (method, stored, len(chunk))
+
+	def _blob_decode(self, method, stored):
+
+		"""Decompress a stored chunk.
+		   Args: method -> the compression method
+		         stored -> the stored data"""
+
+		if method == 1:
+			return zlib.decompress(stored)
+		elif method == 2:
+			return lzma.decompress(stored)
+		return bytes(stored)
+
+	def _blob_get(self, chunks):
+
+		"""Get the data stored in a list of chunks.
+		   Args: chunks -> the hashes of the chunks"""
+
+		if len(chunks) == 1:
+			return self._blob_read(chunks[0])
+		return b''.join([self._blob_read(digest) for digest in chunks])
+
+	def _blob_length(self, digest):
+
+		"""Get the length of a chunk without reading it.
+		   Args: digest -> the hash of the chunk"""
+
+		if digest in self.blobs:
+			return self.blobs[digest][2]
+		return self.blob_extents[digest][3]
+
+	def _blob_read(self, digest):
+
+		"""Get the data of a chunk, using the cache of decompressed chunks.
+		   Args: digest -> the hash of the chunk"""
 
-	def read_file(self, path):
+		try:
+			self.blob_cache.move_to_end(digest)
+			return self.blob_cache[digest]
+		except KeyError:
+			pass
+		# Decompress the chunk from memory or the disk image
+		if digest in self.blobs:
+			method, stored, size = self.blobs[digest]
+		else:
+			offset, length, method, size = self.blob_extents[digest]
+			stored = self.image[offset : offset + length]
+		chunk = self._blob_decode(method, stored)
+		self._blob_cache(digest, chunk)
+		return chunk
 
-		"""Read a file from the file system.
-		   Args: path -> the path to the file"""
+	def _blob_cache(self, digest, chunk):
+
+		"""Add a decompressed chunk to the cache, removing the least recently used chunks once the cache is full.
+		   Args: digest -> the hash of the chunk
+		         chunk -> the decompressed chunk"""
+
+		self.blob_cache[digest] = chunk
+		self.blob_cache_size += len(chunk)
+		while self.blob_cache_size > self.blob_cache_max_size:
+			digest, chunk = self.blob_cache.popitem(last=False)
+			self.blob_cache_size -= len(chunk)
+
+	def _blob_ref(self, chunks):
+
+		"""Add a reference to a list of chunks.
+		   Args: chunks -> the hashes of the chunks"""
+
+		for digest in chunks:
+			self.blob_refs[digest] += 1
+
+	def _blob_release(self, chunks):
+
+		"""Remove a reference to a list of chunks, deleting chunks that are no longer referenced.
+		   Args: chunks -> the hashes of the chunks"""
+
+		for digest in chunks:
+			self.blob_refs[digest] -= 1
+			if self.blob_refs[digest] == 0:
+				self._blob_delete(digest)
+
+	def _blob_delete(self, digest):
+
+		"""Delete a chunk from the blob store.
+		   Args: digest -> the hash of the chunk"""
+
+		self.blobs.pop(digest, None)
+		self.blob_extents.pop(digest, None)
+		if digest in self.blob_cache:
+			self.blob_cache_size -= len(self.blob_cache.pop(digest))
+		del self.blob_refs[digest]
+
+	def _blob_release_tree(self, node):
+
+		"""Release the chunks of every file in a directory, recursively.
+		   Args: node -> the directory"""
+
+		for item in node.values():
+			if type(item) == dict:
+				self._blob_release_tree(item)
+			else:
+				self._blob_release(item)
+
+	def _blob_rebuild(self, node):
+
+		"""Convert the files in a directory from raw data to chunks, and count references to chunks, recursively.
+		   Args: node -> the directory"""
+
+		for name, item in node.items():
+			if type(item) == dict:
+				self._blob_rebuild(item)
+			elif type(item) in (bytes, bytearray):
+				# File data from an image written before the blob store existed
+				node[name] = self._blob_put(item)
+			else:
+				self._blob_ref(item)
+
+	def _split_path(self, path):
+
+		"""Split a path into its names from the root directory.
+		   Args: path -> the path"""
 
+		return tuple([item for item in os.path.normpath(path).split(os.path.sep) if not item in ('', '.')])
+
+	def _mount(self, path):
+
+		"""Find the mounted host directory a path is in, returning the mount and the path on the host, or None and None if the path is not in a mounted directory.
+		   Args: path -> the path"""
+
+		if not self.mounts:
+			return (None, None)
+		names = self._split_path(path)
+		if '..' in names:
+			return (None, None)
+		# Use the deepest mount the path is in, so nested mounts resolve correctly
+		for mount_names, mount in sorted(self.mounts.items(), key=lambda item: len(item[0]), reverse=True):
+			if names[ : len(mount_names)] == mount_names:
+				return (mount, os.path.join(mount.path, *names[len(mount_names) : ]))
+		return (None, None)
+
+	def mount(self, path, host_path, readonly=False):
+
+		"""Mount a host directory in the file system. Files in the directory are read and written on the host, and are never stored in the output file.
+		   Args: path -> the path to mount the directory at
+		         host_path -> the path to the directory on the host
+		         readonly -> should the directory be mounted as read-only"""
+
+		names = self._split_path(path)
+		if not names or '..' in names or not os.path.isdir(host_path):
+			return (32, "Path is invalid.")
+		if names in self.mounts:
+			return (53, "Path is already mounted.")
+
+		self.mounts[names] = HostMount(host_path, readonly)
+		return (0, None)
+
+	def unmount(self, path):
+
+		"""Unmount a host directory from the file system.
+		   Args: path -> the path the directory is mounted at"""
+
+		names = self._split_path(path)
+		if not names in self.mounts:
+			return (54, "Path is not mounted.")
+
+		del self.mounts[names]
+		return (0, None)
+
+	def _resolve(self, path):
+
+		"""Find the directory containing a path, and the final name in the path. Lookups are cached by path.
+		   Args: path -> the path"""
+
+		# Check the path cache
+		try:
+			return (0, self.path_cache[path][1:])
+		except KeyError:
+			pass
 		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		# Find the file by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
+		names = self._split_path(path)
+		if '..' in names:
+			return (31, "Cannot traverse back from root directory.")
+		# Find the directory by iterating through the path into the file system
+		directory = self.filesystem
+		for item in names[ : -1]:
 			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
+				directory = directory[item]
+			except KeyError:
+				return (32, "Path is invalid.")
+			if not type(directory) == dict:
 				return (32, "Path is invalid.")
+		# Cache the lookup
+		if len(self.path_cache) >= PATH_CACHE_SIZE:
+			self.path_cache.clear()
+		self.path_cache[path] = (names, directory, names[-1] if names else None)
+		return (0, (directory, names[-1] if names else None))
+
+	def _resolve_node(self, path):
+
+		"""Find the file or directory at a path.
+		   Args: path -> the path"""
+
+		exitcode = self._resolve(path)
+		if exitcode[0] != 0:
+			return exitcode
+		directory, name = exitcode[1]
+		# The root directory
+		if name == None:
+			return (0, directory)
+		if not name in directory:
+			return (32, "Path is invalid.")
+		return (0, directory[name])
+
+	def _invalidate(self, path):
+
+		"""Remove cached lookups that pass through a directory which was removed or replaced.
+		   Args: path -> the path to the directory"""
+
+		names = self._split_path(path)
+		for key in [key for key, value in self.path_cache.items() if value[0][ : len(names)] == names and len(value[0]) > len(names)]:
+			del self.path_cache[key]
+
+	def get_type(self, path):
+
+		"""Get the type of the item at a path, either 'file' or 'directory'.
+		   Args: path -> the path"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.get_type(host_path)
+			exitcode = self._resolve_node(path)
+			if exitcode[0] != 0:
+				return exitcode
+			return (0, 'directory' if type(exitcode[1]) == dict else 'file')
+
+	def read_file(self, path):
+
+		"""Read a file from the file system.
+		   Args: path -> the path to the file"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.read_file(host_path)
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			return (0, self._blob_get(exitcode[1]))
+
+	def _get_file(self, path):
+
+		"""Get the chunks of a file in the file system.
+		   Args: path -> the path to the file"""
+
+		exitcode = self._resolve_node(path)
+		if exitcode[0] != 0:
+			return exitcode
 		# Get the final file
-		if not type(traversal_history[-1]) in (bytes, bytearray):
+		if not type(exitcode[1]) == tuple:
 			return (32, "Path is invalid.")
-		return (0, traversal_history[-1])
+		return exitcode
 
-	def write_file(self, path, data):
+	def write_file(self, path, data, compression=None):
 
 		"""Write to a new or existing file on the file system.
 		   Args: path -> the path to the file
-		         data -> the data to write to the file"""
+		         data -> the data to write to the file
+		         compression -> the compression to store the file with, either None, 'zlib' or 'lzma'. Defaults to the file system's compression"""
+
+		if not compression in COMPRESSION_METHODS:
+			return (51, "Invalid compression method.")
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.write_file(host_path, data)
+			chunks = self._blob_put(data, compression)
+			exitcode = self._set_file(path, chunks)
+			if exitcode[0] != 0:
+				self._blob_release(chunks)
+				return exitcode
+			# Update
+			self._backend_log('write_file', path, data, compression)
+			return (0, None)
 
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		final_name = split_path.pop()
+	def write_files(self, files, compression=None):
+
+		"""Write several new or existing files on the file system in one update, stopping at the first file that can't be written.
+		   Args: files -> a list of paths and the data to write to each file
+		         compression -> the compression to store the files with, either None, 'zlib' or 'lzma'. Defaults to the file system's compression"""
+
+		if not compression in COMPRESSION_METHODS:
+			return (51, "Invalid compression method.")
+
+		with self.lock:
+			written = []
+			exitcode = (0, None)
+			for path, data in files:
+				# Files in a mounted host directory
+				mount, host_path = self._mount(path)
+				if mount:
+					exitcode = mount.write_file(host_path, data)
+					if exitcode[0] != 0:
+						break
+					continue
+				chunks = self._blob_put(data, compression)
+				exitcode = self._set_file(path, chunks)
+				if exitcode[0] != 0:
+					self._blob_release(chunks)
+					break
+				written.append((path, data))
+			# Update all the files with one record
+			if written:
+				self._backend_log('write_files', written, compression)
+			return exitcode
+
+	def copy_file(self, path, new_path):
+
+		"""Copy a file within the file system. The copy shares its data with the original file.
+		   Args: path -> the path to the file
+		         new_path -> the path to the copy"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			new_mount, new_host_path = self._mount(new_path)
+			if mount and new_mount:
+				return new_mount.copy_file(host_path, new_host_path)
+			elif mount or new_mount:
+				# Copy the data between the host and the file system
+				exitcode = self.read_file(path)
+				if exitcode[0] != 0:
+					return exitcode
+				return self.write_file(new_path, exitcode[1])
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			chunks = exitcode[1]
+			self._blob_ref(chunks)
+			exitcode = self._set_file(new_path, chunks)
+			if exitcode[0] != 0:
+				self._blob_release(chunks)
+				return exitcode
+			# Update
+			self._backend_log('copy_file', path, new_path)
+			return (0, None)
+
+	def move_file(self, path, new_path):
+
+		"""Move a file within the file system, without copying its data.
+		   Args: path -> the path to the file
+		         new_path -> the new path to the file"""
+
+		with self.lock:
+			# Check for environment file
+			if os.path.basename(os.path.normpath(path)) == '__enviro':
+				return (41, "Cannot delete environment file.")
+			# Moving a file onto itself does nothing
+			if os.path.normpath(os.path.join(os.path.sep, path)) == os.path.normpath(os.path.join(os.path.sep, new_path)):
+				exitcode = self._get_file(path)
+				if exitcode[0] != 0:
+					return exitcode
+				return (0, None)
+			# Files in the same mounted host directory
+			mount, host_path = self._mount(path)
+			new_mount, new_host_path = self._mount(new_path)
+			if mount and new_mount:
+				if mount.readonly:
+					return (52, "File system is read-only.")
+				return new_mount.move_file(host_path, new_host_path)
+			exitcode = self.copy_file(path, new_path)
+			if exitcode[0] != 0:
+				return exitcode
+			return self.delete_file(path)
+
+	def _set_file(self, path, chunks):
+
+		"""Set the chunks of a new or existing file on the file system, releasing the file's old chunks.
+		   Args: path -> the path to the file
+		         chunks -> the hashes of the file's chunks"""
+
+		exitcode = self._resolve(path)
+		if exitcode[0] != 0:
+			return exitcode
+		directory, final_name = exitcode[1]
+		if final_name == None:
+			return (32, "Path is invalid.")
 		if any([char in final_name for char in INVALID_FILENAME_CHARS]):
 			return (34, "Invalid filename.")
-		# Find the file by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
-				return (32, "Path is invalid.")
 		# Check for a folder
-		if final_name in traversal_history[-1] and type(traversal_history[-1][final_name]) == dict:
+		if final_name in directory and type(directory[final_name]) == dict:
 			return (32, "Path is invalid.")
 		# Write to the final file
-		traversal_history[-1][final_name] = data
-		# Update
-		self._backend_update()
+		if final_name in directory:
+			self._blob_release(directory[final_name])
+		directory[final_name] = chunks
 		return (0, None)
 
 	def delete_file(self, path):
@@ -93,34 +503,23 @@ class FileSystem:
 		"""Delete a file from the file system.
 		   Args: path -> the path to the file"""
 
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		# Find the file by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
-				return (32, "Path is invalid.")
-		# Check the final file
-		if not type(traversal_history[-1]) in (bytes, bytearray):
-			return (32, "Path is invalid.")
-		# Check for environment file
-		if split_path[-1] == '__enviro':
-			return (41, "Cannot delete environment file.")
-		# Delete the file using the second to last reference in the traversal history
-		del traversal_history[-2][split_path[-1]]
-		# Update
-		self._backend_update()
-		return (0, None)
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.delete_file(host_path)
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			directory, final_name = self._resolve(path)[1]
+			# Check for environment file
+			if final_name == '__enviro':
+				return (41, "Cannot delete environment file.")
+			# Delete the file
+			self._blob_release(directory.pop(final_name))
+			# Update
+			self._backend_log('delete_file', path)
+			return (0, None)
 
 	def rename_file(self, path, new_name):
 
@@ -128,174 +527,831 @@ class FileSystem:
 		   Args: path -> the path to the file
 		         new_name -> new file name"""
 
-		if any([char in new_name for char in INVALID_FILENAME_CHARS]):
-			return (34, "Invalid filename.")
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		# Find the file by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.rename_file(host_path, new_name)
+			if any([char in new_name for char in INVALID_FILENAME_CHARS]):
+				return (34, "Invalid filename.")
+			# Allow folders and files
+			exitcode = self._resolve_node(path)
+			if exitcode[0] != 0:
+				return exitcode
+			directory, final_name = self._resolve(path)[1]
+			if final_name == None:
 				return (32, "Path is invalid.")
-		# Allow folders and files
-		# Rename the file using the second to last reference in the traversal history
-		# Check for environment file
-		if split_path[-1] == '__enviro':
-			return (41, "Cannot delete environment file.")
-		traversal_history[-2][new_name] = traversal_history[-2].pop(split_path[-1])
-		# Update
-		self._backend_update()
-		return (0, None)
+			# Check for environment file
+			if final_name == '__enviro':
+				return (41, "Cannot delete environment file.")
+			if final_name == new_name:
+				return (0, None)
+			# Release whatever the new name replaces
+			if new_name in directory:
+				if type(directory[new_name]) == dict:
+					self._blob_release_tree(directory[new_name])
+				else:
+					self._blob_release(directory[new_name])
+			# Rename the file, and forget cached lookups through the old and new names
+			directory[new_name] = directory.pop(final_name)
+			self._invalidate(path)
+			self._invalidate(os.path.join(os.path.dirname(os.path.normpath(path)), new_name))
+			# Update
+			self._backend_log('rename_file', path, new_name)
+			return (0, None)
 
 	def create_directory(self, path):
 
 		"""Create a directory in the file system.
 		   Args: path -> the path to the folder"""
 
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		final_name = split_path.pop()
-		if any([char in final_name for char in INVALID_FILENAME_CHARS]):
-			return (34, "Invalid directory name.")
-		# Find the folder by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.create_directory(host_path)
+			exitcode = self._resolve(path)
+			if exitcode[0] != 0:
+				return exitcode
+			directory, final_name = exitcode[1]
+			if final_name == None:
+				return (33, "Folder already exists.")
+			if any([char in final_name for char in INVALID_FILENAME_CHARS]):
+				return (34, "Invalid directory name.")
+			# Check for an existing folder
+			if final_name in directory and type(directory[final_name]) == dict:
+				return (33, "Folder already exists.")
+			# Check for an existing file
+			if final_name in directory and type(directory[final_name]) == tuple:
 				return (32, "Path is invalid.")
-		# Check for an existing folder
-		if final_name in traversal_history[-1] and type(traversal_history[-1][final_name]) == dict:
-			return (33, "Folder already exists.")
-		# Check for an existing file
-		if final_name in traversal_history[-1] and type(traversal_history[-1][final_name]) in (bytes, bytearray):
-			return (32, "Path is invalid.")
-		# Create the directory
-		traversal_history[-1][final_name] = {}
-		# Update
-		self._backend_update()
-		return (0, None)
+			# Create the directory
+			directory[final_name] = {}
+			# Update
+			self._backend_log('create_directory', path)
+			return (0, None)
 
 	def delete_directory(self, path):
 
 		"""Delete a directory from the file system.
 		   Args: path -> the path to the folder"""
 
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		# Find the folder by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.delete_directory(host_path)
+			exitcode = self._resolve_node(path)
+			if exitcode[0] != 0:
+				return exitcode
+			directory, final_name = self._resolve(path)[1]
+			# Check the final directory
+			if not type(exitcode[1]) == dict or final_name == None:
 				return (32, "Path is invalid.")
-		# Check the final directory
-		if not type(traversal_history[-1]) == dict:
-			return (32, "Path is invalid.")
-		# Delete the folder using the second to last reference in the traversal history
-		try:
-			del traversal_history[-2][split_path[-1]]
-		except Exception as e:
-			return (32, "Path is invalid.")
-		# Update
-		self._backend_update()
-		return (0, None)
+			# Delete the folder, and forget cached lookups through it
+			self._blob_release_tree(directory.pop(final_name))
+			self._invalidate(path)
+			# Update
+			self._backend_log('delete_directory', path)
+			return (0, None)
+
+	def get_file_size(self, path):
+
+		"""Get the size of a file in the file system, without reading it.
+		   Args: path -> the path to the file"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.get_file_size(host_path)
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			chunks = exitcode[1]
+			if not chunks:
+				return (0, 0)
+			# Every chunk except the last is full
+			return (0, (len(chunks) - 1) * BLOB_CHUNK_SIZE + self._blob_length(chunks[-1]))
+
+	def read_file_range(self, path, offset, size):
+
+		"""Read part of a file from the file system. Only the chunks holding the part are read.
+		   Args: path -> the path to the file
+		         offset -> the offset in the file to read from
+		         size -> the maximum number of bytes to read"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.read_file_range(host_path, offset, size)
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			chunks = exitcode[1]
+			if size <= 0:
+				return (0, b'')
+			# Get the chunks holding the part, without keeping them in memory
+			first = offset // BLOB_CHUNK_SIZE
+			last = (offset + size - 1) // BLOB_CHUNK_SIZE
+			data = b''.join([self._blob_read(digest) for digest in chunks[first : last + 1]])
+			start = offset - first * BLOB_CHUNK_SIZE
+			return (0, data[start : start + size])
+
+	def write_file_range(self, path, offset, data):
+
+		"""Write to part of an existing file on the file system. Only the chunks holding the part are replaced.
+		   Args: path -> the path to the file
+		         offset -> the offset in the file to write to, padding the file with zero bytes if it is past the end of the file
+		         data -> the data to write"""
+
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.write_file_range(host_path, offset, data)
+			exitcode = self._get_file(path)
+			if exitcode[0] != 0:
+				return exitcode
+			chunks = exitcode[1]
+			directory, final_name = self._resolve(path)[1]
+			if not data:
+				return (0, None)
+			# Get the chunks holding the part, starting from the last chunk if the part is past the end of the file
+			first = min(offset // BLOB_CHUNK_SIZE, max(len(chunks) - 1, 0))
+			last = (offset + len(data) - 1) // BLOB_CHUNK_SIZE
+			buffer = bytearray(b''.join([self._blob_read(digest) for digest in chunks[first : last + 1]]))
+			start = offset - first * BLOB_CHUNK_SIZE
+			if len(buffer) < start:
+				buffer += bytes(start - len(buffer))
+			buffer[start : start + len(data)] = data
+			# Replace the chunks. The buffer starts on a chunk boundary, so every chunk but the last stays full
+			new_chunks = self._blob_put(buffer)
+			self._blob_release(chunks[first : last + 1])
+			directory[final_name] = chunks[ : first] + new_chunks + chunks[last + 1 : ]
+			# Update
+			self._backend_log('write_file_range', path, offset, data)
+			return (0, None)
 
 	def list_directory(self, path):
 
 		"""List a directory path, seperated by newlines.
 		   Args: path -> the path to the directory"""
 
-		# Split the path
-		split_path = os.path.normpath(path).split(os.path.sep)
-		# Find the folder by iterating through the path into the file system
-		traversal_history = [self.filesystem]
-		for item in split_path:
-			if item in ('', '.'):
-				continue
-			elif item == '..':
-				if len(traversal_history) == 1:
-					return (31, "Cannot traverse back from root directory.")
-				# Move back
-				del traversal_history[-1]
-			# Traverse to the next section
-			try:
-				traversal_history.append(traversal_history[-1][item])
-			except (KeyError, TypeError):
+		with self.lock:
+			# Files in a mounted host directory
+			mount, host_path = self._mount(path)
+			if mount:
+				return mount.list_directory(host_path)
+			exitcode = self._resolve_node(path)
+			if exitcode[0] != 0:
+				return exitcode
+			# Check the final directory
+			if not type(exitcode[1]) == dict:
 				return (32, "Path is invalid.")
-		# Check the final directory
-		if not type(traversal_history[-1]) == dict:
-			return (32, "Path is invalid.")
-		# List the folder
-		data = '\n'.join(traversal_history[-1])
-		# Update
-		self._backend_update()
-		return (0, data)
+			# List the folder, along with any host directories mounted in it
+			names = self._split_path(path)
+			items = list(exitcode[1])
+			items += [mount_names[-1] for mount_names in self.mounts if mount_names[ : -1] == names and not mount_names[-1] in exitcode[1]]
+			return (0, '\n'.join(items))
 
 	def get_full_buffer(self):
 
 		"""Get the full file system buffer."""
 
-		return pickle.dumps([self.filesystem, self.password])
+		buffer = io.BytesIO()
+		self._backend_write(buffer)
+		return buffer.getvalue()
+
+	def _backend_write(self, f):
+
+		"""Write the file system as a disk image, returning the offset, stored length, compression method and length of each chunk in the image.
+		   Args: f -> the file object to write to"""
+
+		# The header holds the position of the index, so write it once the index has been written
+		f.write(struct.pack(DISK_IMAGE_HEADER, DISK_IMAGE_MAGIC, 0, 0))
+		# Write the chunks
+		extents = {}
+		offset = struct.calcsize(DISK_IMAGE_HEADER)
+		for digest in self.blob_refs:
+			# Chunks are written as they are stored, without decompressing them
+			if digest in self.blobs:
+				method, stored, size = self.blobs[digest]
+			else:
+				stored_offset, length, method, size = self.blob_extents[digest]
+				stored = self.image[stored_offset : stored_offset + length]
+			f.write(stored)
+			extents[digest] = (offset, len(stored), method, size)
+			offset += len(stored)
+		# Write the index
+		index = pickle.dumps([self.filesystem, self.password, self.generation, extents])
+		f.write(index)
+		f.seek(0)
+		f.write(struct.pack(DISK_IMAGE_HEADER, DISK_IMAGE_MAGIC, offset, len(index)))
+		return extents
+
+	def _backend_map_image(self):
+
+		"""Memory-map the output file."""
+
+		self._backend_close_image()
+		self.image_file = open(self.outfile, 'rb')
+		self.image = mmap.mmap(self.image_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def _backend_close_image(self):
+
+		"""Unmap the output file."""
+
+		if self.image:
+			self.image.close()
+			self.image_file.close()
+		self.image = None
+		self.image_file = None
 
 	def _backend_load(self):
 
-		"""Load the file system from the output file."""
+		"""Load the file system from the output file, and replay the journal on top of it. File data is read from the output file when it is first used."""
 
+		with self.lock:
+			try:
+				f = open(self.outfile, 'rb')
+			except Exception as e:
+				raise SysError("Output file for FileSystem does not exist.")
+			magic = f.read(len(DISK_IMAGE_MAGIC))
+			if magic == DISK_IMAGE_MAGIC:
+				f.close()
+				# Map the image and load its index
+				self._backend_map_image()
+				magic, index_offset, index_length = struct.unpack_from(DISK_IMAGE_HEADER, self.image, 0)
+				self.filesystem, self.password, self.generation, self.blob_extents = pickle.loads(self.image[index_offset : index_offset + index_length])
+				self.blobs = {}
+				# Images written before compression was added store each chunk uncompressed
+				for digest, extent in self.blob_extents.items():
+					if len(extent) == 2:
+						self.blob_extents[digest] = (extent[0], extent[1], 0, extent[1])
+			else:
+				# Images written before the disk image format was added are a single pickle
+				f.seek(0)
+				image = pickle.loads(f.read())
+				f.close()
+				# Images written before the journal existed have no generation
+				self.filesystem, self.password = image[0], image[1]
+				self.generation = image[2] if len(image) > 2 else 0
+				self.blobs = {digest : (0, chunk, len(chunk)) for digest, chunk in (image[3] if len(image) > 3 else {}).items()}
+				self.blob_extents = {}
+			self.path_cache = {}
+			self.blob_cache.clear()
+			self.blob_cache_size = 0
+			# Count the references to each chunk
+			self.blob_refs = {digest : 0 for digest in list(self.blobs) + list(self.blob_extents)}
+			self._blob_rebuild(self.filesystem)
+			for digest in [digest for digest in self.blob_refs if self.blob_refs[digest] == 0]:
+				self._blob_delete(digest)
+
+			self._backend_replay()
+
+			if not '__enviro' in self.filesystem:
+				self.write_file('__enviro', b'{}')
+
+	def _backend_replay(self):
+
+		"""Replay the journal onto the loaded file system. Records after the last complete record are discarded."""
+
+		# Read the journal
+		try:
+			f = open(self.journal_file, 'rb')
+			data = f.read()
+			f.close()
+		except FileNotFoundError:
+			data = b''
+		# Read each record, stopping at the first incomplete or corrupted one
+		records = []
+		offset = 0
+		while offset + 8 <= len(data):
+			length, checksum = struct.unpack_from('<II', data, offset)
+			record = data[offset + 8 : offset + 8 + length]
+			if len(record) != length or zlib.crc32(record) != checksum:
+				break
+			try:
+				records.append(pickle.loads(record))
+			except Exception as e:
+				break
+			offset += 8 + length
+		# A journal from another generation is already part of the output file (or is stale), so start a new one
+		if not records or records[0] != ('generation', (self.generation, )):
+			self._backend_reset_journal()
+			return
+		# Apply the operations
+		self.replaying = True
 		try:
-			f = open(self.outfile, 'rb')
-		except Exception as e:
-			raise SysError("Output file for FileSystem does not exist.")
-		self.filesystem, self.password = pickle.loads(f.read())
-		f.close()
+			for operation, args in records[1:]:
+				if not operation in JOURNAL_OPERATIONS:
+					raise SysError("Invalid FileSystem journal operation.")
+				getattr(self, operation)(*args)
+		finally:
+			self.replaying = False
+		# Continue the journal after the last complete record
+		if self.journal:
+			self.journal.close()
+		self.journal = open(self.journal_file, 'r+b')
+		self.journal.truncate(offset)
+		self.journal.seek(offset)
+		self.journal_size = offset
+
+	def _backend_reset_journal(self):
+
+		"""Start a new, empty journal for the current generation."""
+
+		if self.journal:
+			self.journal.close()
+		self.journal = open(self.journal_file, 'wb')
+		self.journal_size = 0
+		self._backend_write_record(('generation', (self.generation, )))
+
+	def _backend_write_record(self, record):
+
+		"""Append a record to the journal.
+		   Args: record -> the record to append"""
+
+		record = self._backend_encode_record(record)
+		self.journal.write(record)
+		self.journal.flush()
+		self.journal_size += len(record)
+
+	def _backend_encode_record(self, record):
+
+		"""Encode a journal record, with its length and checksum.
+		   Args: record -> the record to encode"""
+
+		record = pickle.dumps(record)
+		return struct.pack('<II', len(record), zlib.crc32(record)) + record
+
+	def _backend_log(self, operation, *args):
+
+		"""Log an operation to the journal, compacting the journal once it grows too large.
+		   Args: operation -> the name of the FileSystem method that was applied
+		         args -> the arguments to the method"""
+
+		# Operations being replayed from the journal are already in it
+		if self.replaying:
+			return
+		# Without a journal, write the whole file system
+		if not self.journal:
+			self._backend_update()
+			return
+		if self.durability == 'sync':
+			# Write the record before returning
+			self._backend_write_record((operation, args))
+			os.fsync(self.journal.fileno())
+			if self.journal_size > self.journal_max_size:
+				self._backend_update()
+			return
+		# Leave the record for the write-back thread. The record is encoded now, as the arguments may change later
+		self.pending.append(self._backend_encode_record((operation, args)))
+		self._backend_start_flusher()
+		if self.durability == 'async':
+			self.flush_request.set()
+
+	def _backend_start_flusher(self):
+
+		"""Start the write-back thread, if it is not running."""
+
+		if self.flusher_running:
+			return
+		self.flusher_running = True
+		self.flusher = threading.Thread(target=self._backend_flusher, daemon=True)
+		self.flusher.start()
+
+	def _backend_flusher(self):
+
+		"""Write pending journal records to disk in the background, until the file system is closed."""
+
+		while self.flusher_running:
+			# Wait for a change, or for the next interval
+			self.flush_request.wait(self.flush_interval if self.durability == 'interval' else None)
+			self.flush_request.clear()
+			self._backend_flush()
+
+	def _backend_flush(self):
+
+		"""Write the pending journal records to the journal, compacting the journal once it grows too large."""
+
+		with self.lock:
+			if not self.pending:
+				return
+			data = b''.join(self.pending)
+			self.pending.clear()
+			self.journal.write(data)
+			self.journal.flush()
+			self.journal_size += len(data)
+			if self.journal_size > self.journal_max_size:
+				self._backend_update()
+
+	def sync(self):
+
+		"""Write all changes to disk."""
+
+		with self.lock:
+			self._backend_flush()
+			if self.journal:
+				os.fsync(self.journal.fileno())
 
-		if not '__enviro' in self.filesystem:
-			self.filesystem['__enviro'] = b'{}'
+		return (0, None)
 
-		self._backend_update()
+	def close(self):
 
-	def _backend_update(self):
+		"""Write all changes to disk and stop the write-back thread."""
+
+		# Stop the write-back thread
+		if self.flusher_running:
+			self.flusher_running = False
+			self.flush_request.set()
+			if self.flusher != threading.current_thread():
+				self.flusher.join()
+
+		with self.lock:
+			self.sync()
+			if self.journal:
+				self.journal.close()
+			self.journal = None
+			self._backend_close_image()
+
+		return (0, None)
 
-		"""Update the virtual hard drive file."""
+	def _backend_update(self):
 
-		f = open(self.outfile, 'wb')
-		f.write(self.get_full_buffer())
-		f.close()
+		"""Compact the journal by writing the full file system to the virtual hard drive file."""
+
+		with self.lock:
+			# Write the new image to a temporary file and replace the old one, so a crash leaves either the old or new image
+			self.generation += 1
+			f = open(self.outfile + '.tmp', 'wb')
+			extents = self._backend_write(f)
+			f.flush()
+			os.fsync(f.fileno())
+			f.close()
+			self._backend_close_image()
+			os.replace(self.outfile + '.tmp', self.outfile)
+			# Every chunk is now in the new image, so drop the chunks held in memory and read them from the image instead. Decompressed chunks stay cached
+			self.blob_extents = extents
+			self.blobs = {}
+			self._backend_map_image()
+			# The journal's operations, including those not written yet, are now in the image
+			self.pending.clear()
+			self._backend_reset_journal()
 
 	def _format(self, password=None):
 
 		"""Format the hard drive."""
 
-		self.filesystem = {'__enviro' : b'{}'}
-		self.password = hashlib.sha256(bytes(password, ENCODING)).digest()
-		self._backend_update()
+		with self.lock:
+			self.blobs = {}
+			self.blob_refs = {}
+			self.blob_extents = {}
+			self.blob_cache.clear()
+			self.blob_cache_size = 0
+			self.filesystem = {'__enviro' : self._blob_put(b'{}')}
+			self.path_cache = {}
+			self.password = hashlib.sha256(bytes(password, ENCODING)).digest()
+			self._backend_update()
+
+
+class HostMount:
+
+	"""A host directory mounted in the file system. Paths given to the mount are paths on the host."""
+
+	def __init__(self, path, readonly=False):
+
+		"""Create the mount.
+		   Args: path -> the path to the directory on the host
+		         readonly -> should the directory be read-only"""
+
+		self.path = os.path.abspath(path)
+		self.readonly = readonly
+
+	def _in_mount(self, path):
+
+		"""Check a path on the host is inside the mounted directory, once symlinks are resolved.
+		   Args: path -> the path on the host"""
+
+		root = os.path.realpath(self.path)
+		path = os.path.realpath(path)
+		return path == root or path.startswith(os.path.join(root, ''))
+
+	def get_type(self, path):
+
+		"""Get the type of the item at a path, either 'file' or 'directory'.
+		   Args: path -> the path"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if os.path.isdir(path):
+			return (0, 'directory')
+		elif os.path.isfile(path):
+			return (0, 'file')
+		return (32, "Path is invalid.")
+
+	def read_file(self, path):
+
+		"""Read a file.
+		   Args: path -> the path to the file"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		try:
+			f = open(path, 'rb')
+			data = f.read()
+			f.close()
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, data)
+
+	def write_file(self, path, data):
+
+		"""Write to a new or existing file.
+		   Args: path -> the path to the file
+		         data -> the data to write to the file"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if any([char in os.path.basename(path) for char in INVALID_FILENAME_CHARS]):
+			return (34, "Invalid filename.")
+		try:
+			f = open(path, 'wb')
+			f.write(data)
+			f.close()
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def copy_file(self, path, new_path):
+
+		"""Copy a file.
+		   Args: path -> the path to the file
+		         new_path -> the path to the copy"""
+
+		if not self._in_mount(path) or not self._in_mount(new_path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if not os.path.isfile(path):
+			return (32, "Path is invalid.")
+		try:
+			shutil.copyfile(path, new_path)
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def move_file(self, path, new_path):
+
+		"""Move a file.
+		   Args: path -> the path to the file
+		         new_path -> the new path to the file"""
+
+		if not self._in_mount(path) or not self._in_mount(new_path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if not os.path.isfile(path):
+			return (32, "Path is invalid.")
+		try:
+			shutil.move(path, new_path)
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def delete_file(self, path):
+
+		"""Delete a file.
+		   Args: path -> the path to the file"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if not os.path.isfile(path):
+			return (32, "Path is invalid.")
+		try:
+			os.remove(path)
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def rename_file(self, path, new_name):
+
+		"""Rename a file or directory.
+		   Args: path -> the path to the file
+		         new_name -> new file name"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if any([char in new_name for char in INVALID_FILENAME_CHARS]):
+			return (34, "Invalid filename.")
+		# The new name can't move the file into another directory
+		if new_name in ('', '.', '..') or '/' in new_name or '\\' in new_name or os.sep in new_name:
+			return (34, "Invalid filename.")
+		# The mounted directory itself can't be renamed
+		if path == self.path or not os.path.exists(path):
+			return (32, "Path is invalid.")
+		try:
+			os.replace(path, os.path.join(os.path.dirname(path), new_name))
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def create_directory(self, path):
+
+		"""Create a directory.
+		   Args: path -> the path to the folder"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		if any([char in os.path.basename(path) for char in INVALID_FILENAME_CHARS]):
+			return (34, "Invalid directory name.")
+		if os.path.isdir(path):
+			return (33, "Folder already exists.")
+		try:
+			os.mkdir(path)
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def delete_directory(self, path):
+
+		"""Delete a directory and everything in it.
+		   Args: path -> the path to the folder"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		# The mounted directory itself can't be deleted
+		if path == self.path or not os.path.isdir(path):
+			return (32, "Path is invalid.")
+		try:
+			shutil.rmtree(path)
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def get_file_size(self, path):
+
+		"""Get the size of a file.
+		   Args: path -> the path to the file"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if not os.path.isfile(path):
+			return (32, "Path is invalid.")
+		return (0, os.path.getsize(path))
+
+	def read_file_range(self, path, offset, size):
+
+		"""Read part of a file.
+		   Args: path -> the path to the file
+		         offset -> the offset in the file to read from
+		         size -> the maximum number of bytes to read"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		try:
+			f = open(path, 'rb')
+			f.seek(offset)
+			data = f.read(max(size, 0))
+			f.close()
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, data)
+
+	def write_file_range(self, path, offset, data):
+
+		"""Write to part of an existing file, padding the file with zero bytes if the offset is past the end of the file.
+		   Args: path -> the path to the file
+		         offset -> the offset in the file to write to
+		         data -> the data to write"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		if self.readonly:
+			return (52, "File system is read-only.")
+		try:
+			f = open(path, 'r+b')
+			f.seek(offset)
+			f.write(data)
+			f.close()
+		except OSError as e:
+			return (32, "Path is invalid.")
+		return (0, None)
+
+	def list_directory(self, path):
+
+		"""List a directory, seperated by newlines.
+		   Args: path -> the path to the directory"""
+
+		if not self._in_mount(path):
+			return (32, "Path is invalid.")
+		try:
+			return (0, '\n'.join(os.listdir(path)))
+		except OSError as e:
+			return (32, "Path is invalid.")
+
+	def __repr__(self):
+
+		"""Get the string representation of the mount."""
+
+		return "<HostMount " + self.path + (" (read-only)>" if self.readonly else ">")
+
+	def __str__(self):
+
+		"""Get the string representation of the mount."""
+
+		return self.__repr__()
+
+
+class FileHandle:
+
+	"""An open file in the file system, read and written in parts from a position in the file."""
+
+	def __init__(self, filesystem, path, mode):
+
+		"""Create the file handle.
+		   Args: filesystem -> the file system the file is in
+		         path -> the full path to the file
+		         mode -> the mode the file is open in. 0 for reading, 1 for writing, 2 for appending and 3 for reading and writing"""
+
+		self.filesystem = filesystem
+		self.path = path
+		self.mode = mode
+		self.position = 0
+
+	def read(self, size):
+
+		"""Read from the file at the current position, moving the position past the data read.
+		   Args: size -> the maximum number of bytes to read"""
+
+		if not self.mode in (0, 3):
+			return (48, "File is not open for reading.")
+		exitcode = self.filesystem.read_file_range(self.path, self.position, size)
+		if exitcode[0] == 0:
+			self.position += len(exitcode[1])
+		return exitcode
+
+	def write(self, data):
+
+		"""Write to the file at the current position, or at the end of the file in append mode, moving the position past the data written.
+		   Args: data -> the data to write"""
+
+		if not self.mode in (1, 2, 3):
+			return (48, "File is not open for writing.")
+		if self.mode == 2:
+			exitcode = self.filesystem.get_file_size(self.path)
+			if exitcode[0] != 0:
+				return exitcode
+			self.position = exitcode[1]
+		exitcode = self.filesystem.write_file_range(self.path, self.position, data)
+		if exitcode[0] == 0:
+			self.position += len(data)
+		return exitcode
+
+	def seek(self, offset, whence=0):
+
+		"""Move the position in the file, returning the new position.
+		   Args: offset -> the offset to move to
+		         whence -> what the offset is relative to. 0 for the start of the file, 1 for the current position and 2 for the end of the file"""
+
+		if whence == 0:
+			position = offset
+		elif whence == 1:
+			position = self.position + offset
+		elif whence == 2:
+			exitcode = self.filesystem.get_file_size(self.path)
+			if exitcode[0] != 0:
+				return exitcode
+			position = exitcode[1] + offset
+		else:
+			return (49, "Invalid seek origin.")
+		if position < 0:
+			return (49, "Invalid seek origin.")
+		self.position = position
+		return (0, position)
+
+	def __repr__(self):
+
+		"""Get the string representation of the file handle."""
+
+		return "<FileHandle " + self.path + " at " + str(self.position) + ">"
+
+	def __str__(self):
+
+		"""Get the string representation of the file handle."""
+
+		return self.__repr__()
 
 
 class Computer:
@@ -461,15 +1517,18 @@ class Peripheral:
 
 class TerminalScreen(Peripheral):
 
-	"""The terminal screen class."""
+	"""The terminal screen class. The screen is drawn by a render thread, which only redraws the lines that changed."""
 
 	defined_interrupts = [0xe0, 0xe1, 0xe2, 0xe3]
 
-	def __init__(self, computer):
+	def __init__(self, computer, fps=TERMINAL_FPS):
 
-		"""Create the terminal."""
+		"""Create the terminal.
+		   Args: computer -> computer the terminal is attached to
+		         fps -> the maximum number of times to draw the screen per second"""
 
 		self.computer = computer
+		self.fps = fps
 
 	def start(self, pid):
 
@@ -490,10 +1549,24 @@ class TerminalScreen(Peripheral):
 		clear()
 		os.system("title [EMOS] TERMINAL_SCREEN_" + str(self.pid))
 
+		# Start the render thread
+		self.screen_lines = [''] * self.rows
+		self.rendering = True
+		self.render_event = threading.Event()
+		self.render_thread = threading.Thread(target=self.render_loop, daemon=True)
+		self.render_thread.start()
+
 	def end(self):
 
 		"""Run ending protocols."""
 
+		# Stop the render thread
+		self.rendering = False
+		self.render_event.set()
+		self.render_thread.join()
+		# Draw the last changes
+		self.render()
+
 		# Remove the designated memory for the terminal's printout
 		self.computer.memory.delete_memory_partition(('perp', self.pid))
 
@@ -513,14 +1586,14 @@ class TerminalScreen(Peripheral):
 			return self.update_screen()
 		elif iid == 0xe1:
 			# Get one char and save it to RAX
-			char = getchars(1)
+			char = self.get_chars(1)
 			# Place the char in RAX
 			self.computer.operatingsystem.processes[pid].threads[tid].registers['RAX'].data[0] = ord(char)
 			return (0, None)
 		elif iid == 0xe2:
 			# Get a number of chars (as specified in RBX) and put them into stack
 			nchars = int.from_bytes(self.computer.operatingsystem.processes[pid].threads[tid].registers['RBX'].data[0 : 4], byteorder='little')
-			chars = getchars(nchars)
+			chars = self.get_chars(nchars)
 			# Place the chars
 			self.computer.operatingsystem.processes[pid].threads[tid].stack.push(bytes(chars, ENCODING))
 			# Recalculate RES
@@ -528,59 +1601,88 @@ class TerminalScreen(Peripheral):
 			return (0, None)
 		elif iid == 0xe3:
 			# Get the rows and columns and put it as two 2-byte integers into RBX
-			self.computer.operatingsystem.processes[pid].threads[tid].registers['RAX'].data[0 : 4] = int.to_bytes(self.rows, 2, byteorder='little') + int.to_bytes(self.columns, 2, byteorder='little')
-	
+			self.computer.operatingsystem.processes[pid].threads[tid].registers['RAX'].data[0 : 4] = int.to_bytes(self.rows, 2, byteorder='little') + int.to_bytes(self.cols, 2, byteorder='little')
+			return (0, None)
+
+	def get_chars(self, n):
+
+		"""Get N characters from the keyboard, without echoing.
+		   Args: n -> number of chars to get"""
+
+		return getchars(n)
+
+	def get_line(self):
+
+		"""Get a line from the keyboard, with the console echoing it."""
+
+		return input()
+
 	def update_screen(self):
 
-		"""Update the data buffer to the screen."""
+		"""Mark the screen as changed, so the render thread draws it."""
 
-		# Clear the terminal
-		clear()
+		self.render_event.set()
+
+		return (0, None)
+
+	def get_lines(self):
+
+		"""Get the lines of the data buffer to show on the screen, wrapping long lines."""
+
+		# Update the buffer if the terminal's data changed
+		if self.computer.operatingsystem.terminal.changed:
+			self.computer.operatingsystem.terminal.update_buffer()
 
 		# Get a variable for the data
 		data = str(self.computer.memory.memorypartitions[('perp', self.pid)].data.replace(b'\x00', b''), ENCODING)
 
-		new_data = []
+		lines = []
 
 		# Put in newlines if a line is too long
 		for line in data.split('\n'):
-			if len(line) > self.cols:
-				# Too many characters in the line
-				new_data.append(line[ : self.cols])
-				new_data.append(line[self.cols : ])
-			else:
-				# Else, just add the line
-				new_data.append(line)
-
-		# Join the new data
-		data = '\n'.join(new_data)
-
-		# Cut the data off if there are too many newlines
-		if data.count('\n') + 1 > self.rows:
-			# Too many lines, so cut some off
-			split_data = data.split('\n')
-			new_data = []
-			# Iterate over each line, reversed
-			for line in reversed(split_data):
-				# Check if the line is too long
-				if len(line) > self.cols:
-					# Add two lines
-					new_data.append(line[ : self.cols])
-					new_data.append(line[self.cols : ])
-				else:
-					# Add the line
-					new_data.append(line)
-				# If there are too many lines
-				if len(new_data) >= self.rows:
-					break
+			lines.append(line[ : self.cols])
+			for start in range(self.cols, len(line), self.cols):
+				lines.append(line[start : start + self.cols])
 
-			# Join the new data, reversed
-			data = '\n'.join(reversed(new_data))
+		# Cut the lines off if there are too many
+		return lines[-self.rows : ]
 
-		# Print the data
-		write(data)
+	def render(self):
 
-		return (0, None)
+		"""Draw the lines of the screen that changed since it was last drawn."""
+
+		lines = self.get_lines()
+
+		output = []
+		for row in range(self.rows):
+			line = lines[row] if row < len(lines) else ''
+			if line == self.screen_lines[row]:
+				continue
+			# Move to the line, write it, and clear the rest of it
+			output.append('\x1b[' + str(row + 1) + ';1H' + line + '\x1b[K')
+			self.screen_lines[row] = line
+
+		# Put the cursor at the end of the data
+		output.append('\x1b[' + str(len(lines)) + ';' + str(len(lines[-1]) + 1) + 'H')
+
+		# Print the changes
+		write(''.join(output))
+
+	def render_loop(self):
+
+		"""Draw the screen whenever it changes, at most fps times per second."""
+
+		while True:
+			self.render_event.wait()
+			if not self.rendering:
+				break
+			self.render_event.clear()
+			try:
+				self.render()
+			except Exception:
+				# Draw again on the next frame
+				self.render_event.set()
+			time.sleep(1 / self.fps)
 
 	def __repr__(self):
 
@@ -593,3 +1695,95 @@ class TerminalScreen(Peripheral):
 		"""Get the string representation of the peripheral."""
 
 		return self.__repr__()
+
+
+class HeadlessTerminalScreen(TerminalScreen):
+
+	"""A terminal screen kept in memory, for running without a console. Input is read from a queue of scripted input, and the screen is only drawn when it is asked for."""
+
+	def __init__(self, computer, rows=24, cols=80):
+
+		"""Create the terminal.
+		   Args: computer -> computer the terminal is attached to
+		         rows -> number of rows on the screen
+		         cols -> number of columns on the screen"""
+
+		self.computer = computer
+		self.rows = rows
+		self.cols = cols
+
+		# Scripted input, waited on when there isn't enough
+		self.input_data = collections.deque()
+		self.input_condition = threading.Condition()
+
+	def start(self, pid):
+
+		"""Start the terminal.
+		   Args: pid -> peripheral ID"""
+
+		self.pid = pid
+
+		# Create the designated memory for the terminal's printout
+		self.computer.memory.add_memory_partition(('perp', self.pid), MemorySection('terminal_perp_' + str(self.pid), self.rows * self.cols + self.rows, bytes(self.rows * self.cols + self.rows)))
+
+	def end(self):
+
+		"""Run ending protocols."""
+
+		# Remove the designated memory for the terminal's printout
+		self.computer.memory.delete_memory_partition(('perp', self.pid))
+
+		del self.pid
+
+	def update_screen(self):
+
+		"""Update the screen. The screen is drawn when get_screen is called, so nothing is done here."""
+
+		return (0, None)
+
+	def get_screen(self):
+
+		"""Draw the screen, returning its lines."""
+
+		lines = self.get_lines()
+		return lines + [''] * (self.rows - len(lines))
+
+	def feed_input(self, data):
+
+		"""Add scripted input for the terminal to read.
+		   Args: data -> the input text to add"""
+
+		with self.input_condition:
+			self.input_data.extend(data)
+			self.input_condition.notify_all()
+
+	def get_chars(self, n):
+
+		"""Get N characters from the scripted input, waiting until there are enough.
+		   Args: n -> number of chars to get"""
+
+		with self.input_condition:
+			self.input_condition.wait_for(lambda: len(self.input_data) >= n)
+			return ''.join([self.input_data.popleft() for i in range(n)])
+
+	def get_line(self):
+
+		"""Get a line from the scripted input, waiting until there is a full line."""
+
+		with self.input_condition:
+			self.input_condition.wait_for(lambda: '\n' in self.input_data)
+			line = ''.join(iter(self.input_data.popleft, '\n'))
+
+		return line
+
+	def __repr__(self):
+
+		"""Get the string representation of the peripheral."""
+
+		return "<HeadlessTerminalScreen>"
+
+	def __str__(self):
+
+		"""Get the string representation of the peripheral."""
+
+		return self.__repr__()
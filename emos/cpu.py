@@ -39,6 +39,15 @@ class Register:
 		del self.data
 		return (0, None)
 
+	def copy(self):
+
+		"""Get a copy of the register."""
+
+		register = Register(self.name, self.size)
+		if hasattr(self, 'data'):
+			register.data = bytearray(self.data)
+		return register
+
 	def set_data(self, data, offset):
 
 		"""Set the data."""
@@ -110,6 +119,7 @@ class CPUCore:
 		self.processmemory = processmemory
 		self.pname = name
 		self.tid = tid
+		self.encoding = processmemory.encoding
 
 		self.registers = {'RAX' : Register('RAX', 8), # RAX (Accumulator register)
 						  'RCX' : Register('RCX', 8), # RCX (Count register)
@@ -149,6 +159,9 @@ class CPUCore:
 		self.registers['RSP'].set_data(int.to_bytes(processmemory.ss, 4, byteorder='little'), 4)
 		self.registers['RBP'].set_data(int.to_bytes(processmemory.ss, 4, byteorder='little'), 4)
 
+		# Start at the entry point
+		self.registers['RIP'].set_data(int.to_bytes(processmemory.entry, 4, byteorder='little'), 4)
+
 		self.error = False
 
 	def get(self, src):
@@ -1646,6 +1659,37 @@ class CPUCore:
 			mem_len = self.handle_output(self.get(mem_len_arg))
 
 			return (0, ('pmem', (mem_pid, mem_start, mem_len)))
+		elif self.encoding != 2:
+			return (14, "Not a supported data type.")
+		elif arg_type > 0x30 and arg_type < 0x40:  # Small intermediate value
+			# Get the first byte, as the rest are zeros
+			int_data = self.handle_output(self.get_current_code_bytes(1))
+			self.inc_rip(1)
+
+			return (0, ('const', (int_data + bytes(arg_type - 0x31),)))
+		elif arg_type >= 0x10 and arg_type < 0x20:  # Short intermediate value
+			# Get data, with the length in the type
+			int_data = self.handle_output(self.get_current_code_bytes(arg_type - 0x10))
+			self.inc_rip(arg_type - 0x10)
+
+			return (0, ('const', (int_data,)))
+		elif arg_type == 8:  # Register with a fixed start and length
+			# Get register suffix, start and length
+			reg_data = self.handle_output(self.get_current_code_bytes(3))
+			self.inc_rip(3)
+			reg_suf = list(self.registers.keys())[reg_data[0]][1 : ]
+
+			return (0, ('reg', (reg_suf, reg_data[1 : 2], reg_data[2 : 3])))
+		elif arg_type == 9:  # Memory with a fixed length
+			# Get offset
+			mem_start_arg = self.handle_output(self.parse_argument())
+			mem_start = self.handle_output(self.get(mem_start_arg))
+
+			# Get length
+			mem_len = self.handle_output(self.get_current_code_bytes(1))
+			self.inc_rip(1)
+
+			return (0, ('mem', (mem_start, mem_len)))
 		else:
 			return (14, "Not a supported data type.")
 
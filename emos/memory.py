@@ -25,11 +25,48 @@ class MemorySection:
 		self.name = name
 		self.size = size
 		self.data = bytearray(data)
+		# Reference count shared with copy-on-write forks, or None if the data is not shared
+		self.shared = None
+
+	def fork(self):
+
+		"""Create a copy-on-write copy of the memory section. The data is shared until either section is written to."""
+
+		section = copy.copy(self)
+		if self.shared == None:
+			self.shared = [1]
+		self.shared[0] += 1
+		section.shared = self.shared
+		return section
+
+	def __del__(self):
+
+		"""Stop sharing the data with any forks when the memory section is deleted."""
+
+		self.release()
+
+	def release(self):
+
+		"""Stop sharing the data with any forks, without copying it. To be called before the data is replaced."""
+
+		if self.shared != None:
+			self.shared[0] -= 1
+			self.shared = None
+
+	def unshare(self):
+
+		"""Make sure the data is owned by this memory section, copying it if it is still shared with a fork. To be called before the data is modified in place."""
+
+		if self.shared != None:
+			if self.shared[0] > 1:
+				self.data = bytearray(self.data)
+			self.release()
 
 	def set_data(self, data):
 
 		"""Set the data."""
 
+		self.release()
 		self.data = bytearray(data)
 		self.size = len(data)
 		return (0, None)
@@ -41,6 +78,7 @@ class MemorySection:
 		if self.size < 4:
 			# Size is less than 4
 			return (3, "Stack is not large enough.")
+		self.unshare()
 		data = self.data[-4 : ]
 		del self.data[-4 : ]
 		self.size -= 4
@@ -48,9 +86,10 @@ class MemorySection:
 
 	def push(self, data):
 
-		"""Push bytes onto the memory."""
+		"""Push bytes onto the memory, appending them in place."""
 
-		self.data = self.data + data
+		self.unshare()
+		self.data += data
 		self.size += len(data)
 		return (0, None)
 
@@ -65,6 +104,7 @@ class MemorySection:
 		if self.size < n:
 			# Size is less than n
 			return (3, "Stack is not large enough.")
+		self.unshare()
 		data = self.data[-n : ]
 		del self.data[-n : ]
 		self.size -= n
@@ -72,11 +112,12 @@ class MemorySection:
 
 	def removebytes(self, numbytes):
 
-		"""Remove numbytes bytes from the end of the memory."""
+		"""Remove numbytes bytes from the end of the memory, truncating it in place."""
 
 		if self.size < numbytes:
 			return (4, "Not enough memory to remove.")
-		self.data = self.data[ : self.size - numbytes]
+		self.unshare()
+		del self.data[self.size - numbytes : ]
 		self.size -= numbytes
 		return (0, None)
 
@@ -91,17 +132,65 @@ class MemorySection:
 
 		return (0, self.data[offset : offset + numbytes])
 
+	def get_view(self, offset, numbytes):
+
+		"""Get a read-only view of bytes in the memory section, without copying them. The view must be released before the section is resized.
+		   Args: offset -> beginning offset
+		         numbytes -> number of bytes to get"""
+
+		if offset + numbytes > self.size:
+			return (5, "Offset is not in memory.")
+
+		return (0, memoryview(self.data)[offset : offset + numbytes].toreadonly())
+
+	def get_cstring(self, offset):
+
+		"""Get a null-terminated string from the memory section, not including the null byte.
+		   Args: offset -> beginning offset"""
+
+		end = self.data.find(b'\x00', offset)
+		if end == -1:
+			return (5, "Offset is not in memory.")
+
+		return (0, self.data[offset : end])
+
+	def get_lstring(self, offset):
+
+		"""Get a length-prefixed string from the memory section, where the data follows a 4 byte length.
+		   Args: offset -> beginning offset"""
+
+		exitcode, length = self.get_bytes(offset, 4)
+		if exitcode != 0:
+			return (exitcode, length)
+
+		return self.get_bytes(offset + 4, int.from_bytes(length, byteorder='little'))
+
 	def set_bytes(self, offset, data):
 
-		"""Set data to the memory section.
+		"""Set data to the memory section, overwriting it in place.
 		   Args: offset -> offset to begin setting data at
 		         data -> data to set"""
 
 		if offset + len(data) > self.size:
 			return (5, "Offset is not in memory.")
 
-		self.data = self.data[ : offset] + data + self.data[offset + len(data) : ]
-		self.size += len(data)
+		self.unshare()
+		self.data[offset : offset + len(data)] = data
+
+		return (0, None)
+
+	def write(self, offset, data):
+
+		"""Write data to the memory section in place, growing the section if needed. Growth is amortized by the underlying bytearray.
+		   Args: offset -> offset to begin writing data at, which may be past the end of the section (the gap is padded with zero bytes)
+		         data -> data to write"""
+
+		self.unshare()
+		if offset > self.size:
+			# Pad with zero bytes
+			self.data += bytes(offset - self.size)
+		self.data[offset : offset + len(data)] = data
+		self.size = len(self.data)
 
 		return (0, None)
 
@@ -118,17 +207,295 @@ class MemorySection:
 		return self.__repr__()
 
 
+class MappedMemorySection(MemorySection):
+
+	"""A memory section backed by a memory-mapped host file. Pages are loaded on demand by the host, and written back to the file on sync. Usually heap managed by the OS."""
+
+	def __init__(self, name, path, readonly=False):
+
+		"""Create a memory-mapped memory section.
+		   Args: name -> the name of the memory section
+		         path -> the path to the host file
+		         readonly -> should the file be mapped as read-only"""
+
+		self.name = name
+		self.path = path
+		self.readonly = readonly
+		self.shared = None
+
+		self.file = open(path, 'rb' if readonly else 'r+b')
+		self.size = os.fstat(self.file.fileno()).st_size
+		# Empty files cannot be mapped, so they are mapped on their first write
+		self.data = self.map() if self.size else b''
+
+	def map(self):
+
+		"""Map the host file into memory."""
+
+		return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE)
+
+	def resize(self, size):
+
+		"""Resize the section and the host file.
+		   Args: size -> the new size"""
+
+		if self.size:
+			self.data.resize(size)
+		else:
+			self.file.truncate(size)
+			self.data = self.map()
+		self.size = size
+
+	def set_data(self, data):
+
+		"""Set the data."""
+
+		if self.readonly:
+			return (45, "Memory is read-only.")
+
+		if len(data) != self.size:
+			self.resize(len(data))
+		self.data[ : ] = data
+		return (0, None)
+
+	def get_view(self, offset, numbytes):
+
+		"""Get a copy of bytes in the memory section. A view into the map would stop it from being resized or closed, so the bytes are always copied.
+		   Args: offset -> beginning offset
+		         numbytes -> number of bytes to get"""
+
+		if offset + numbytes > self.size:
+			return (5, "Offset is not in memory.")
+
+		return (0, memoryview(self.data[offset : offset + numbytes]))
+
+	def write(self, offset, data):
+
+		"""Write data to the section in place, growing the section and the host file if needed.
+		   Args: offset -> offset to begin writing data at, which may be past the end of the section (the gap is padded with zero bytes)
+		         data -> data to write"""
+
+		if self.readonly:
+			return (45, "Memory is read-only.")
+
+		if offset + len(data) > self.size:
+			self.resize(offset + len(data))
+		self.data[offset : offset + len(data)] = data
+
+		return (0, None)
+
+	def sync(self):
+
+		"""Write the changed pages back to the host file."""
+
+		if self.size and not self.readonly:
+			self.data.flush()
+		return (0, None)
+
+	def close(self):
+
+		"""Sync and unmap the host file."""
+
+		self.sync()
+		if self.size:
+			self.data.close()
+		self.file.close()
+		return (0, None)
+
+	def __repr__(self):
+
+		"""Get the string representation of the memory."""
+
+		return "<MappedMemorySection " + str(self.name) + " " + self.path + ">"
+
+
+class Arena:
+
+	"""A heap memory allocator. Allocations are carved out of a single heap memory section using size classes and free lists. Managed by the OS."""
+
+	# Allocations up to this size are rounded up to a power of two, larger ones to a multiple of it
+	MAX_SMALL_SIZE = 4096
+	MIN_SIZE = 8
+
+	def __init__(self, memory, section):
+
+		"""Create the arena.
+		   Args: memory -> the memory the section is in
+		         section -> the heap memory section to allocate from"""
+
+		self.memory = memory
+		self.section = section
+
+		# Free offsets for each block size. Adjacent free blocks are merged, so a block may be larger than any size class
+		self.free_lists = {}
+		# Size of the free block at each offset, and the offset of the free block ending at each offset
+		self.free_starts = {}
+		self.free_ends = {}
+		# Size class of each allocated offset
+		self.allocations = {}
+		self.used = 0
+		# End of the carved out part of the section. Anything after it was preallocated and is still free
+		self.top = 0
+
+	def get_size_class(self, size):
+
+		"""Get the size class an allocation of size bytes is rounded up to.
+		   Args: size -> the size of the allocation"""
+
+		if size <= self.MIN_SIZE:
+			return self.MIN_SIZE
+		if size <= self.MAX_SMALL_SIZE:
+			return 1 << (size - 1).bit_length()
+		return -(-size // self.MAX_SMALL_SIZE) * self.MAX_SMALL_SIZE
+
+	def malloc(self, size):
+
+		"""Allocate size bytes, returning the offset of the allocation.
+		   Args: size -> the number of bytes to allocate"""
+
+		size_class = self.get_size_class(size)
+
+		# Find the smallest free block that is large enough
+		free_sizes = [free_size for free_size, offsets in self.free_lists.items() if free_size >= size_class and offsets]
+		if free_sizes:
+			# Reuse a freed block, splitting off the rest of it
+			free_size = min(free_sizes)
+			offset = next(iter(self.free_lists[free_size]))
+			self.remove_free(offset)
+			if free_size > size_class:
+				self.add_free(offset + size_class, free_size - size_class)
+		elif self.top + size_class <= self.section.size:
+			# Carve out of the preallocated part of the section
+			offset = self.top
+			self.top += size_class
+		else:
+			# Grow the section
+			exitcode = self.memory.reserve(self.top + size_class - self.section.size)
+			if exitcode[0] != 0:
+				return exitcode
+			offset = self.top
+			self.section.write(self.section.size, bytes(self.top + size_class - self.section.size))
+			self.top += size_class
+
+		self.allocations[offset] = size_class
+		self.used += size_class
+		return (0, offset)
+
+	def realloc(self, offset, size):
+
+		"""Resize the allocation at offset to size bytes, returning the new offset. The allocation is resized in place if possible.
+		   Args: offset -> the offset of the allocation
+		         size -> the new size of the allocation"""
+
+		if not offset in self.allocations:
+			return (43, "Allocation does not exist.")
+
+		size_class = self.allocations[offset]
+
+		if size <= size_class:
+			# Already large enough
+			return (0, offset)
+
+		new_size_class = self.get_size_class(size)
+
+		if offset + size_class == self.top:
+			# Last block in the section, so grow it in place
+			grow = max(offset + new_size_class - self.section.size, 0)
+			exitcode = self.memory.reserve(grow)
+			if exitcode[0] != 0:
+				return exitcode
+			self.section.write(self.section.size, bytes(grow))
+			self.top = offset + new_size_class
+			self.allocations[offset] = new_size_class
+			self.used += new_size_class - size_class
+			return (0, offset)
+
+		# Move the allocation
+		exitcode, new_offset = self.malloc(size)
+		if exitcode != 0:
+			return (exitcode, new_offset)
+		self.section.write(new_offset, self.section.data[offset : offset + size_class])
+		self.free(offset)
+
+		return (0, new_offset)
+
+	def free(self, offset):
+
+		"""Free the allocation at offset.
+		   Args: offset -> the offset of the allocation"""
+
+		if not offset in self.allocations:
+			return (43, "Allocation does not exist.")
+
+		size_class = self.allocations.pop(offset)
+		self.add_free(offset, size_class)
+		self.used -= size_class
+
+		return (0, None)
+
+	def add_free(self, offset, size):
+
+		"""Add a free block, merging it with the free blocks next to it. A free block at the end of the carved out part of the section is given back by lowering the top.
+		   Args: offset -> the offset of the block
+		         size -> the size of the block"""
+
+		# Merge with the free block after it
+		if offset + size in self.free_starts:
+			size += self.remove_free(offset + size)
+		# Merge with the free block before it
+		if offset in self.free_ends:
+			previous = self.free_ends[offset]
+			size += self.remove_free(previous)
+			offset = previous
+
+		if offset + size == self.top:
+			# Shrink the carved out part of the section
+			self.top = offset
+			return
+
+		self.free_lists.setdefault(size, set()).add(offset)
+		self.free_starts[offset] = size
+		self.free_ends[offset + size] = offset
+
+	def remove_free(self, offset):
+
+		"""Remove the free block at offset, returning its size.
+		   Args: offset -> the offset of the block"""
+
+		size = self.free_starts.pop(offset)
+		del self.free_ends[offset + size]
+		self.free_lists[size].discard(offset)
+		if not self.free_lists[size]:
+			del self.free_lists[size]
+		return size
+
+	def __repr__(self):
+
+		"""Get the string representation of the arena."""
+
+		return "<Arena " + hex(self.used) + " of " + hex(self.section.size) + " used>"
+
+	def __str__(self):
+
+		"""Get the string representation of the arena."""
+
+		return self.__repr__()
+
+
 class ProcessMemory:
 
 	"""Memory set for a process. Similar to virtual memory, as all data pointers will be continuous. Managed by the CPU and the OS."""
 
-	def __init__(self, code, data, stack, maxsize=MAXPROCESSMEMORY):
+	def __init__(self, code, data, stack, maxsize=MAXPROCESSMEMORY, encoding=1, stack_size=0, entry=0):
 
 		"""Create a chunk of memory for a process.
 		   Args: code -> code section
 		   		 data -> data section
 		   		 stack -> stack section
-		   		 maxsize -> maximum process memory"""
+		   		 maxsize -> maximum process memory
+		   		 encoding -> the instruction encoding of the code section
+		   		 stack_size -> number of bytes of stack reserved for the process
+		   		 entry -> offset in the code section to start running at"""
 
 		self.code = MemorySection('code', len(code), code)
 		self.data = MemorySection('data', len(data), data)
@@ -138,6 +505,25 @@ class ProcessMemory:
 		self.ss = self.ds + len(self.data.data)
 		self.es = self.ss + len(self.stack.data)
 		self.maxsize = maxsize
+		self.encoding = encoding
+		self.stack_size = stack_size
+		self.entry = entry
+
+	def get_reserved_size(self):
+
+		"""Get the size of the process memory, including the reserved stack."""
+
+		return max(self.es, self.ss + self.stack_size)
+
+	def fork(self):
+
+		"""Create a copy-on-write copy of the process memory. The code, data and stack sections are shared until they are written to."""
+
+		processmemory = copy.copy(self)
+		processmemory.code = self.code.fork()
+		processmemory.data = self.data.fork()
+		processmemory.stack = self.stack.fork()
+		return processmemory
 
 	def get_byte(self, offset):
 
@@ -157,21 +543,80 @@ class ProcessMemory:
 		elif offset >= self.es:
 			return (5, "Offset is not in memory.")
 
+	def get_sections(self):
+
+		"""Get the code, data and stack sections along with their starting offsets."""
+
+		return ((self.code, self.cs), (self.data, self.ds), (self.stack, self.ss))
+
 	def get_bytes(self, offset, numbytes):
 
 		"""Get bytes from the memory.
 		   Args: offset -> offset to start at
 		   		 numbytes -> number of bytes to get"""
 
-		data = bytearray(numbytes)
+		if offset < 0 or offset + numbytes > self.es:
+			return (5, "Offset is not in memory.")
+
+		data = bytearray()
 
-		for i in range(offset, offset + numbytes):
-			exitcode, currentbyte = self.get_byte(i)
-			if exitcode != 0:
-				return (exitcode, currentbyte)
-			data[i - offset] = currentbyte
+		# Copy the part of each section the bytes are in
+		for section, start in self.get_sections():
+			end = start + len(section.data)
+			if offset < end and offset + numbytes > start:
+				data += section.data[max(offset, start) - start : min(offset + numbytes, end) - start]
 		return (0, data)
 
+	def get_view(self, offset, numbytes):
+
+		"""Get a read-only view of bytes from the memory. The bytes are not copied unless they span more than one section. The view must be released before the section is resized.
+		   Args: offset -> offset to start at
+		   		 numbytes -> number of bytes to get"""
+
+		for section, start in self.get_sections():
+			if start <= offset and offset + numbytes <= start + len(section.data):
+				return section.get_view(offset - start, numbytes)
+
+		exitcode, data = self.get_bytes(offset, numbytes)
+		if exitcode != 0:
+			return (exitcode, data)
+		return (0, memoryview(data))
+
+	def get_cstring(self, offset):
+
+		"""Get a null-terminated string from the memory, not including the null byte.
+		   Args: offset -> offset to start at"""
+
+		if offset < 0:
+			return (5, "Offset is not in memory.")
+
+		data = bytearray()
+
+		# Search each section from the offset onwards for the null byte
+		for section, start in self.get_sections():
+			end = start + len(section.data)
+			if offset >= end:
+				continue
+			begin = max(offset, start) - start
+			null_index = section.data.find(b'\x00', begin)
+			if null_index != -1:
+				data += section.data[begin : null_index]
+				return (0, data)
+			data += section.data[begin : ]
+
+		return (5, "Offset is not in memory.")
+
+	def get_lstring(self, offset):
+
+		"""Get a length-prefixed string from the memory, where the data follows a 4 byte length.
+		   Args: offset -> offset to start at"""
+
+		exitcode, length = self.get_bytes(offset, 4)
+		if exitcode != 0:
+			return (exitcode, length)
+
+		return self.get_bytes(offset + 4, int.from_bytes(length, byteorder='little'))
+
 	def set_byte(self, data, offset):
 
 		"""Set the byte at offset offset to data data.
@@ -186,17 +631,19 @@ class ProcessMemory:
 			return (7, "Cannot write to code section.")
 		elif offset - self.ss < 0:
 			# Data section
+			self.data.unshare()
 			self.data.data[offset - self.ds] = bytearray(data)[0]
 			return (0, None)
 		elif offset - self.es < 0:
 			# Stack section
+			self.stack.unshare()
 			self.stack.data[offset - self.ss] = bytearray(data)[0]
 			return (0, None)
 		else:
 			# Not in range
 			to_add = bytearray(offset - self.es) + bytearray(data)
 			self.es += len(to_add)
-			return self.stack.set_data(self.stack.data + to_add)
+			return self.stack.push(to_add)
 			
 	def set_bytes(self, data, offset):
 
@@ -204,10 +651,23 @@ class ProcessMemory:
 		   Args: data -> data to add
 		   		 offset -> offset to start at"""
 
-		for i in range(len(data)):
-			exitcode, message = self.set_byte(bytearray([data[i]]), offset + i)
-			if exitcode != 0:
-				return (exitcode, message)
+		end = offset + len(data)
+
+		if (end > self.es) and (end > self.maxsize):
+			return (6, "Not enough memory.")
+		if offset - self.ds < 0:
+			# Code section
+			return (7, "Cannot write to code section.")
+		if offset - self.ss < 0:
+			# Data section
+			data_end = min(end, self.ss)
+			self.data.unshare()
+			self.data.data[offset - self.ds : data_end - self.ds] = data[ : data_end - offset]
+		if end > self.ss:
+			# Stack section, growing it if the data goes past the end
+			stack_start = max(offset, self.ss)
+			self.stack.write(stack_start - self.ss, data[stack_start - offset : ])
+			self.es = self.ss + self.stack.size
 
 		return (0, None)
 
@@ -301,7 +761,7 @@ class Memory:
 		self.memorypartitions[name] = memorypartition
 		self.recalculate_length()
 		if self.size > self.maxsize:
-			self.delete_process(name)
+			self.delete_memory_partition(name)
 			return (11, "Not enough memory.")
 		return (0, None)
 
@@ -334,18 +794,29 @@ class Memory:
 
 		return (0, None)
 
+	def reserve(self, size):
+
+		"""Account for a memory partition growing in place by size bytes.
+		   Args: size -> number of bytes the partition is growing by"""
+
+		if self.size + size > self.maxsize:
+			return (11, "Not enough memory.")
+
+		self.size += size
+		return (0, None)
+
 	def recalculate_length(self):
 
 		"""Recalculate the size of the memory."""
 
 		size = 0
 		for name, memorypartition in self.memorypartitions.items():
-			if type(memorypartition) == MemorySection:
+			if isinstance(memorypartition, MemorySection):
 				# Memory section, so use size
 				size += memorypartition.size
 			elif type(memorypartition) == ProcessMemory:
-				# Process memory, so use es
-				size += memorypartition.es
+				# Process memory, so use es or the end of the reserved stack
+				size += memorypartition.get_reserved_size()
 
 		self.size = size
 		return (0, self.size)
@@ -362,13 +833,13 @@ class Memory:
 			# Check if the current base works
 			if type(memorypartition) == ProcessMemory:
 				currentOffset -= memorypartition.es
-			elif type(memorypartition) == MemorySection:
+			elif isinstance(memorypartition, MemorySection):
 				currentOffset -= memorypartition.size
 
 			if currentOffset <= 0:
 				if type(memorypartition) == ProcessMemory:
 					return memorypartition.get_byte(lastOffset)
-				elif type(memorypartition) == MemorySection:
+				elif isinstance(memorypartition, MemorySection):
 					return (0, memorypartition.data[lastOffset])
 				
 		# Not in memory
@@ -387,13 +858,14 @@ class Memory:
 			# Check if the current base works
 			if type(memorypartition) == ProcessMemory:
 				currentOffset -= memorypartition.es
-			elif type(memorypartition) == MemorySection:
+			elif isinstance(memorypartition, MemorySection):
 				currentOffset -= memorypartition.size
 			# Set the byte
 			if currentOffset <= 0:
 				if type(memorypartition) == ProcessMemory:
 					return self.memorypartitions[name].set_byte(lastOffset, byte)
-				elif type(memorypartition) == MemorySection:
+				elif isinstance(memorypartition, MemorySection):
+					self.memorypartitions[name].unshare()
 					self.memorypartitions[name].data[lastOffset] = byte
 					return (0, None)
 
@@ -18,6 +18,12 @@ import emos.parse
 import hashlib
 import json
 import struct
+import mmap
+import zlib
+import lzma
+import collections
+import shutil
+import io
 import numpy as np
 import multiprocessing
 
@@ -27,6 +33,17 @@ MAXPROCESSMEMORY = 2 ** 32 - 1
 MAXMEMORY = 2 ** 32 - 1
 ENCODING = 'utf-8'
 INVALID_FILENAME_CHARS = ['\n', '\b', '\t', '\r', '"', '\'']
+JOURNAL_MAX_SIZE = 2 ** 22
+JOURNAL_OPERATIONS = ('write_file', 'write_files', 'write_file_range', 'copy_file', 'delete_file', 'rename_file', 'create_directory', 'delete_directory')
+BLOB_CHUNK_SIZE = 2 ** 16
+PATH_CACHE_SIZE = 4096
+BLOB_CACHE_SIZE = 2 ** 24
+COMPRESSION_METHODS = {None : 0, 'zlib' : 1, 'lzma' : 2}
+DISK_IMAGE_MAGIC = b'EMOSDISK'
+FLUSH_INTERVAL = 1.0
+DISK_IMAGE_HEADER = '<8sQQ'
+STDOUT_SIZE = 2 ** 20
+TERMINAL_FPS = 30
 FILEPATH = os.path.dirname(__file__)
 
 
@@ -78,6 +95,25 @@ def clear():
 	os.system('cls' if os.name == 'nt' else 'clear')
 
 
+def write_output(buffer, data):
+
+	"""Add data to the end of an output buffer in place, handling backspaces.
+	   Args: buffer -> the bytearray to add to
+	         data -> the data to add"""
+
+	data = bytes(data)
+	if not b'\b' in data:
+		buffer += data
+		return
+
+	# Each backspace deletes the last char before the text after it is added
+	parts = data.split(b'\b')
+	buffer += parts[0]
+	for part in parts[1 : ]:
+		del buffer[-1 : ]
+		buffer += part
+
+
 def write(string):
 
 	"""Write the string to standard out.
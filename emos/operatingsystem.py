@@ -28,7 +28,14 @@ class OperatingSystem:
 		self.computer = computer
 		self.has_password = has_password
 
-		self.mem_alloc_ids = []
+		self.mem_alloc_ids = set()
+		# Freed memory IDs to reuse, and the next never used memory ID
+		self.mem_free_ids = []
+		self.mem_next_id = 0
+		# Heap memory IDs that are used as allocator arenas, and their arenas
+		self.arenas = {}
+		# Heap memory IDs that are mapped to EMOS files, and their paths
+		self.mapped_files = {}
 
 		self.process_ids = []
 		self.processes = {}
@@ -48,6 +55,12 @@ class OperatingSystem:
 
 		self.log = ''
 
+		# Cache of compiled code for the compile command
+		self.compile_cache = emos.parse.CompileCache()
+
+		# Host directory to move old process output to, or None to discard it
+		self.stdout_spill = None
+
 	def set_cmd_handler(self, cmdhandler):
 
 		"""Set the current command handler. This is optional.
@@ -55,6 +68,20 @@ class OperatingSystem:
 
 		self.cmdhandler = cmdhandler
 
+	def set_compile_cache(self, compile_cache):
+
+		"""Set the cache used to compile code, i.e. to keep compiled code in a host directory across runs.
+		   Args: compile_cache -> the emos.parse.CompileCache to use"""
+
+		self.compile_cache = compile_cache
+
+	def set_stdout_spill(self, directory):
+
+		"""Set the host directory that process output past the STDOut size is moved to, or None to discard it.
+		   Args: directory -> the host directory to use"""
+
+		self.stdout_spill = directory
+
 	def set_max_thread_operations(self, max_operations_per_thread):
 
 		"""Set the maximum number of operations each thread gets to run per iteration, if no IO is involved.
@@ -62,20 +89,27 @@ class OperatingSystem:
 
 		self.max_operations_per_thread = max_operations_per_thread
 
-	def allocate_memory(self):
+	def allocate_memory(self, memorysection=None):
 
-		"""Allocate memory, returning the memory id."""
+		"""Allocate memory, returning the memory id.
+		   Args: memorysection -> the memory section to use, or None for an empty section"""
 
-		for i in range(max(self.mem_alloc_ids) if self.mem_alloc_ids else 0):
-			if not i in self.mem_alloc_ids:
-				# This id is free
-				current_mem_id = i
-				break
-		# No holes, so add a new id
-		current_mem_id = (max(self.mem_alloc_ids) if self.mem_alloc_ids else -1) + 1
-
-		self.computer.memory.add_memory_partition(('mem', current_mem_id), MemorySection(('mem', current_mem_id), 0, bytearray()))
-		self.mem_alloc_ids.append(current_mem_id)
+		if self.mem_free_ids:
+			# Reuse a freed id
+			current_mem_id = self.mem_free_ids.pop()
+		else:
+			# No holes, so add a new id
+			current_mem_id = self.mem_next_id
+			self.mem_next_id += 1
+
+		if memorysection == None:
+			memorysection = MemorySection(('mem', current_mem_id), 0, bytearray())
+
+		exitcode = self.computer.memory.add_memory_partition(('mem', current_mem_id), memorysection)
+		if exitcode[0] != 0:
+			self.mem_free_ids.append(current_mem_id)
+			return exitcode
+		self.mem_alloc_ids.add(current_mem_id)
 		return (0, current_mem_id)
 
 	def free_memory(self, mem_id):
@@ -86,8 +120,15 @@ class OperatingSystem:
 		if not mem_id in self.mem_alloc_ids:
 			return (19, "Memory ID does not exist.")
 
+		# Memory mapped to an EMOS file is not written back, so syncing is the only way to write to the file. Host files are unmapped
+		if isinstance(self.computer.memory.memorypartitions[('mem', mem_id)], MappedMemorySection):
+			self.computer.memory.memorypartitions[('mem', mem_id)].close()
+
 		# Free the memory
 		self.mem_alloc_ids.remove(mem_id)
+		self.mem_free_ids.append(mem_id)
+		self.arenas.pop(mem_id, None)
+		self.mapped_files.pop(mem_id, None)
 		self.computer.memory.delete_memory_partition(('mem', mem_id))
 
 		return (0, None)
@@ -121,28 +162,162 @@ class OperatingSystem:
 		   		 data -> data to edit to
 		   		 start_offset -> starting offset"""
 
-		# Get size
-		exitcode, size = self.get_memory_size(mem_id)
+		if not mem_id in self.mem_alloc_ids:
+			return (19, "Memory ID does not exist.")
+
+		partition = self.computer.memory.memorypartitions[('mem', mem_id)]
+
+		# Make sure the memory can hold the partition's growth
+		exitcode = self.computer.memory.reserve(max(start_offset + len(data) - partition.size, 0))
+		if exitcode[0] != 0:
+			return exitcode
+
+		# Write the data in place, padding with zero bytes if it starts out of bounds
+		return partition.write(start_offset, data)
+
+	def map_host_file(self, path, readonly=False):
+
+		"""Map a host file into heap memory, returning the memory id. The file's pages are loaded on demand.
+		   Args: path -> the path to the host file
+		         readonly -> should the file be mapped as read-only"""
+
+		try:
+			memorysection = MappedMemorySection(None, path, readonly)
+		except OSError:
+			return (32, "Path is invalid.")
+
+		exitcode, mem_id = self.allocate_memory(memorysection)
+		if exitcode != 0:
+			memorysection.close()
+			return (exitcode, mem_id)
+
+		memorysection.name = ('mem', mem_id)
+		return (0, mem_id)
+
+	def map_file(self, path):
+
+		"""Load an EMOS file into heap memory, returning the memory id. The memory is written back to the file on sync.
+		   Args: path -> the path to the file"""
+
+		exitcode, data = self.computer.filesystem.read_file(path)
+		if exitcode != 0:
+			return (exitcode, data)
+
+		exitcode, mem_id = self.allocate_memory(MemorySection(None, len(data), data))
 		if exitcode != 0:
-			return (exitcode, size)
+			return (exitcode, mem_id)
 
-		# Get data
-		exitcode, current_data = self.get_memory(mem_id, 0, size)
+		self.computer.memory.memorypartitions[('mem', mem_id)].name = ('mem', mem_id)
+		self.mapped_files[mem_id] = path
+		return (0, mem_id)
+
+	def sync_memory(self, mem_id):
+
+		"""Write heap memory mem_id back to the file it is mapped to.
+		   Args: mem_id -> memory id"""
+
+		if not mem_id in self.mem_alloc_ids:
+			return (19, "Memory ID does not exist.")
+
+		partition = self.computer.memory.memorypartitions[('mem', mem_id)]
+
+		if mem_id in self.mapped_files:
+			# EMOS file
+			return self.computer.filesystem.write_file(self.mapped_files[mem_id], bytes(partition.data))
+		elif isinstance(partition, MappedMemorySection):
+			# Host file
+			return partition.sync()
+
+		return (46, "Memory is not mapped to a file.")
+
+	def create_arena(self, size=0):
+
+		"""Allocate heap memory to use as an allocator arena, returning the memory id.
+		   Args: size -> the number of bytes to preallocate for the arena"""
+
+		exitcode, mem_id = self.allocate_memory(MemorySection(None, size, bytearray(size)) if size else None)
 		if exitcode != 0:
-			return (exitcode, current_data)
-
-		# Too large, but starts within bounds
-		if start_offset + len(data) > size and start_offset < size:
-			new_data = current_data[ : start_offset] + data
-		# Too large, and starts out of bounds (padding with zero bytes)
-		elif start_offset + len(data) > size and start_offset > size:
-			new_data = current_data + bytes(start_offset - size) + data
-		# Within bounds
+			return (exitcode, mem_id)
+
+		self.arenas[mem_id] = Arena(self.computer.memory, self.computer.memory.memorypartitions[('mem', mem_id)])
+		return (0, mem_id)
+
+	def get_arena(self, mem_id):
+
+		"""Get the allocator arena at memory id mem_id.
+		   Args: mem_id -> memory id"""
+
+		if not mem_id in self.arenas:
+			return (44, "Memory ID is not an arena.")
+
+		return (0, self.arenas[mem_id])
+
+	def get_arena_totals(self):
+
+		"""Get the number of bytes allocated and the total size across all allocator arenas."""
+
+		return (0, (sum(arena.used for arena in self.arenas.values()), sum(arena.section.size for arena in self.arenas.values())))
+
+	def file_open(self, pid, path, mode):
+
+		"""Open a file for a process, returning the file descriptor.
+		   Args: pid -> the process ID
+		         path -> the full path to the file
+		         mode -> the mode to open the file in. 0 for reading, 1 for writing, 2 for appending and 3 for reading and writing"""
+
+		filesystem = self.computer.filesystem
+
+		if not mode in (0, 1, 2, 3):
+			return (50, "Invalid file mode.")
+
+		if mode == 1:
+			# Create or truncate the file
+			exitcode = filesystem.write_file(path, b'')
+		else:
+			exitcode = filesystem.get_file_size(path)
+			if exitcode[0] != 0 and mode == 2:
+				# Create the file
+				exitcode = filesystem.write_file(path, b'')
+		if exitcode[0] != 0:
+			return exitcode
+
+		# Use the lowest free file descriptor
+		open_files = self.processes[pid].open_files
+		handle = FileHandle(filesystem, path, mode)
+		if None in open_files:
+			fd = open_files.index(None)
+			open_files[fd] = handle
 		else:
-			# New data
-			new_data = current_data[ : start_offset] + data + current_data[start_offset + len(data) : ]
+			fd = len(open_files)
+			open_files.append(handle)
+
+		return (0, fd)
 
-		return self.computer.memory.edit_memory_partition(('mem', mem_id), MemorySection(self.computer.memory.memorypartitions[('mem', mem_id)].name, len(new_data), new_data))
+	def file_get(self, pid, fd):
+
+		"""Get the file handle for a process's file descriptor.
+		   Args: pid -> the process ID
+		         fd -> the file descriptor"""
+
+		open_files = self.processes[pid].open_files
+
+		if not (0 <= fd < len(open_files)) or open_files[fd] == None:
+			return (47, "Invalid file descriptor.")
+
+		return (0, open_files[fd])
+
+	def file_close(self, pid, fd):
+
+		"""Close a process's file descriptor.
+		   Args: pid -> the process ID
+		         fd -> the file descriptor"""
+
+		exitcode = self.file_get(pid, fd)
+		if exitcode[0] != 0:
+			return exitcode
+
+		self.processes[pid].open_files[fd] = None
+		return (0, None)
 
 	def process_create(self, process):
 
@@ -158,13 +333,37 @@ class OperatingSystem:
 		# No holes, so add a new PID
 		current_pid = (max(self.process_ids) if self.process_ids else -1) + 1
 
+		# Check the entry point is in the code section
+		if process.processmemory.entry != 0 and process.processmemory.entry >= len(process.processmemory.code.data):
+			return (55, "Entry point is outside of the code section.")
+
+		# Check the process fits in its memory, including the reserved stack and heap
+		if process.processmemory.get_reserved_size() + process.heap_size > process.processmemory.maxsize:
+			return (8, "Not enough memory to load the process.")
+
+		# Add the process to memory
+		exitcode = self.computer.memory.add_memory_partition(('proc', current_pid), process.processmemory)
+		if exitcode[0] != 0:
+			return exitcode
+
+		# Preallocate the heap
+		if process.heap_size:
+			exitcode = self.create_arena(process.heap_size)
+			if exitcode[0] != 0:
+				self.computer.memory.delete_memory_partition(('proc', current_pid))
+				return exitcode
+			process.heap = exitcode[1]
+
+		# Move old output to a file in the spill directory
+		if self.stdout_spill != None:
+			process.stdout.spill = os.path.join(self.stdout_spill, str(current_pid) + '.out')
+			if os.path.exists(process.stdout.spill):
+				os.remove(process.stdout.spill)
+
 		# Add the process
 		self.processes[current_pid] = process
 		self.process_ids.append(current_pid)
 
-		# Add the process to memory
-		self.computer.memory.add_memory_partition(('proc', current_pid), process.processmemory)
-
 		# Update the process
 		self.processes[current_pid].state = 'r'
 		self.processes[current_pid].pid = current_pid
@@ -220,6 +419,14 @@ class OperatingSystem:
 
 		del self.processes[pid].pid
 		self.process_ids.remove(pid)
+		# Free the heap if it was never claimed
+		if self.processes[pid].heap != None:
+			self.free_memory(self.processes[pid].heap)
+		# Close the process's files
+		self.processes[pid].open_files.clear()
+		# Remove the old output
+		if self.processes[pid].stdout.spill != None and os.path.exists(self.processes[pid].stdout.spill):
+			os.remove(self.processes[pid].stdout.spill)
 		del self.processes[pid]
 
 		self.computer.memory.delete_memory_partition(('proc', pid))
@@ -282,7 +489,17 @@ class OperatingSystem:
 		if not pid in self.process_ids:
 			return (20, "PID doesn't exist.")
 
-		return self.process_create(copy.deepcopy(self.processes[pid]))
+		# Create a copy-on-write copy of the process
+		process = self.processes[pid].fork()
+		exitcode = self.process_create(process)
+		if exitcode[0] != 0:
+			return exitcode
+
+		# Bind the dynamic libraries to the new process
+		for tid, thread in process.threads.items():
+			thread.dynamic_libraries = [library.fork(exitcode[1], tid) for library in thread.dynamic_libraries]
+
+		return exitcode
 
 	def thread_fork(self, pid, tid):
 
@@ -296,7 +513,16 @@ class OperatingSystem:
 		if not tid in self.processes[pid].threads:
 			return (21, "TID dosen't exist.")
 
-		return self.thread_create(pid, copy.deepcopy(self.processes[pid].threads[tid]))
+		# Create a copy-on-write copy of the thread
+		thread = self.processes[pid].threads[tid].fork()
+		exitcode = self.thread_create(pid, thread)
+		if exitcode[0] != 0:
+			return exitcode
+
+		# Bind the dynamic libraries to the new thread
+		thread.dynamic_libraries = [library.fork(pid, exitcode[1]) for library in thread.dynamic_libraries]
+
+		return exitcode
 
 	def thread_await(self, pid, tid):
 
@@ -333,23 +559,37 @@ class OperatingSystem:
 		"""Run executable data and load it, retuning the process.
 		   Args: data -> data to run"""
 
-		# Get the beginning data offset
-		data_offset = int.from_bytes(data[0 : 4], byteorder='little')
-		# Split the data
-		data = data[4 : ]
+		# Get the header
+		encoding = 1
+		bss_size, stack_size, heap_size, entry = 0, 0, 0, 0
+		if bytes(data[0 : 4]) == emos.parse.EXECUTABLE_MAGIC_EXTENDED:
+			# Extended header with the memory layout
+			header_size = struct.calcsize(emos.parse.EXECUTABLE_HEADER_EXTENDED)
+			magic, encoding, data_offset, bss_size, stack_size, heap_size, entry = struct.unpack(emos.parse.EXECUTABLE_HEADER_EXTENDED, bytes(data[0 : header_size]))
+			data = data[header_size : ]
+		elif bytes(data[0 : 4]) == emos.parse.EXECUTABLE_MAGIC:
+			# Header with the encoding and the beginning data offset
+			header_size = struct.calcsize(emos.parse.EXECUTABLE_HEADER)
+			magic, encoding, data_offset = struct.unpack(emos.parse.EXECUTABLE_HEADER, bytes(data[0 : header_size]))
+			data = data[header_size : ]
+		else:
+			# Original header, with just the beginning data offset
+			data_offset = int.from_bytes(data[0 : 4], byteorder='little')
+			data = data[4 : ]
 		# Get the code section
 		code_section = data[ : data_offset]
-		# Get the data section
-		data_section = data[data_offset : ]
+		# Get the data section, with the BSS zeroed at the end
+		data_section = bytearray(len(data) - data_offset + bss_size)
+		data_section[ : len(data) - data_offset] = data[data_offset : ]
 
 		# Create the process memory
-		processmemory = ProcessMemory(code_section, data_section, b'')
+		processmemory = ProcessMemory(code_section, data_section, b'', encoding=encoding, stack_size=stack_size, entry=entry)
 
 		# Create the thread
 		thread = PThread(0, MemorySection('stack', 0, b''), None)
 
 		# Create process
-		process = Process(processmemory, {0 : thread}, 't')
+		process = Process(processmemory, {0 : thread}, 't', heap_size=heap_size)
 		return process
 
 	def update_process_memory_global(self, pid, tid):
@@ -422,12 +662,13 @@ class OperatingSystem:
 				length = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
 				# Get the data
 				processmemory_use = self.processes[pid].get_processmemory_thread(tid)
-				exitcode, data = processmemory_use.get_bytes(begin_offset, length)
+				exitcode, data = processmemory_use.get_view(begin_offset, length)
 				if exitcode != 0:
 					exitcode = (exitcode, None)
 				else:
 					# Write the data to the STDOut
-					exitcode = self.processes[pid].stdout.write(data, self.terminal)
+					with data:
+						exitcode = self.processes[pid].stdout.write(data, self.terminal)
 			elif syscallid == 2:
 				# Read from the processes STDIn with the length in RBX and save it to the thread's stack
 				length = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
@@ -442,7 +683,11 @@ class OperatingSystem:
 					exitcode = (0, None)
 			elif syscallid == 3:
 				# Take input from the processes STDIn, echoing back. Puts the length of the data into RAX
-				exitcode, data = self.processes[pid].stdin.take_input(self.terminal)
+				if self.processes[pid].stdin.get_size() > 0:
+					# Read a line of the input data first
+					exitcode, data = self.processes[pid].stdin.readline(self.terminal)
+				else:
+					exitcode, data = self.processes[pid].stdin.take_input(self.terminal)
 				if exitcode != 0:
 					exitcode = (exitcode, None)
 				else:
@@ -483,9 +728,9 @@ class OperatingSystem:
 				exitcode = self.process_fork(pid)
 				if exitcode[0] == 0:
 					# Put the PID into RBX
-					self.processes[pid].threads[tid].registers['RAX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+					self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
 					# Set the other processes waiting attribute
-					self.processes[exitcode[1]].theads[tid].waiting = False
+					self.processes[exitcode[1]].threads[tid].waiting = False
 					# Give the new process the exit code
 					self.processes[exitcode[1]].threads[tid].registers['RAX'].data[0 : 4] = bytes(4)
 			elif syscallid == 6:
@@ -601,7 +846,7 @@ class OperatingSystem:
 					exitcode = (exitcode, None)
 			elif syscallid == 18:
 				# Get the size of the given STDIn data, putting the length into RBX
-				self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(len(self.processes[pid].stdin.data), 4, byteorder='little')
+				self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(self.processes[pid].stdin.get_size(), 4, byteorder='little')
 				exitcode = (0, None)
 			elif syscallid == 19:
 				# Await a processes completion with the PID in RBX
@@ -928,23 +1173,217 @@ class OperatingSystem:
 				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
 				# Get the data
 				processmemory_use = self.processes[pid].get_processmemory_thread(tid)
-				# Get each byte
-				i = begin_offset
-				data = ''
-				while True:
-					exitcode, byte = processmemory_use.get_bytes(i, 1)
+				exitcode, data = processmemory_use.get_cstring(begin_offset)
+				if exitcode != 0:
+					exitcode = (exitcode, None)
+				else:
+					# Write the data to the STDOut
+					exitcode = self.processes[pid].stdout.write(data, self.terminal)
+			elif syscallid == 41:
+				# Create an allocator arena in heap memory, putting the ID in RBX. The first arena is the preallocated heap, if there is one
+				if self.processes[pid].heap != None:
+					exitcode = (0, self.processes[pid].heap)
+					self.processes[pid].heap = None
+				else:
+					exitcode = self.create_arena()
+				if exitcode[0] == 0:
+					self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+					exitcode = (0, None)
+			elif syscallid == 42:
+				# Allocate RCX bytes in the arena with the ID in RBX, putting the offset of the allocation in RCX
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				s_size = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, arena = self.get_arena(s_id)
+				if exitcode != 0:
+					exitcode = (exitcode, arena)
+				else:
+					exitcode = arena.malloc(s_size)
+					if exitcode[0] == 0:
+						self.processes[pid].threads[tid].registers['RCX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+						exitcode = (0, None)
+			elif syscallid == 43:
+				# Resize the allocation at offset RCX in the arena with the ID in RBX to R9 bytes, putting the new offset in RCX
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				s_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				s_size = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, arena = self.get_arena(s_id)
+				if exitcode != 0:
+					exitcode = (exitcode, arena)
+				else:
+					exitcode = arena.realloc(s_offset, s_size)
+					if exitcode[0] == 0:
+						self.processes[pid].threads[tid].registers['RCX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+						exitcode = (0, None)
+			elif syscallid == 44:
+				# Free the allocation at offset RCX in the arena with the ID in RBX
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				s_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, arena = self.get_arena(s_id)
+				if exitcode != 0:
+					exitcode = (exitcode, arena)
+				else:
+					exitcode = arena.free(s_offset)
+			elif syscallid == 45:
+				# Get the memory statistics of the arena with the ID in RBX, putting the number of bytes allocated in RCX and the size of the arena in R9, and the totals across all arenas in R10 and R11
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, arena = self.get_arena(s_id)
+				if exitcode != 0:
+					exitcode = (exitcode, arena)
+				else:
+					self.processes[pid].threads[tid].registers['RCX'].data[0 : 4] = int.to_bytes(arena.used, 4, byteorder='little')
+					self.processes[pid].threads[tid].registers['R9'].data[0 : 4] = int.to_bytes(arena.section.size, 4, byteorder='little')
+					total_used, total_size = self.get_arena_totals()[1]
+					self.processes[pid].threads[tid].registers['R10'].data[0 : 4] = int.to_bytes(total_used, 4, byteorder='little')
+					self.processes[pid].threads[tid].registers['R11'].data[0 : 4] = int.to_bytes(total_size, 4, byteorder='little')
+					exitcode = (0, None)
+			elif syscallid == 46:
+				if self.processes[pid].security_level == 1:
+					exitcode = (40, "Invalid process security level.")
+				else:
+					# Map the file given by RBX and RCX into heap memory, putting the ID in RBX
+					begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+					length = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+					# Get the data
+					processmemory_use = self.processes[pid].get_processmemory_thread(tid)
+					exitcode, data = processmemory_use.get_bytes(begin_offset, length)
 					if exitcode != 0:
 						exitcode = (exitcode, None)
-						break
-					if byte == b'\x00':
+					else:
+						# Map the file
+						path = str(data, ENCODING)
+						if path.startswith('/') or path.startswith('\\'):
+							# Absolute path
+							fullpath = path
+						else:
+							# Relative path
+							fullpath = os.path.join(self.processes[pid].cmdhandler.current_working_dir, path)
+						exitcode = self.map_file(fullpath)
+						if exitcode[0] == 0:
+							self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+							exitcode = (0, None)
+			elif syscallid == 47:
+				if self.processes[pid].security_level == 1:
+					exitcode = (40, "Invalid process security level.")
+				else:
+					# Write the heap memory with the ID in RBX back to the file it is mapped to
+					s_id = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+					exitcode = self.sync_memory(s_id)
+			elif syscallid == 48:
+				# Open the file given by RBX and RCX in the mode given by R9, putting the file descriptor in RBX
+				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				length = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				mode = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				# Get the data
+				processmemory_use = self.processes[pid].get_processmemory_thread(tid)
+				exitcode, data = processmemory_use.get_bytes(begin_offset, length)
+				if exitcode != 0:
+					exitcode = (exitcode, None)
+				elif self.processes[pid].security_level == 1 and mode != 0:
+					exitcode = (40, "Invalid process security level.")
+				else:
+					# Open the file
+					path = str(data, ENCODING)
+					if path.startswith('/') or path.startswith('\\'):
+						# Absolute path
+						fullpath = path
+					else:
+						# Relative path
+						fullpath = os.path.join(self.processes[pid].cmdhandler.current_working_dir, path)
+					exitcode = self.file_open(pid, fullpath, mode)
+					if exitcode[0] == 0:
+						self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
+						exitcode = (0, None)
+			elif syscallid == 49:
+				# Close the file descriptor in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode = self.file_close(pid, fd)
+			elif syscallid == 50:
+				# Read up to R9 bytes from the file descriptor in RBX into the process memory at RCX, putting the number of bytes read in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				length = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, handle = self.file_get(pid, fd)
+				if exitcode != 0:
+					exitcode = (exitcode, handle)
+				else:
+					# Check the data fits in the process memory before reading it, so no data is lost from the file. The stack isn't grown
+					processmemory_use = self.processes[pid].get_processmemory_thread_writable(tid)
+					if begin_offset < processmemory_use.ds:
+						exitcode = (7, "Cannot write to code section.")
+					elif begin_offset + length > processmemory_use.es:
+						exitcode = (5, "Offset is not in memory.")
+					else:
+						exitcode = handle.read(length)
+						if exitcode[0] == 0:
+							# Write the data into the process memory
+							data = exitcode[1]
+							exitcode = processmemory_use.set_bytes(data, begin_offset)
+							if exitcode[0] == 0:
+								self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(len(data), 4, byteorder='little')
+			elif syscallid == 51:
+				# Write R9 bytes from the process memory at RCX to the file descriptor in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				length = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, handle = self.file_get(pid, fd)
+				if exitcode != 0:
+					exitcode = (exitcode, handle)
+				else:
+					# Get the data
+					processmemory_use = self.processes[pid].get_processmemory_thread(tid)
+					exitcode, data = processmemory_use.get_bytes(begin_offset, length)
+					if exitcode != 0:
+						exitcode = (exitcode, None)
+					else:
+						exitcode = handle.write(data)
+			elif syscallid == 52:
+				# Read up to R9 bytes from the file descriptor in RBX into the heap memory with the ID in R10 at offset RCX, putting the number of bytes read in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				length = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['R10'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, handle = self.file_get(pid, fd)
+				if exitcode != 0:
+					exitcode = (exitcode, handle)
+				elif not s_id in self.mem_alloc_ids:
+					exitcode = (19, "Memory ID does not exist.")
+				else:
+					exitcode = handle.read(length)
+					if exitcode[0] == 0:
+						# Write the data into the heap memory
+						data = exitcode[1]
+						exitcode = self.edit_memory(s_id, data, begin_offset)
+						if exitcode[0] == 0:
+							self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(len(data), 4, byteorder='little')
+			elif syscallid == 53:
+				# Write R9 bytes from the heap memory with the ID in R10 at offset RCX to the file descriptor in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				begin_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little')
+				length = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				s_id = int.from_bytes(self.processes[pid].threads[tid].registers['R10'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, handle = self.file_get(pid, fd)
+				if exitcode != 0:
+					exitcode = (exitcode, handle)
+				else:
+					# Get the data
+					exitcode, data = self.get_memory(s_id, begin_offset, length)
+					if exitcode != 0:
+						exitcode = (exitcode, data)
+					else:
+						exitcode = handle.write(data)
+			elif syscallid == 54:
+				# Move the position of the file descriptor in RBX to the signed offset in RCX, relative to the start of the file, the current position or the end of the file when R9 is 0, 1 or 2. Puts the new position in RBX
+				fd = int.from_bytes(self.processes[pid].threads[tid].registers['RBX'].get_bytes(0, 4)[1], byteorder='little')
+				s_offset = int.from_bytes(self.processes[pid].threads[tid].registers['RCX'].get_bytes(0, 4)[1], byteorder='little', signed=True)
+				whence = int.from_bytes(self.processes[pid].threads[tid].registers['R9'].get_bytes(0, 4)[1], byteorder='little')
+				exitcode, handle = self.file_get(pid, fd)
+				if exitcode != 0:
+					exitcode = (exitcode, handle)
+				else:
+					exitcode = handle.seek(s_offset, whence)
+					if exitcode[0] == 0:
+						self.processes[pid].threads[tid].registers['RBX'].data[0 : 4] = int.to_bytes(exitcode[1], 4, byteorder='little')
 						exitcode = (0, None)
-						break
-					data += str(byte, ENCODING)
-					i += 1
-				
-				if exitcode[0] == 0:
-					# Write the data to the STDOut
-					exitcode = self.processes[pid].stdout.write(bytes(data, ENCODING), self.terminal)
 			else:
 				exitcode = (30, "Invalid SYSCall.")
 
@@ -1146,7 +1585,7 @@ class OperatingSystem:
 		for peripheral_id, peripheral in self.computer.peripherals.items():
 			peripheral.start(peripheral_id)
 			# Check if the peripheral is a terminal screen
-			if type(peripheral) == TerminalScreen:
+			if isinstance(peripheral, TerminalScreen):
 				self.terminalID = peripheral_id
 
 		if self.terminalID == None:
@@ -1261,6 +1700,9 @@ class OperatingSystem:
 		for peripheral_id, peripheral in self.computer.peripherals.items():
 			peripheral.end()
 
+		# Write any changes to the file system that are still pending
+		self.computer.filesystem.sync()
+
 	def __repr__(self):
 
 		"""Get the string representation of the OS."""
@@ -1299,6 +1741,14 @@ class DynamicLibrary:
 		del self.pid
 		del self.tid
 
+	def fork(self, pid, tid):
+
+		"""Create a copy of the dynamic library for a forked process or thread.
+		   Args: pid -> the process ID the new library is for
+		         tid -> the thread ID the new library is for"""
+
+		return type(self)(self.operatingsystem, pid, tid)
+
 	def handle(self, call):
 
 		"""Handle a call.
@@ -1396,10 +1846,11 @@ class ProcessCMDHandler:
 
 			# Run the final command
 			# Check if the command is a file
-			directory_list = self.computer.filesystem.list_directory(self.current_working_dir)
-			if directory_list[0] != 0:
-				return directory_list
-			directory_list = directory_list[1].split('\n')
+			exitcode = self.computer.filesystem.get_type(self.current_working_dir)
+			if exitcode[0] != 0:
+				return exitcode
+			if exitcode[1] != 'directory':
+				return (32, "Path is invalid.")
 			if 'PATH' in enviro_dict:
 				enviro_path_list = shlex.split(enviro_dict['PATH'])
 				for i in enviro_path_list:
@@ -1408,7 +1859,7 @@ class ProcessCMDHandler:
 						maincommand = i
 						break
 
-			if (maincommand in directory_list) or (maincommand + '.cbf' in directory_list) or (self.computer.filesystem.read_file(maincommand if maincommand.startswith('/') or maincommand.startswith('\\') else os.path.join(self.current_working_dir, maincommand))[0] == 0):
+			if (self.computer.filesystem.get_type(os.path.join(self.current_working_dir, maincommand))[0] == 0) or (self.computer.filesystem.get_type(os.path.join(self.current_working_dir, maincommand + '.cbf'))[0] == 0):
 				# Command is a file
 				# Get full main command name
 				maincommand = maincommand if maincommand.endswith('.cbf') else (maincommand + '.cbf')
@@ -1418,7 +1869,7 @@ class ProcessCMDHandler:
 					return file_data
 				process = self.computer.operatingsystem.run_executable_data(file_data[1])
 				process.security_level = self.security_level
-				process.stdin.data = bytearray(b' '.join([bytes(i, ENCODING) for i in args]))
+				process.stdin.set_data(b' '.join([bytes(i, ENCODING) for i in args]))
 				process.cmdhandler.current_working_dir = self.current_working_dir
 				exitcode, pid = self.computer.operatingsystem.process_create(process)
 				if exitcode != 0:
@@ -1426,7 +1877,7 @@ class ProcessCMDHandler:
 				# Wait for the process to finish
 				self.computer.operatingsystem.process_await(pid)
 				# Get the processes STDOut data
-				stdout_data = self.computer.operatingsystem.processes[pid].stdout.data
+				stdout_data = self.computer.operatingsystem.processes[pid].stdout.pipe()[1]
 				# Get the processes exitcode
 				exitcode = self.computer.operatingsystem.processes[pid].output[0]
 
@@ -1567,13 +2018,18 @@ class ProcessCMDHandler:
 						return exitcode
 					codefile = str(exitcode[1], ENCODING)
 
-					# Parse and compile the code
-					parser = emos.parse.Compiler(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir)
-					parser.parse()
-					parser.compile()
+					# Parse and compile the code, unless it is cached
+					optimize = '-O' in args[2 : ]
+					encoding = 2 if '-v2' in args[2 : ] else 1
+					compiled, data_index, removed_instructions, code_labels = self.computer.operatingsystem.compile_cache.compile(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir, optimize, encoding)
+
+					# Start at the label given with '-entry=', if there is one
+					entry = 0
+					for arg in args[2 : ]:
+						if arg.startswith('-entry='):
+							entry = emos.parse.find_entry(code_labels, arg[len('-entry=') : ])
 
-					compiled = parser.compiled
-					linked = bytearray(int.to_bytes((parser.data_index if parser.data_index else len(parser.compiled)), 4, byteorder='little')) + compiled
+					linked = emos.parse.build_executable(compiled, data_index, encoding, entry=entry)
 
 					# Write the code to the file
 					# Get full path
@@ -1583,12 +2039,148 @@ class ProcessCMDHandler:
 					else:
 						# Relative
 						fullpath = os.path.join(self.current_working_dir, args[1])
+					exitcode = self.computer.filesystem.write_file(fullpath, linked)
+					if exitcode[0] != 0 or not optimize:
+						return (exitcode[0], b'')
+					# Report what the optimizer did
+					return (0, bytes('Optimized out ' + str(removed_instructions) + ' instructions.', ENCODING))
+				except Exception as e:
+					# Error
+					self.computer.operatingsystem.log += (str(e) + '\n')
+					return (37, "Parse error. [" + str(e) + "]")
+
+			elif maincommand == 'assemble':
+				# Compile a file into an object file
+				try:
+					# Get full path
+					if args[0].startswith('/') or args[0].startswith('\\'):
+						# Absolute
+						fullpath = args[0]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[0])
+						
+					# Get the file
+					exitcode = self.computer.filesystem.read_file(fullpath)
+					if exitcode[0] != 0:
+						return exitcode
+					codefile = str(exitcode[1], ENCODING)
+
+					# Parse and compile the code, leaving the labels/symbols unresolved
+					parser = emos.parse.Compiler(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir, 2 if '-v2' in args[2 : ] else 1)
+					parser.parse()
+					objectfile = parser.compile_object()
+
+					# Write the object file
+					# Get full path
+					if args[1].startswith('/') or args[1].startswith('\\'):
+						# Absolute
+						fullpath = args[1]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[1])
+					return (self.computer.filesystem.write_file(fullpath, objectfile.to_bytes())[0], b'')
+				except Exception as e:
+					# Error
+					self.computer.operatingsystem.log += (str(e) + '\n')
+					return (37, "Parse error. [" + str(e) + "]")
+
+			elif maincommand == 'link':
+				# Link object files into an executable
+				try:
+					objects = []
+					for path in args[1 : ]:
+						# Get full path
+						if path.startswith('/') or path.startswith('\\'):
+							# Absolute
+							fullpath = path
+						else:
+							# Relative
+							fullpath = os.path.join(self.current_working_dir, path)
+
+						# Get the object file
+						exitcode = self.computer.filesystem.read_file(fullpath)
+						if exitcode[0] != 0:
+							return exitcode
+						objects.append(emos.parse.ObjectFile.from_bytes(exitcode[1]))
+
+					# Link the object files
+					compiled, data_index = emos.parse.Linker(objects).link()
+
+					linked = emos.parse.build_executable(compiled, data_index, objects[0].encoding)
+
+					# Write the code to the file
+					# Get full path
+					if args[0].startswith('/') or args[0].startswith('\\'):
+						# Absolute
+						fullpath = args[0]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[0])
 					return (self.computer.filesystem.write_file(fullpath, linked)[0], b'')
 				except Exception as e:
 					# Error
 					self.computer.operatingsystem.log += (str(e) + '\n')
 					return (37, "Parse error. [" + str(e) + "]")
 
+			elif maincommand == 'build':
+				# Compile several files, or the files in directories, at once
+				optimize = '-O' in args
+				encoding = 2 if '-v2' in args else 1
+				entry = None
+				for arg in args:
+					if arg.startswith('-entry='):
+						entry = arg[len('-entry=') : ]
+
+				# Find the source files
+				sources = []
+				for path in args:
+					if path in ('-O', '-v2') or path.startswith('-entry='):
+						continue
+					# Get full path
+					if path.startswith('/') or path.startswith('\\'):
+						# Absolute
+						fullpath = path
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, path)
+
+					exitcode = self.computer.filesystem.get_type(fullpath)
+					if exitcode[0] != 0:
+						return exitcode
+					if exitcode[1] == 'directory':
+						# Every source file in the directory
+						exitcode = self.computer.filesystem.list_directory(fullpath)
+						if exitcode[0] != 0:
+							return exitcode
+						paths = [os.path.join(fullpath, name) for name in exitcode[1].split('\n') if name.endswith('.cpu')]
+					else:
+						paths = [fullpath]
+
+					# Get the files
+					for sourcepath in paths:
+						exitcode = self.computer.filesystem.read_file(sourcepath)
+						if exitcode[0] != 0:
+							return exitcode
+						sources.append((sourcepath, str(exitcode[1], ENCODING)))
+
+				# Compile the code
+				results = emos.parse.compile_batch(sources, 'emos', self.computer.operatingsystem, self.current_working_dir, optimize, encoding, entry=entry)
+
+				# Write the executables in one update
+				executables = [(os.path.splitext(sourcepath)[0] + '.cbf', results[sourcepath][1]) for sourcepath, code in sources if results[sourcepath][0] == 0]
+				exitcode = self.computer.filesystem.write_files(executables)
+				if exitcode[0] != 0:
+					return exitcode
+
+				# Report the errors
+				errors = [sourcepath + ': ' + results[sourcepath][1] for sourcepath, code in sources if results[sourcepath][0] != 0]
+				for error in errors:
+					self.computer.operatingsystem.log += (error + '\n')
+				if errors:
+					return (37, '\n'.join(errors))
+				return (0, bytes('Compiled ' + str(len(sources)) + ' files.', ENCODING))
+
 			elif maincommand == 'time':
 				# Get the current time
 				data = time.asctime()
@@ -1667,22 +2259,16 @@ class ProcessCMDHandler:
 					# Relative
 					fullpath = os.path.join(self.current_working_dir, args[0])
 					
-				# Get the file
-				exitcode = self.computer.filesystem.read_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-				filedata = exitcode[1]
-
-				# Write to the second file
+				# Get the second file's full path
 				if args[1].startswith('/') or args[1].startswith('\\'):
 					# Absolute
-					fullpath = args[1]
+					newpath = args[1]
 				else:
 					# Relative
-					fullpath = os.path.join(self.current_working_dir, args[1])
+					newpath = os.path.join(self.current_working_dir, args[1])
 					
-				# Write to the file
-				return (self.computer.filesystem.write_file(fullpath, filedata)[0], b'')
+				# Copy the file
+				return (self.computer.filesystem.copy_file(fullpath, newpath)[0], b'')
 
 			elif maincommand == 'env':
 				# Modify or get environment variables
@@ -1725,27 +2311,16 @@ class ProcessCMDHandler:
 					# Relative
 					fullpath = os.path.join(self.current_working_dir, args[0])
 					
-				# Get the file
-				exitcode = self.computer.filesystem.read_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-				filedata = exitcode[1]
-
-				# Delete the file
-				exitcode = self.computer.filesystem.delete_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-
-				# Write to the second file
+				# Get the second file's full path
 				if args[1].startswith('/') or args[1].startswith('\\'):
 					# Absolute
-					fullpath = args[1]
+					newpath = args[1]
 				else:
 					# Relative
-					fullpath = os.path.join(self.current_working_dir, args[1])
+					newpath = os.path.join(self.current_working_dir, args[1])
 					
-				# Write to the file
-				return (self.computer.filesystem.write_file(fullpath, filedata)[0], b'')
+				# Move the file
+				return (self.computer.filesystem.move_file(fullpath, newpath)[0], b'')
 
 			return (36, "Illegal command.")
 
@@ -1797,7 +2372,12 @@ class CMDHandler:
 		'del' : 'Delete a file or folder.',
 		'rname' : 'Rename a file or folder.',
 		'mkdir' : 'Create a new directory.',
-		'compile' : 'Compile and link EMOS code.',
+		'mount' : 'Mount a host directory, optionally read-only with \'ro\'.',
+		'unmount' : 'Unmount a host directory.',
+		'compile' : 'Compile and link EMOS code, optimizing it with \'-O\', using the compact encoding with \'-v2\' and starting at a label with \'-entry=<label>\'.',
+		'assemble' : 'Compile EMOS code into an object file, to link later. Use the compact encoding with \'-v2\'.',
+		'link' : 'Link object files into an executable. The first object file is where the program starts.',
+		'build' : 'Compile several files, or every file in directories, at once. Takes \'-O\', \'-v2\' and \'-entry=<label>\' like compile.',
 		'time' : 'Get the current time.',
 		'shutdown' : 'Shut down the computer.',
 		'clear' : 'Clear the screen',
@@ -1912,10 +2492,11 @@ class CMDHandler:
 
 			# Run the final command
 			# Check if the command is a file
-			directory_list = self.computer.filesystem.list_directory(self.current_working_dir)
-			if directory_list[0] != 0:
-				return directory_list
-			directory_list = directory_list[1].split('\n')
+			exitcode = self.computer.filesystem.get_type(self.current_working_dir)
+			if exitcode[0] != 0:
+				return exitcode
+			if exitcode[1] != 'directory':
+				return (32, "Path is invalid.")
 			if 'PATH' in enviro_dict:
 				enviro_path_list = shlex.split(enviro_dict['PATH'])
 				for i in enviro_path_list:
@@ -1924,7 +2505,7 @@ class CMDHandler:
 						maincommand = i
 						break
 
-			if (maincommand in directory_list) or (maincommand + '.cbf' in directory_list) or (self.computer.filesystem.read_file(maincommand if maincommand.startswith('/') or maincommand.startswith('\\') else os.path.join(self.current_working_dir, maincommand))[0] == 0):
+			if (self.computer.filesystem.get_type(os.path.join(self.current_working_dir, maincommand))[0] == 0) or (self.computer.filesystem.get_type(os.path.join(self.current_working_dir, maincommand + '.cbf'))[0] == 0):
 				# Command is a file
 				# Get full main command name
 				maincommand = maincommand if maincommand.endswith('.cbf') else (maincommand + '.cbf')
@@ -1934,7 +2515,7 @@ class CMDHandler:
 					return file_data
 				process = self.computer.operatingsystem.run_executable_data(file_data[1])
 				process.security_level = self.security_level
-				process.stdin.data = bytearray(b' '.join([bytes(i, ENCODING) for i in args]))
+				process.stdin.set_data(b' '.join([bytes(i, ENCODING) for i in args]))
 				process.cmdhandler.current_working_dir = self.current_working_dir
 				self.stealable = True
 				exitcode, pid = self.computer.operatingsystem.process_create(process)
@@ -1948,7 +2529,7 @@ class CMDHandler:
 				# Get the processes exitcode
 				exitcode, exitphrase = self.computer.operatingsystem.processes[pid].output
 				# Get the processes STDOut
-				stdout_data = self.computer.operatingsystem.processes[pid].stdout.data
+				stdout_data = self.computer.operatingsystem.processes[pid].stdout.pipe()[1]
 
 				# Write the STDOut data to the pipe file
 				if pipetofile:
@@ -2073,6 +2654,36 @@ class CMDHandler:
 				# Create the path
 				return (self.computer.filesystem.create_directory(fullpath)[0], b'')
 
+			elif maincommand == 'mount':
+				# Mount a host directory in the file system, optionally read-only
+				if not len(args) in (2, 3):
+					return (56, "Invalid number of arguments.")
+				# Get full path
+				if args[1].startswith('/') or args[1].startswith('\\'):
+					# Absolute
+					fullpath = args[1]
+				else:
+					# Relative
+					fullpath = os.path.join(self.current_working_dir, args[1])
+
+				# Mount the directory
+				return (self.computer.filesystem.mount(fullpath, args[0], len(args) > 2 and args[2] == 'ro')[0], b'')
+
+			elif maincommand == 'unmount':
+				# Unmount a host directory
+				if len(args) != 1:
+					return (56, "Invalid number of arguments.")
+				# Get full path
+				if args[0].startswith('/') or args[0].startswith('\\'):
+					# Absolute
+					fullpath = args[0]
+				else:
+					# Relative
+					fullpath = os.path.join(self.current_working_dir, args[0])
+
+				# Unmount the directory
+				return (self.computer.filesystem.unmount(fullpath)[0], b'')
+
 			elif maincommand == 'compile':
 				# Compile a file
 				try:
@@ -2090,13 +2701,18 @@ class CMDHandler:
 						return exitcode
 					codefile = str(exitcode[1], ENCODING)
 
-					# Parse and compile the code
-					parser = emos.parse.Compiler(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir)
-					parser.parse()
-					parser.compile()
+					# Parse and compile the code, unless it is cached
+					optimize = '-O' in args[2 : ]
+					encoding = 2 if '-v2' in args[2 : ] else 1
+					compiled, data_index, removed_instructions, code_labels = self.computer.operatingsystem.compile_cache.compile(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir, optimize, encoding)
+
+					# Start at the label given with '-entry=', if there is one
+					entry = 0
+					for arg in args[2 : ]:
+						if arg.startswith('-entry='):
+							entry = emos.parse.find_entry(code_labels, arg[len('-entry=') : ])
 
-					compiled = parser.compiled
-					linked = bytearray(int.to_bytes((parser.data_index if parser.data_index else len(parser.compiled)), 4, byteorder='little')) + compiled
+					linked = emos.parse.build_executable(compiled, data_index, encoding, entry=entry)
 
 					# Write the code to the file
 					# Get full path
@@ -2106,12 +2722,148 @@ class CMDHandler:
 					else:
 						# Relative
 						fullpath = os.path.join(self.current_working_dir, args[1])
+					exitcode = self.computer.filesystem.write_file(fullpath, linked)
+					if exitcode[0] != 0 or not optimize:
+						return (exitcode[0], b'')
+					# Report what the optimizer did
+					return (0, bytes('Optimized out ' + str(removed_instructions) + ' instructions.', ENCODING))
+				except Exception as e:
+					# Error
+					self.computer.operatingsystem.log += (str(e) + '\n')
+					return (37, "Parse error. [" + str(e) + "]")
+
+			elif maincommand == 'assemble':
+				# Compile a file into an object file
+				try:
+					# Get full path
+					if args[0].startswith('/') or args[0].startswith('\\'):
+						# Absolute
+						fullpath = args[0]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[0])
+						
+					# Get the file
+					exitcode = self.computer.filesystem.read_file(fullpath)
+					if exitcode[0] != 0:
+						return exitcode
+					codefile = str(exitcode[1], ENCODING)
+
+					# Parse and compile the code, leaving the labels/symbols unresolved
+					parser = emos.parse.Compiler(codefile, 'emos', self.computer.operatingsystem, self.current_working_dir, 2 if '-v2' in args[2 : ] else 1)
+					parser.parse()
+					objectfile = parser.compile_object()
+
+					# Write the object file
+					# Get full path
+					if args[1].startswith('/') or args[1].startswith('\\'):
+						# Absolute
+						fullpath = args[1]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[1])
+					return (self.computer.filesystem.write_file(fullpath, objectfile.to_bytes())[0], b'')
+				except Exception as e:
+					# Error
+					self.computer.operatingsystem.log += (str(e) + '\n')
+					return (37, "Parse error. [" + str(e) + "]")
+
+			elif maincommand == 'link':
+				# Link object files into an executable
+				try:
+					objects = []
+					for path in args[1 : ]:
+						# Get full path
+						if path.startswith('/') or path.startswith('\\'):
+							# Absolute
+							fullpath = path
+						else:
+							# Relative
+							fullpath = os.path.join(self.current_working_dir, path)
+
+						# Get the object file
+						exitcode = self.computer.filesystem.read_file(fullpath)
+						if exitcode[0] != 0:
+							return exitcode
+						objects.append(emos.parse.ObjectFile.from_bytes(exitcode[1]))
+
+					# Link the object files
+					compiled, data_index = emos.parse.Linker(objects).link()
+
+					linked = emos.parse.build_executable(compiled, data_index, objects[0].encoding)
+
+					# Write the code to the file
+					# Get full path
+					if args[0].startswith('/') or args[0].startswith('\\'):
+						# Absolute
+						fullpath = args[0]
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, args[0])
 					return (self.computer.filesystem.write_file(fullpath, linked)[0], b'')
 				except Exception as e:
 					# Error
 					self.computer.operatingsystem.log += (str(e) + '\n')
 					return (37, "Parse error. [" + str(e) + "]")
 
+			elif maincommand == 'build':
+				# Compile several files, or the files in directories, at once
+				optimize = '-O' in args
+				encoding = 2 if '-v2' in args else 1
+				entry = None
+				for arg in args:
+					if arg.startswith('-entry='):
+						entry = arg[len('-entry=') : ]
+
+				# Find the source files
+				sources = []
+				for path in args:
+					if path in ('-O', '-v2') or path.startswith('-entry='):
+						continue
+					# Get full path
+					if path.startswith('/') or path.startswith('\\'):
+						# Absolute
+						fullpath = path
+					else:
+						# Relative
+						fullpath = os.path.join(self.current_working_dir, path)
+
+					exitcode = self.computer.filesystem.get_type(fullpath)
+					if exitcode[0] != 0:
+						return exitcode
+					if exitcode[1] == 'directory':
+						# Every source file in the directory
+						exitcode = self.computer.filesystem.list_directory(fullpath)
+						if exitcode[0] != 0:
+							return exitcode
+						paths = [os.path.join(fullpath, name) for name in exitcode[1].split('\n') if name.endswith('.cpu')]
+					else:
+						paths = [fullpath]
+
+					# Get the files
+					for sourcepath in paths:
+						exitcode = self.computer.filesystem.read_file(sourcepath)
+						if exitcode[0] != 0:
+							return exitcode
+						sources.append((sourcepath, str(exitcode[1], ENCODING)))
+
+				# Compile the code
+				results = emos.parse.compile_batch(sources, 'emos', self.computer.operatingsystem, self.current_working_dir, optimize, encoding, entry=entry)
+
+				# Write the executables in one update
+				executables = [(os.path.splitext(sourcepath)[0] + '.cbf', results[sourcepath][1]) for sourcepath, code in sources if results[sourcepath][0] == 0]
+				exitcode = self.computer.filesystem.write_files(executables)
+				if exitcode[0] != 0:
+					return exitcode
+
+				# Report the errors
+				errors = [sourcepath + ': ' + results[sourcepath][1] for sourcepath, code in sources if results[sourcepath][0] != 0]
+				for error in errors:
+					self.computer.operatingsystem.log += (error + '\n')
+				if errors:
+					return (37, '\n'.join(errors))
+				return (0, bytes('Compiled ' + str(len(sources)) + ' files.', ENCODING))
+
 			elif maincommand == 'time':
 				# Get the current time
 				data = time.asctime()
@@ -2238,22 +2990,16 @@ class CMDHandler:
 					# Relative
 					fullpath = os.path.join(self.current_working_dir, args[0])
 					
-				# Get the file
-				exitcode = self.computer.filesystem.read_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-				filedata = exitcode[1]
-
-				# Write to the second file
+				# Get the second file's full path
 				if args[1].startswith('/') or args[1].startswith('\\'):
 					# Absolute
-					fullpath = args[1]
+					newpath = args[1]
 				else:
 					# Relative
-					fullpath = os.path.join(self.current_working_dir, args[1])
+					newpath = os.path.join(self.current_working_dir, args[1])
 					
-				# Write to the file
-				return (self.computer.filesystem.write_file(fullpath, filedata)[0], b'')
+				# Copy the file
+				return (self.computer.filesystem.copy_file(fullpath, newpath)[0], b'')
 
 			elif maincommand == 'env':
 				# Modify or get environment variables
@@ -2296,27 +3042,16 @@ class CMDHandler:
 					# Relative
 					fullpath = os.path.join(self.current_working_dir, args[0])
 					
-				# Get the file
-				exitcode = self.computer.filesystem.read_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-				filedata = exitcode[1]
-
-				# Delete the file
-				exitcode = self.computer.filesystem.delete_file(fullpath)
-				if exitcode[0] != 0:
-					return exitcode
-
-				# Write to the second file
+				# Get the second file's full path
 				if args[1].startswith('/') or args[1].startswith('\\'):
 					# Absolute
-					fullpath = args[1]
+					newpath = args[1]
 				else:
 					# Relative
-					fullpath = os.path.join(self.current_working_dir, args[1])
+					newpath = os.path.join(self.current_working_dir, args[1])
 					
-				# Write to the file
-				return (self.computer.filesystem.write_file(fullpath, filedata)[0], b'')
+				# Move the file
+				return (self.computer.filesystem.move_file(fullpath, newpath)[0], b'')
 
 			return (36, "Illegal command.")
 
@@ -2360,18 +3095,23 @@ class Process:
 
 	"""The main process object."""
 
-	def __init__(self, processmemory, threads, state, security_level=0):
+	def __init__(self, processmemory, threads, state, security_level=0, heap_size=0):
 
 		"""Create the process.
 		   Args: processmemory -> the process memory for the process
 		         threads -> a dictionary containing all the thread ids and the threads
 		         state -> string containing the state of the process. 'r' for running, or 't' for terminated/stopped/error
-		         secutiry_level -> the security level which the process is at. 0 for full access, and 1 for limited access"""
+		         secutiry_level -> the security level which the process is at. 0 for full access, and 1 for limited access
+		         heap_size -> the size of the heap arena to preallocate when the process is created"""
 
 		self.processmemory = processmemory
 		self.threads = threads
 		self.state = state
 
+		self.heap_size = heap_size
+		# Memory ID of the preallocated heap arena, until the process claims it
+		self.heap = None
+
 		self.stdout = STDOut()
 		self.stdin = STDIn()
 
@@ -2381,14 +3121,40 @@ class Process:
 
 		self.security_level = security_level
 
+	def fork(self):
+
+		"""Create a copy-on-write copy of the process. The process memory and thread stacks are shared with the new process until they are written to.
+		   The new process gets its own STDOut, a copy of the remaining STDIn data, and copies of the open file handles, so file positions are not shared.
+		   If this process has not claimed its preallocated heap yet, the new process gets its own heap of the same size."""
+
+		process = Process(self.processmemory.fork(), {tid : thread.fork() for tid, thread in self.threads.items()}, self.state, self.security_level, self.heap_size if self.heap != None else 0)
+		process.stdin.set_data(self.stdin.get_data())
+		process.open_files = [copy.copy(handle) if handle != None else None for handle in self.open_files]
+		process.cmdhandler.current_working_dir = self.cmdhandler.current_working_dir
+
+		return process
+
+	def get_processmemory_thread_writable(self, tid):
+
+		"""Get the process memory for a specific thread, sharing the data section with the process so writes to it are kept.
+		   Args: tid -> the thread id"""
+
+		newpm = copy.copy(self.processmemory)
+		newpm.stack = self.threads[tid].stack
+		newpm.es = newpm.ss + len(newpm.stack.data)
+
+		return newpm
+
 	def get_processmemory_thread(self, tid):
 
 		"""Get the process memory for a specific thread.
 		   Args: tid -> the thread id"""
 
-		stack = self.threads[tid].stack
-		newpm = copy.deepcopy(self.processmemory)
-		newpm.stack = stack
+		# Share the code and data sections copy-on-write, and use the thread's stack
+		newpm = copy.copy(self.processmemory)
+		newpm.code = self.processmemory.code.fork()
+		newpm.data = self.processmemory.data.fork()
+		newpm.stack = self.threads[tid].stack
 		newpm.es = newpm.ss + len(newpm.stack.data)
 
 		return newpm
@@ -2466,6 +3232,17 @@ class PThread:
 
 		self.dynamic_libraries = []
 
+	def fork(self):
+
+		"""Create a copy-on-write copy of the thread. The stack is shared with the new thread until it is written to."""
+
+		thread = PThread(self.tid, self.stack.fork(), {name : register.copy() for name, register in self.registers.items()} if self.registers else self.registers)
+		thread.waiting = self.waiting
+		thread.running = self.running
+		thread.dynamic_libraries = list(self.dynamic_libraries)
+
+		return thread
+
 	def __repr__(self):
 
 		"""Get the string representation of the process."""
@@ -2493,6 +3270,11 @@ class Terminal:
 		self.state = 'term'
 		self.data = bytearray()
 
+		# Whether the screen buffer needs to be updated
+		self.changed = False
+		# Held while the view or the data is changed, and while the screen buffer is updated
+		self.lock = threading.RLock()
+
 	def start(self):
 
 		"""Start the terminal."""
@@ -2513,13 +3295,14 @@ class Terminal:
 			if not self.operatingsystem.cmdhandler.stealable:
 				return (38, "Command handler is not ready to be stolen.")
 
-		self.pid_view = pid
-		self.stdout = self.operatingsystem.processes[pid].stdout
-		self.stdin = self.operatingsystem.processes[pid].stdin
-		self.stdout.active = True
-		self.stdin.active = True
-		
-		self.state = 'proc'
+		with self.lock:
+			self.pid_view = pid
+			self.stdout = self.operatingsystem.processes[pid].stdout
+			self.stdin = self.operatingsystem.processes[pid].stdin
+			self.stdout.active = True
+			self.stdin.active = True
+
+			self.state = 'proc'
 
 		self.notify_change()
 
@@ -2529,12 +3312,13 @@ class Terminal:
 
 		"""Set the display to view the kernel's STDOut."""
 
-		self.pid_view = None
-		self.stdout = self.operatingsystem.kernel_stdout
-		self.stdin = None
-		self.stdout.active = True
+		with self.lock:
+			self.pid_view = None
+			self.stdout = self.operatingsystem.kernel_stdout
+			self.stdin = None
+			self.stdout.active = True
 
-		self.state = 'kern'
+			self.state = 'kern'
 
 		self.notify_change()
 
@@ -2544,18 +3328,20 @@ class Terminal:
 
 		"""Unset the display view from any PID's STDOut."""
 
-		# Add the final STDOut data to our data permanently
-		self.data += self.stdout.data
+		with self.lock:
+			# Add the final STDOut data to our data permanently
+			self.data += self.stdout.data
+			del self.data[ : -STDOUT_SIZE]
 
-		self.stdout.active = False
-		if self.stdin != None:
-			self.stdin.active = False
+			self.stdout.active = False
+			if self.stdin != None:
+				self.stdin.active = False
 
-		del self.pid_view
-		del self.stdout
-		del self.stdin
+			del self.pid_view
+			del self.stdout
+			del self.stdin
 
-		self.state = 'term'
+			self.state = 'term'
 
 		self.notify_change()
 
@@ -2563,36 +3349,49 @@ class Terminal:
 
 	def notify_change(self):
 
-		"""Notify that the STDOut changed and update the terminal screen."""
-
-		size_x = self.computer.peripherals[self.terminalID].cols
-		size_y = self.computer.peripherals[self.terminalID].rows
-
-		# Check for terminal or output mode
-		if self.state == 'term':
-			# Cut the data, and then write the data
-			# Cut the data
-			self.data = self.data[-(size_x * size_y + size_y) : ]
-			# Write the data
-			self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(self.data + bytes((size_x * size_y + size_y) - len(self.data)))
-			self.computer.peripherals[self.terminalID].update_screen()
-		elif self.state == 'proc':
-			# Write the data with the STDOut data and cut it too
-			# Add the STDOut data and cut the data
-			data = self.data + self.stdout.pipe()[1]
-			# Cut the data
-			data = data[-(size_x * size_y + size_y) : ]
-			# Write the data
-			self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(data + bytes((size_x * size_y + size_y) - len(data)))
-			self.computer.peripherals[self.terminalID].update_screen()
-		elif self.state == 'kern':
-			# Write the kernel STDOut to the screen
-			data = self.stdout.pipe()[1]
-			# Cut the data
-			data = data[-(size_x * size_y + size_y) : ]
-			# Write the data
-			self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(data + bytes((size_x * size_y + size_y) - len(data)))
-			self.computer.peripherals[self.terminalID].update_screen()
+		"""Notify that the STDOut changed. The screen buffer is updated when the terminal screen next draws."""
+
+		self.changed = True
+		self.computer.peripherals[self.terminalID].update_screen()
+
+		return (0, None)
+
+	def update_buffer(self):
+
+		"""Write the data to the terminal screen's buffer."""
+
+		with self.lock:
+			self.changed = False
+			try:
+				size_x = self.computer.peripherals[self.terminalID].cols
+				size_y = self.computer.peripherals[self.terminalID].rows
+
+				# Check for terminal or output mode
+				if self.state == 'term':
+					# Cut the data, and then write the data
+					# Cut the data
+					self.data = self.data[-(size_x * size_y + size_y) : ]
+					# Write the data
+					self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(self.data + bytes((size_x * size_y + size_y) - len(self.data)))
+				elif self.state == 'proc':
+					# Write the data with the STDOut data and cut it too
+					# Add the STDOut data and cut the data
+					data = self.data + self.stdout.data[-(size_x * size_y + size_y) : ]
+					# Cut the data
+					data = data[-(size_x * size_y + size_y) : ]
+					# Write the data
+					self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(data + bytes((size_x * size_y + size_y) - len(data)))
+				elif self.state == 'kern':
+					# Write the kernel STDOut to the screen
+					data = self.stdout.data[-(size_x * size_y + size_y) : ]
+					# Cut the data
+					data = data[-(size_x * size_y + size_y) : ]
+					# Write the data
+					self.computer.memory.memorypartitions[('perp', self.terminalID)].set_data(data + bytes((size_x * size_y + size_y) - len(data)))
+			except Exception:
+				# Keep the change, so the next draw tries again
+				self.changed = True
+				raise
 
 		return (0, None)
 
@@ -2600,10 +3399,14 @@ class Terminal:
 
 		"""Clear the terminal window."""
 
-		self.data = b''
+		with self.lock:
+			self.data = bytearray()
 
-		if self.state in ('proc', 'kern'):
-			self.stdout.data = b''
+			if self.state in ('proc', 'kern'):
+				self.stdout.data = bytearray()
+				# Remove the old output that was moved to the spill file
+				if self.stdout.spill != None and os.path.exists(self.stdout.spill):
+					os.remove(self.stdout.spill)
 
 		self.notify_change()
 
@@ -2611,14 +3414,14 @@ class Terminal:
 
 		"""Get one character from the terminal, without echoing."""
 
-		return (0, getchars(1))
+		return (0, self.computer.peripherals[self.terminalID].get_chars(1))
 
 	def get_chars(self, n):
 
 		"""Get N characters from the terminal, without echoing.
 		   Args: n -> number of chars to get"""
 
-		return (0, getchars(n))
+		return (0, self.computer.peripherals[self.terminalID].get_chars(n))
 
 	def get_input(self):
 
@@ -2627,7 +3430,7 @@ class Terminal:
 		# Check the state
 		if self.state in ('term', 'kern'):
 			# Get the standard input
-			input_data = input()
+			input_data = self.computer.peripherals[self.terminalID].get_line()
 			self.print_terminal(bytes(input_data, ENCODING))
 			return (0, input_data)
 
@@ -2635,7 +3438,7 @@ class Terminal:
 		# Iterate over each character in the input
 		while True:
 			# Get a character
-			char = getchars(1)
+			char = self.computer.peripherals[self.terminalID].get_chars(1)
 			# Add the character
 			orig_text = text
 			if char == '\b':
@@ -2654,15 +3457,9 @@ class Terminal:
 
 		"""Print to the terminal."""
 
-		# Add each character, handling backspaces
-		for char in data:
-			# Check for a backspace
-			if bytes([char]) == b'\b':
-				# Delete the last char
-				self.data = self.data[ : -1]
-			else:
-				# Add the char
-				self.data += bytes([char])
+		with self.lock:
+			write_output(self.data, data)
+			del self.data[ : -STDOUT_SIZE]
 
 		if self.state in ('term', 'kern'):
 			self.notify_change()
@@ -2684,30 +3481,29 @@ class Terminal:
 
 class STDOut:
 
-	"""The basic standard output class. Each process gets a standard output handle. The output gets mapped into the terminal/console."""
+	"""The basic standard output class. Each process gets a standard output handle. The output gets mapped into the terminal/console.
+	   Only the last maxsize bytes of output are kept, and older output is moved to the spill file if there is one."""
 
-	def __init__(self):
+	def __init__(self, maxsize=STDOUT_SIZE, spill=None):
 
-		"""Create the standard output."""
+		"""Create the standard output.
+		   Args: maxsize -> the number of bytes of output to keep
+		         spill -> path to a host file to move older output to, or None to discard it"""
 
 		self.data = bytearray()
 		self.active = False
 
+		self.maxsize = maxsize
+		self.spill = spill
+
 	def write(self, data, terminal):
 
 		"""Write data into the output stream, and notify the attached terminal.
 		   Args: data -> data to add
 		         terminal -> terminal to notify"""
 
-		# Add each character, handling backspaces
-		for char in data:
-			# Check for a backspace
-			if bytes([char]) == b'\b':
-				# Delete the last char
-				self.data = self.data[ : -1]
-			else:
-				# Add the char
-				self.data += bytes([char])
+		write_output(self.data, data)
+		self.trim()
 
 		if self.active:
 			# Notify the terminal
@@ -2722,16 +3518,11 @@ class STDOut:
 		         terminal -> terminal to notify"""
 
 		self.data = bytearray()
+		if self.spill != None and os.path.exists(self.spill):
+			os.remove(self.spill)
 
-		# Add each character, handling backspaces
-		for char in data:
-			# Check for a backspace
-			if bytes([char]) == b'\b':
-				# Delete the last char
-				self.data = self.data[ : -1]
-			else:
-				# Add the char
-				self.data += bytes([char])
+		write_output(self.data, data)
+		self.trim()
 
 		if self.active:
 			# Notify the terminal
@@ -2739,9 +3530,28 @@ class STDOut:
 
 		return (0, None)
 
+	def trim(self):
+
+		"""Remove the oldest output if there is more than maxsize bytes, moving it to the spill file."""
+
+		if len(self.data) <= self.maxsize:
+			return
+
+		# Remove an extra quarter, so the spill file is only written to every so often
+		numbytes = len(self.data) - self.maxsize + self.maxsize // 4
+		if self.spill != None:
+			with open(self.spill, 'ab') as f:
+				f.write(self.data[ : numbytes])
+		# Deleting from the front of a bytearray doesn't copy the rest of it
+		del self.data[ : numbytes]
+
 	def pipe(self):
 
-		"""Pipe/return the output stream."""
+		"""Pipe/return the output stream, including any output moved to the spill file."""
+
+		if self.spill != None and os.path.exists(self.spill):
+			with open(self.spill, 'rb') as f:
+				return (0, f.read() + self.data)
 
 		return (0, self.data)
 
@@ -2760,56 +3570,126 @@ class STDOut:
 
 class STDIn:
 
-	"""The basic standard input class."""
+	"""The basic standard input class. The input data is kept as a queue of chunks and an offset into the first chunk, so reading doesn't move the rest of the data."""
 
 	def __init__(self):
 
 		"""Create the standard input."""
 
 		self.active = False
-		self.data = bytearray()
+		self.chunks = collections.deque()
+		self.offset = 0
+		self.size = 0
+
+	def write(self, data):
+
+		"""Add data to the end of the input.
+		   Args: data -> data to add"""
+
+		if len(data) > 0:
+			self.chunks.append(bytes(data))
+			self.size += len(data)
+
+		return (0, None)
+
+	def set_data(self, data):
+
+		"""Set the input data, removing any unread input.
+		   Args: data -> data to set"""
+
+		self.chunks.clear()
+		self.offset = 0
+		self.size = 0
+
+		return self.write(data)
+
+	def get_data(self):
+
+		"""Get the unread input data, without reading it."""
+
+		return b''.join(self.chunks)[self.offset : ]
+
+	def get_size(self):
+
+		"""Get the size of the unread input data."""
+
+		return self.size
+
+	def take(self, n):
+
+		"""Remove up to N bytes from the start of the input, returning them.
+		   Args: n -> number of bytes to remove"""
+
+		pieces = []
+		while n > 0 and self.chunks:
+			chunk = self.chunks[0]
+			piece = chunk[self.offset : self.offset + n]
+			pieces.append(piece)
+			n -= len(piece)
+			self.size -= len(piece)
+			self.offset += len(piece)
+			# Remove the chunk once it is all read
+			if self.offset == len(chunk):
+				self.chunks.popleft()
+				self.offset = 0
+
+		return b''.join(pieces)
 
 	def read(self, terminal):
 
 		"""Read from a terminal.
 		   Args: terminal -> terminal to read from"""
 
-		if self.active:
-			if len(self.data) == 0:
-				return terminal.get_char()
-			else:
-				return (0, chr(self.data.pop(0)))
-		else:
-			if len(self.data) == 0:
-				return (24, "STDIn not attached to a terminal.")
-			else:
-				return (0, chr(self.data.pop(0)))
+		return self.readn(1, terminal)
 
 	def readn(self, n, terminal):
 
-		"""Read N characters from a terminal.
+		"""Read N characters from a terminal. Each byte of the input data is read as one character.
 		   Args: n -> number of characters to read
 		   		 terminal -> terminal to read from"""
 
-		if self.active:
-			final_text = ''
-			for i in range(n):
-				exitcode, char = self.read(terminal)
-				if exitcode != 0:
-					return (exitcode, char)
-				final_text += char
-			return (0, final_text)
-		else:
-			if len(self.data) == 0:
+		if not self.active:
+			if self.size == 0 or self.size < n:
 				return (24, "STDIn not attached to a terminal.")
-			else:
-				final_text = ''
-				for i in range(n):
-					exitcode, char = self.read(terminal)
-					if exitcode != 0:
-						return (exitcode, char)
-					final_text += char
-				return (0, final_text)
+			return (0, str(self.take(n), 'latin-1'))
+
+		# Read the input data, and get the rest from the terminal
+		text = str(self.take(n), 'latin-1')
+		if len(text) < n:
+			exitcode, chars = terminal.get_chars(n - len(text))
+			if exitcode != 0:
+				return (exitcode, chars)
+			text += chars
+
+		return (0, text)
+
+	def readline(self, terminal):
+
+		"""Read a line from a terminal, without the newline. Each byte of the input data is read as one character.
+		   Args: terminal -> terminal to read from"""
+
+		# Find the end of the line in the input data
+		length = 0
+		for index, chunk in enumerate(self.chunks):
+			start = self.offset if index == 0 else 0
+			end = chunk.find(b'\n', start)
+			if end != -1:
+				return (0, str(self.take(length + end - start + 1)[ : -1], 'latin-1'))
+			length += len(chunk) - start
+
+		if not self.active:
+			if self.size == 0:
+				return (24, "STDIn not attached to a terminal.")
+			# Read the last line
+			return (0, str(self.take(self.size), 'latin-1'))
+
+		# Read the input data, and get the rest of the line from the terminal
+		text = str(self.take(self.size), 'latin-1')
+		exitcode, line = terminal.get_input()
+		if exitcode != 0:
+			return (exitcode, line)
+
+		return (0, text + line)
 
 	def take_input(self, terminal):
 
@@ -2868,7 +3748,7 @@ class INT_STR_LIB(DynamicLibrary):
 				exitcode = (exitcode, None)
 			else:
 				# Write the data to the STDOut
-				int_value = int(str(data, ENCODING))
+				int_value = int(data)
 				self.operatingsystem.processes[self.pid].threads[self.tid].registers['RBX'].data[0 : 4] = int.to_bytes(int_value, 4, byteorder='little')
 				exitcode = (0, None)
 		elif call == 2:
@@ -2894,7 +3774,7 @@ class INT_STR_LIB(DynamicLibrary):
 				exitcode = (exitcode, None)
 			else:
 				# Write the data to the STDOut
-				int_value = int(str(data, ENCODING))
+				int_value = int(data)
 				self.operatingsystem.processes[self.pid].threads[self.tid].registers['RBX'].data[0 : 4] = int.to_bytes(int_value, 4, byteorder='little', signed=True)
 				exitcode = (0, None)
 
@@ -2985,7 +3865,7 @@ class FLOAT_STR_LIB(DynamicLibrary):
 				exitcode = (exitcode, None)
 			else:
 				# Write the data to the STDOut
-				float_value = float(str(data, ENCODING))
+				float_value = float(data)
 				self.operatingsystem.processes[self.pid].threads[self.tid].registers['RBX'].data[0 : 4] = struct.pack('f', float_value)
 				exitcode = (0, None)
 
@@ -8,8 +8,14 @@
 
 import string
 import math
+import re
 import os
 import struct
+import hashlib
+import pickle
+import collections
+import json
+import multiprocessing
 
 ENCODING = 'utf-8'
 REGISTER_NAMES = ['RAX', 'RCX', 'RDX', 'RBX', 'RSP', 'RBP', 'RSI', 'RDI', 'RIP', 'CS', 'DS', 'SS', 'ES', 'FLAGS', 'R8', 'R9', 'R10', 'R11', 'R12', 'R13', 'R14', 'R15']
@@ -19,6 +25,25 @@ MNEMONIC_LIST = ['MOV', 'ADD', 'SUB', 'MUL', 'SMUL', 'DIV', 'SDIV', 'AND', 'OR',
 				 'JE', 'JLE', 'JGE', 'JNE', 'NOP', 'HLT', 'CALL', 'RET', 'SYS', 'POPN', 'PUSHN', 'INFL', 'INT', 'ARGN', 'LIB', 'BSL', 'ASL', 'BSLF', 'ASLF', 'BSR', 'ASR', 'BSRF', 'ASRF', 'EIR', 'ML', 'MG', 'ME', 'MLE', 'MGE', 
 				 'MNE', 'POPR', 'POPNR', 'VARN', 'OFFSG', 'ADDFLOAT', 'SUBFLOAT', 'MULFLOAT', 'DIVFLOAT', 'POWFLOAT', 'CMPFLOAT', 'ITF', 'SITF', 'FTI', 'FTSI']
 STD_LIBS = ['ISLIB', 'WRITELIB', 'FSLIB']
+STRING_ESCAPES = {'n': '\n', 'b': '\b', 't': '\t', 'r': '\r'}
+PATTERN_WHITESPACE = re.compile(r'\s*')
+PATTERN_SPACES = re.compile(' *')
+PATTERN_TABS = re.compile('\t*')
+PATTERN_ALPHA = re.compile('[a-zA-Z]*')
+PATTERN_ALPHANUMERIC = re.compile('[a-zA-Z0-9]*')
+PATTERN_HEX = re.compile('[0-9a-fA-F]*')
+PATTERN_DEC = re.compile('[0-9]*')
+DEFINED_PATTERNS = {}
+COMPILE_CACHE_SIZE = 256
+OBJECT_MAGIC = b'EMOSOBJ\x00'
+OBJECT_HEADER = '<8sIII'
+EXECUTABLE_MAGIC = b'\x7fCBF'
+EXECUTABLE_HEADER = '<4sBI'
+# Extended header with the BSS size, stack reservation, heap hint and entry point
+EXECUTABLE_MAGIC_EXTENDED = b'\x7fCBX'
+EXECUTABLE_HEADER_EXTENDED = '<4sBIIIII'
+# Instruction encodings. 1 is the original encoding, and 2 adds compact argument types
+ENCODINGS = (1, 2)
 
 
 class ParseError(Exception):
@@ -28,64 +53,173 @@ class ParseError(Exception):
 	pass
 
 
+class MissingInclude(ParseError):
+
+	"""An included file that wasn't given to the compiler."""
+
+	def __init__(self, path):
+
+		"""Create the error.
+		   Args: path -> the path of the included file"""
+
+		super().__init__("Included file " + path + " was not given.")
+		self.path = path
+
+
+def build_executable(compiled, data_index, encoding=1, stack_size=0, heap_size=0, entry=0):
+
+	"""Build an executable from compiled code, adding the header. Zeros at the end of the data section are left out and stored as the BSS size.
+	   Args: compiled -> the compiled code and data
+	         data_index -> the index of the data section, or None if there is none
+	         encoding -> the instruction encoding of the code
+	         stack_size -> the number of bytes of stack to reserve when the process is loaded
+	         heap_size -> the size of the heap arena to preallocate when the process is loaded
+	         entry -> the offset in the code section to start running at"""
+
+	data_offset = data_index if data_index else len(compiled)
+
+	# Count the zeros at the end of the data section
+	bss_size = len(compiled) - data_offset - len(bytes(compiled[data_offset : ]).rstrip(b'\x00'))
+	extended_size = struct.calcsize(EXECUTABLE_HEADER_EXTENDED) - (4 if encoding == 1 else struct.calcsize(EXECUTABLE_HEADER))
+
+	if stack_size or heap_size or entry or bss_size > extended_size:
+		# Extended header, leaving out the BSS
+		header = struct.pack(EXECUTABLE_HEADER_EXTENDED, EXECUTABLE_MAGIC_EXTENDED, encoding, data_offset, bss_size, stack_size, heap_size, entry)
+		return bytearray(header) + compiled[ : len(compiled) - bss_size]
+
+	if encoding == 1:
+		# Original header, with just the beginning data offset
+		return bytearray(int.to_bytes(data_offset, 4, byteorder='little')) + compiled
+
+	return bytearray(struct.pack(EXECUTABLE_HEADER, EXECUTABLE_MAGIC, encoding, data_offset)) + compiled
+
+
+def find_entry(code_labels, name):
+
+	"""Get the offset of the entry point label in the code section.
+	   Args: code_labels -> the offsets of the labels in the code section
+	         name -> the label to start running at"""
+
+	if not name in code_labels:
+		raise ParseError("Entry point " + name + " is not a label in the code section.")
+
+	return code_labels[name]
+
+
 class Compiler:
 
 	"""Compiles code."""
 
-	def __init__(self, code, filesys='comp', emos=None, currentdir=None):
+	def __init__(self, code, filesys='comp', emos=None, currentdir=None, encoding=1, files=None):
 
 		"""Create the Compiler.
 		   Args: code -> code to parse and compile
-		         filesys -> the file system to load other files from. 'comp' is for computer, and 'emos' is for EMOS. 
+		         filesys -> the file system to load other files from. 'comp' is for computer, 'emos' is for EMOS, and 'files' is for the files given in files. 
 		         emos -> the operating system to retrieve files from
-		         currentdir -> the current working directory for emos"""
+		         currentdir -> the current working directory for emos
+		         encoding -> the instruction encoding to compile to, 1 or 2
+		         files -> a dictionary of EMOS paths to code, for the 'files' file system"""
+
+		if not encoding in ENCODINGS:
+			raise ParseError("Invalid encoding.")
 
 		self.code = code
+		self.pos = 0
+		self.sources = []
 		self.filesys = filesys
 		self.emos = emos
 		self.currentdir = currentdir
+		self.encoding = encoding
+		self.files = files
 
 		self.tree = [['SEC', 'code']]
+		# Included files and the hashes of their code, in the order they were included
+		self.includes = []
+		# Number of instructions removed by the optimizer
+		self.removed_instructions = 0
+
+	def push_source(self, code):
+
+		"""Start reading from a new source, returning to the current one once it runs out.
+		   Args: code -> the code to read next"""
+
+		self.sources.append((self.code, self.pos))
+		self.code = code
+		self.pos = 0
+
+	def at_end(self):
+
+		"""Check if we have run out of input."""
+
+		# Drop any sources we have finished reading
+		while self.pos >= len(self.code) and self.sources:
+			self.code, self.pos = self.sources.pop()
+
+		return self.pos >= len(self.code)
 
 	def next_char(self):
 
 		"""Pop off the next character."""
 
-		try:
-			char = self.code[0]
-			self.code = self.code[1 : ]
-			return char
-		except:
+		if self.at_end():
 			raise ParseError('Ran out of input, excepted more.')
+		char = self.code[self.pos]
+		self.pos += 1
+		return char
 
 	def next_chars(self, num_chars):
 
 		"""Pop off num_chars chars."""
 
-		try:
-			chars = self.code[ : num_chars]
-			self.code = self.code[num_chars : ]
-			return chars
-		except:
-			raise ParseError('Ran out of input, excepted more.')
+		chars = ''
+
+		# Take chars until we have enough or we run out
+		while len(chars) < num_chars and not self.at_end():
+			taken = self.code[self.pos : self.pos + num_chars - len(chars)]
+			self.pos += len(taken)
+			chars += taken
+
+		return chars
 
 	def scan_char(self):
 
 		"""Get the next char."""
 
-		try:
-			return self.code[0]
-		except:
+		if self.at_end():
 			raise ParseError('Ran out of input, expected more.')
+		return self.code[self.pos]
 
 	def scan_chars(self, num_chars):
 
 		"""Get the next chars."""
 
-		try:
-			return self.code[ : num_chars]
-		except:
-			raise ParseError('Ran out of input, expected more.')
+		self.at_end()
+		chars = self.code[self.pos : self.pos + num_chars]
+
+		# Look ahead into the sources below this one
+		for code, pos in reversed(self.sources):
+			if len(chars) >= num_chars:
+				break
+			chars += code[pos : pos + num_chars - len(chars)]
+
+		return chars
+
+	def skip_chars(self, pattern):
+
+		"""Parse through a run of characters matching a pattern, across sources.
+		   Args: pattern -> a compiled regular expression matching the run"""
+
+		chars = ''
+
+		while not self.at_end():
+			end = pattern.match(self.code, self.pos).end()
+			chars += self.code[self.pos : end]
+			self.pos = end
+			# Stop unless the run continues into the next source
+			if end < len(self.code):
+				break
+
+		return chars
 
 	def parse_through_whitespace(self, allow_comments=False):
 
@@ -95,8 +229,8 @@ class Compiler:
 
 		while True:
 			# Remove whitespace
-			self.code = self.code.lstrip()
-			if self.code and self.scan_char() == '#':
+			self.skip_chars(PATTERN_WHITESPACE)
+			if not self.at_end() and self.scan_char() == '#':
 				# Next is a comment
 				if allow_comments:
 					had_comment = True
@@ -117,8 +251,9 @@ class Compiler:
 
 		while True:
 			# Remove whitespace
-			self.code = self.code.lstrip(' ').lstrip('\t')
-			if self.code and self.scan_char() == '#':
+			self.skip_chars(PATTERN_SPACES)
+			self.skip_chars(PATTERN_TABS)
+			if not self.at_end() and self.scan_char() == '#':
 				# Next is a comment
 				if allow_comments:
 					had_comment = True
@@ -136,7 +271,7 @@ class Compiler:
 		"""Parse a string.
 		   Args: starting_char -> the starting character that the string started with"""
 
-		chars = ''
+		chars = []
 
 		# Iterate until stopping
 		while True:
@@ -149,31 +284,14 @@ class Compiler:
 			if current_char == '\\':
 				# We should check the next character
 				next_char = self.next_char()
-				# Check for a 'n'
-				if next_char == 'n':
-					# Add a newline
-					chars += '\n'
-					continue
-				elif next_char == 'b':
-					# Add a backspace
-					chars += '\b'
-					continue
-				elif next_char == 't':
-					# Add a tab
-					chars += '\t'
-					continue
-				elif next_char == 'r':
-					# Add a line return
-					chars += '\r'
-					continue
-				# Else, add the next char and ignore it
-				chars += next_char
+				# Add the escaped char, or the next char itself if it isn't an escape
+				chars.append(STRING_ESCAPES.get(next_char, next_char))
 				continue
 			# Else, add the char normally
-			chars += current_char
+			chars.append(current_char)
 
 		# When we are done, return the string
-		return chars
+		return ''.join(chars)
 
 	def parse_until_char(self, char):
 
@@ -182,18 +300,15 @@ class Compiler:
 
 		chars = ''
 
-		# Iterate through until we get to char
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char == char:
+		# Iterate through the sources until we get to char
+		while not self.at_end():
+			end = self.code.find(char, self.pos)
+			if end == -1:
+				end = len(self.code)
+			chars += self.code[self.pos : end]
+			self.pos = end
+			if end < len(self.code):
 				break
-			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
 
 		# Return the string
 		return chars
@@ -202,111 +317,68 @@ class Compiler:
 
 		"""Parse until we get to a non-alpha character (not in the alphabet)."""
 
-		chars = ''
-
-		# Iterate through until we get to non alpha
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char not in string.ascii_letters:
-				break
-			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
-
-		# Return the string
-		return chars
+		return self.skip_chars(PATTERN_ALPHA)
 
 	def parse_until_non_alphanumeric(self):
 
 		"""Parse until we get to a non-alphanumeric character (not in the alphabet or numbers)."""
 
-		chars = ''
-
-		# Iterate through until we get to non alpha
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char not in string.ascii_letters + '0123456789':
-				break
-			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
-
-		# Return the string
-		return chars
+		return self.skip_chars(PATTERN_ALPHANUMERIC)
 
 	def parse_until_non_hex(self):
 
 		"""Parse until we get a non-hexadecimal character (not in the hex system of 0123456789abcdefABCDEF)"""
 
-		chars = ''
-
-		# Iterate through until we get to non hex
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char not in CHARS_HEX:
-				break
-			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
-
-		# Return the string
-		return chars
+		return self.skip_chars(PATTERN_HEX)
 
 	def parse_until_non_numeric(self):
 
 		"""Parse until we get a non-numeric character (not in the decimal system of 0123456789)"""
 
-		chars = ''
-
-		# Iterate through until we get to non hex
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char not in CHARS_DEC:
-				break
-			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
-
-		# Return the string
-		return chars
+		return self.skip_chars(PATTERN_DEC)
 
 	def parse_until_non_defined(self, defined):
 
 		"""Parse until we get a char not in the defined list."""
 
-		chars = ''
-
-		# Iterate through until we get to non hex
-		while True:
-			if not self.code:
-				break
-			current_char = self.scan_char()
-			# Check for the special char
-			if current_char not in defined:
-				break
+		# Build the pattern for this set of chars once
+		if defined not in DEFINED_PATTERNS:
+			DEFINED_PATTERNS[defined] = re.compile('[' + ''.join(re.escape(char) for char in defined) + ']*')
+
+		return self.skip_chars(DEFINED_PATTERNS[defined])
+
+	def read_include(self, filename):
+
+		"""Read the code of an included file.
+		   Args: filename -> the name of the file to include"""
+
+		if self.filesys == 'comp':
+			# Computer file system
+			file = open(filename, 'r')
+			filedata = file.read()
+			file.close()
+		elif self.filesys == 'emos':
+			# EMOS file system
+			if filename.startswith('/') or filename.startswith('\\'):
+				# Absolute path
+				exitcode, filedata = self.emos.computer.filesystem.read_file(filename)
+				if exitcode != 0:
+					raise ParseError("Invalid path.")
+				filedata = str(filedata, ENCODING)
 			else:
-				# Add the char
-				self.next_char()
-				chars += current_char
-
-		# Return the string
-		return chars
+				# Relative path
+				exitcode, filedata = self.emos.computer.filesystem.read_file(os.path.join(self.currentdir, filename))
+				if exitcode != 0:
+					raise ParseError("Invalid path.")
+				filedata = str(filedata, ENCODING)
+		elif self.filesys == 'files':
+			# Files given to the compiler, with paths like EMOS
+			path = filename if filename.startswith('/') or filename.startswith('\\') else os.path.join(self.currentdir, filename)
+			if not path in self.files:
+				raise MissingInclude(path)
+			filedata = self.files[path]
+
+		return filedata
 
 	def parse_arg(self):
 
@@ -569,11 +641,11 @@ class Compiler:
 		"""Parse the code."""
 
 		# Iterate through the code
-		while self.code:
+		while not self.at_end():
 			# Clear unnecessary spaces
 			if self.parse_through_whitespace(allow_comments=True):
 				continue
-			if not self.code:
+			if self.at_end():
 				break
 			# Get the opcode/mnemonic
 			mnemonic = self.parse_until_non_alpha()
@@ -586,7 +658,7 @@ class Compiler:
 				args = []
 				while True:
 					# Check if we get a newline
-					if not self.code or self.scan_char() == '\n':
+					if self.at_end() or self.scan_char() == '\n':
 						break
 					elif self.scan_char() == '#':
 						self.parse_through_whitespace(allow_comments=True)
@@ -597,7 +669,7 @@ class Compiler:
 					if self.parse_through_whitespace_nonewline(allow_comments=True):
 						break
 					# Check if we get a comma
-					if self.code and self.scan_char() == ',':
+					if not self.at_end() and self.scan_char() == ',':
 						self.next_char()
 						self.parse_through_whitespace_nonewline()
 						continue
@@ -648,7 +720,7 @@ class Compiler:
 							args = []
 							while True:
 								# Check if we get a newline
-								if not self.code or self.scan_char() == '\n':
+								if self.at_end() or self.scan_char() == '\n':
 									break
 								# Parse the arg
 								args.append(self.parse_arg())
@@ -656,7 +728,7 @@ class Compiler:
 								if self.parse_through_whitespace_nonewline(allow_comments=True):
 									break
 								# Check if we get a comma
-								if self.code and self.scan_char() == ',':
+								if not self.at_end() and self.scan_char() == ',':
 									self.next_char()
 									self.parse_through_whitespace_nonewline()
 									continue
@@ -674,31 +746,14 @@ class Compiler:
 					# File include
 					filename = self.parse_through_string(self.next_char())
 					# Get the file data
-					if self.filesys == 'comp':
-						# Computer file system
-						file = open(filename, 'r')
-						filedata = file.read()
-						file.close()
-					elif self.filesys == 'emos':
-						# EMOS file system
-						if filename.startswith('/') or filename.startswith('\\'):
-							# Absolute path
-							exitcode, filedata = self.emos.computer.filesystem.read_file(filename)
-							if exitcode != 0:
-								raise ParseError("Invalid path.")
-							filedata = str(filedata, ENCODING)
-						else:
-							# Relative path
-							exitcode, filedata = self.emos.computer.filesystem.read_file(os.path.join(self.currentdir, filename))
-							if exitcode != 0:
-								raise ParseError("Invalid path.")
-							filedata = str(filedata, ENCODING)
+					filedata = self.read_include(filename)
+					self.includes.append((filename, hashlib.sha256(bytes(filedata, ENCODING)).hexdigest()))
 					# Eat the ending char
 					self.parse_through_whitespace_nonewline()
 					if self.next_char() != '>':
 						raise ParseError("Missing '>'")
-					# Add the code
-					self.code = filedata + self.code
+					# Read the included code before the rest of this source
+					self.push_source(filedata)
 				else:
 					# Library include
 					libname = self.parse_until_non_alpha().upper()
@@ -713,6 +768,233 @@ class Compiler:
 
 		return self.tree
 
+	def optimize(self):
+
+		"""Optimize the parsed tree with peephole optimizations, returning the number of instructions removed."""
+
+		instructions = len([line for line in self.tree if type(line[0]) == int])
+
+		# Keep optimizing until nothing changes, since each optimization can make room for others
+		while self.optimize_instructions() | self.optimize_jumps():
+			pass
+
+		self.removed_instructions = instructions - len([line for line in self.tree if type(line[0]) == int])
+		return self.removed_instructions
+
+	def get_arg_size(self, arg):
+
+		"""Get the size of an argument at compile time, or None if it isn't known until running.
+		   Args: arg -> the argument"""
+
+		atype = arg[0].upper()
+
+		if atype in ('R', 'U'):
+			return 4
+		elif atype in ('REG', 'HEAP', 'PERP', 'PROC'):
+			size = arg[1][2]
+		elif atype == 'MEM':
+			size = arg[1][1]
+		else:
+			return None
+
+		if size[0].upper() != 'INT':
+			return None
+		return int.from_bytes(size[1][0], byteorder='little')
+
+	def fold_constants(self, opcode, args):
+
+		"""Get the constant result of an instruction with constant sources, or None if it can't be folded.
+		   Args: opcode -> the opcode of the instruction
+		         args -> the arguments of the instruction"""
+
+		if len(args) != (2 if opcode == MNEMONIC_LIST.index('NOTF') else 3) or not all(arg[0].upper() == 'INT' for arg in args[ : -1]):
+			return None
+		size = self.get_arg_size(args[-1])
+		if size == None:
+			return None
+
+		# Get the source values
+		a = bytes(args[0][1][0])
+		a_int = int.from_bytes(a, byteorder='little')
+		b_int = int.from_bytes(args[1][1][0], byteorder='little') if len(args) == 3 else 0
+
+		signed = False
+		if opcode == MNEMONIC_LIST.index('ADDF'):
+			answer = a_int + b_int
+		elif opcode == MNEMONIC_LIST.index('SUBF'):
+			answer = a_int - b_int
+			signed = True
+		elif opcode == MNEMONIC_LIST.index('MULF'):
+			answer = a_int * b_int
+		elif opcode == MNEMONIC_LIST.index('ANDF'):
+			answer = a_int & b_int
+		elif opcode == MNEMONIC_LIST.index('ORF'):
+			answer = a_int | b_int
+		elif opcode == MNEMONIC_LIST.index('XORF'):
+			answer = a_int ^ b_int
+		elif opcode == MNEMONIC_LIST.index('NOTF'):
+			answer = (2 ** (8 * len(a)) - 1) - a_int
+		elif opcode == MNEMONIC_LIST.index('BSLF'):
+			answer = a_int << b_int
+		elif opcode == MNEMONIC_LIST.index('BSRF'):
+			answer = a_int >> b_int
+		elif opcode == MNEMONIC_LIST.index('ASLF'):
+			answer = int.from_bytes(a, byteorder='little', signed=True) << b_int
+			signed = True
+		elif opcode == MNEMONIC_LIST.index('ASRF'):
+			answer = int.from_bytes(a, byteorder='little', signed=True) >> b_int
+			signed = True
+		else:
+			return None
+
+		try:
+			return bytearray(int.to_bytes(answer, size, byteorder='little', signed=signed))
+		except OverflowError:
+			# Leave the overflow for when the code runs
+			return None
+
+	def optimize_instructions(self):
+
+		"""Fold constants, reduce multiplications by powers of two to shifts, and remove redundant moves. Returns if anything changed."""
+
+		tree = []
+		changed = False
+
+		mode = 'code'
+
+		for line in self.tree:
+			if line[0] == 'SEC':
+				mode = line[1]
+			if type(line[0]) != int or mode != 'code':
+				tree.append(line)
+				continue
+
+			opcode, args = line
+
+			# Only fold the instructions that don't modify the flags, so the result can be moved in directly
+			folded = self.fold_constants(opcode, args)
+			if folded != None:
+				tree.append([MNEMONIC_LIST.index('MOV'), [args[-1], ['INT', [folded]]]])
+				changed = True
+				continue
+
+			# Multiplications by a power of two are shifts
+			if opcode == MNEMONIC_LIST.index('MULF') and len(args) == 3:
+				for factor, other in ((args[0], args[1]), (args[1], args[0])):
+					if factor[0].upper() == 'INT' and other[0].upper() != 'INT':
+						value = int.from_bytes(factor[1][0], byteorder='little')
+						if value > 0 and value & (value - 1) == 0:
+							line = [MNEMONIC_LIST.index('BSLF'), [other, ['INT', [bytearray(int.to_bytes(value.bit_length() - 1, 4, byteorder='little'))]], args[2]]]
+							changed = True
+							break
+
+			# Moving a register to itself does nothing
+			if opcode == MNEMONIC_LIST.index('MOV') and len(args) == 2 and args[0] == args[1] and args[0][0].upper() in ('R', 'U'):
+				changed = True
+				continue
+
+			# Popping a register straight after pushing it does nothing
+			if opcode == MNEMONIC_LIST.index('POP') and tree and tree[-1][0] == MNEMONIC_LIST.index('PUSH') and tree[-1][1] == args and len(args) == 1 and args[0][0].upper() in ('R', 'U'):
+				tree.pop()
+				changed = True
+				continue
+
+			tree.append(line)
+
+		self.tree = tree
+		return changed
+
+	def is_empty_line(self, line):
+
+		"""Check if a line in the tree doesn't compile to anything, i.e. a label.
+		   Args: line -> the line in the tree"""
+
+		return line[0] == 'LABL' or line == ['DATA', []]
+
+	def get_jump_target(self, name, labels):
+
+		"""Get the label/symbol a jump to name ends up at, following labels that only jump somewhere else.
+		   Args: name -> the label/symbol jumped to
+		         labels -> a dictionary of label names to their index in the tree"""
+
+		visited = set()
+
+		while name in labels and not name in visited:
+			visited.add(name)
+			# Find the first line after the label
+			index = labels[name] + 1
+			while index < len(self.tree) and self.is_empty_line(self.tree[index]):
+				index += 1
+			if index == len(self.tree):
+				break
+			line = self.tree[index]
+			if line[0] != MNEMONIC_LIST.index('JMP') or len(line[1]) != 1 or line[1][0][0].upper() != 'SYM':
+				break
+			name = line[1][0][1][0]
+
+		return name
+
+	def optimize_jumps(self):
+
+		"""Thread jumps to jumps, and remove jumps to the next instruction and code that can't be reached. Returns if anything changed."""
+
+		jumps = [MNEMONIC_LIST.index(mnemonic) for mnemonic in ('JMP', 'JL', 'JG', 'JE', 'JLE', 'JGE', 'JNE')]
+		unconditional = [MNEMONIC_LIST.index(mnemonic) for mnemonic in ('JMP', 'HLT', 'RET')]
+
+		# Find the code labels
+		labels = {}
+		mode = 'code'
+		for index, line in enumerate(self.tree):
+			if line[0] == 'SEC':
+				mode = line[1]
+			elif line[0] == 'LABL' and mode == 'code':
+				labels[line[1]] = index
+
+		tree = []
+		changed = False
+
+		mode = 'code'
+		unreachable = False
+
+		for index, line in enumerate(self.tree):
+			if line[0] == 'SEC':
+				mode = line[1]
+			if type(line[0]) != int or mode != 'code':
+				# Labels, sections and data can all be reached
+				unreachable = False
+				tree.append(line)
+				continue
+
+			if unreachable:
+				# Nothing jumps here, and the instruction before never continues
+				changed = True
+				continue
+
+			opcode, args = line
+
+			if opcode in jumps and len(args) == 1 and args[0][0].upper() == 'SYM':
+				name = args[0][1][0]
+				# Check if we jump to the next instruction
+				following = index + 1
+				while following < len(self.tree) and self.is_empty_line(self.tree[following]):
+					if self.tree[following] == ['LABL', name]:
+						break
+					following += 1
+				if following < len(self.tree) and self.tree[following] == ['LABL', name]:
+					changed = True
+					continue
+				# Jump straight to where the target jumps to
+				target = self.get_jump_target(name, labels)
+				if target != name:
+					line = [opcode, [['SYM', [target]]]]
+					changed = True
+
+			unreachable = opcode in unconditional
+			tree.append(line)
+
+		self.tree = tree
+		return changed
+
 	def compile_arg(self, arg):
 
 		"""Compiles an argument.
@@ -725,6 +1007,10 @@ class Compiler:
 
 		# Register
 		if atype == 'REG':
+			if self.encoding == 2 and self.is_small_constant(data[1]) and self.is_small_constant(data[2]):
+				# Type: 8, RegName: data[0], Start: data[1] as one byte, End: data[2] as one byte
+				self.compiled += bytearray([8, data[0], int.from_bytes(data[1][1][0], byteorder='little'), int.from_bytes(data[2][1][0], byteorder='little')])
+				return
 			# Type: 0, RegName: data[0], Start: data[1], End: data[2]
 			self.compiled += bytearray([0])
 			self.compiled += bytearray([data[0]])
@@ -732,12 +1018,27 @@ class Compiler:
 			self.compile_arg(data[2])
 		# Process memory
 		elif atype == 'MEM':
+			if self.encoding == 2 and self.is_small_constant(data[1]):
+				# Type: 9, Start: data[0], End: data[1] as one byte
+				self.compiled += bytearray([9])
+				self.compile_arg(data[0])
+				self.compiled += bytearray([int.from_bytes(data[1][1][0], byteorder='little')])
+				return
 			# Type: 1, Start: data[0], End: data[1]
 			self.compiled += bytearray([1]) 
 			self.compile_arg(data[0]) 
 			self.compile_arg(data[1])
 		# Intermediate
 		elif atype == 'INT':
+			if self.encoding == 2 and 0 < len(data[0]) < 16 and not any(data[0][1 : ]):
+				# Type: 0x30 + the length, Data: the first byte of data[0], as the rest is zeros
+				self.compiled += bytearray([0x30 + len(data[0]), data[0][0]])
+				return
+			if self.encoding == 2 and len(data[0]) < 16:
+				# Type: 0x10 + the length, Data: data[0]
+				self.compiled += bytearray([0x10 + len(data[0])])
+				self.compiled += data[0]
+				return
 			# Type: 2, Data: data[0]
 			self.compiled += bytearray([2]) 
 			self.compiled += int.to_bytes(len(data[0]), 2, 'little')
@@ -745,8 +1046,12 @@ class Compiler:
 		# Label/Symbol
 		elif atype == 'SYM':
 			# Type: 2, Data: zeros for now, but we will add then in later
-			self.compiled += bytearray([2])
-			self.compiled += bytearray([4, 0])
+			if self.encoding == 2:
+				# Type: 0x14, as the data always has four bytes
+				self.compiled += bytearray([0x14])
+			else:
+				self.compiled += bytearray([2])
+				self.compiled += bytearray([4, 0])
 			# Add this label access to the label_uses
 			self.label_uses[len(self.compiled)] = data[0]
 
@@ -783,6 +1088,13 @@ class Compiler:
 			self.compile_arg(data[1])
 			self.compile_arg(data[2])
 
+	def is_small_constant(self, arg):
+
+		"""Check if an argument is a constant that fits in one byte.
+		   Args: arg -> the argument"""
+
+		return arg[0].upper() == 'INT' and int.from_bytes(arg[1][0], byteorder='little') < 256
+
 	def compile_data(self, data):
 
 		"""Compiles a data argument.
@@ -826,22 +1138,23 @@ class Compiler:
 
 		self.tree = code_sec + data_sec
 
-	def compile(self):
+	def compile_tree(self):
 
-		"""Compiles the code in the tree."""
+		"""Compiles the code in the tree, leaving the labels/symbols unresolved."""
 
 		self.compiled = bytearray()
 
 		self.rearrange_tree()
 		
 		self.labels = {}
+		self.label_sections = {}
 		self.label_uses = {}
 
 		self.data_index = None
 
 		mode = 'code'
 
-		# Pass one (compiling)
+		# Compile each line
 		for line in self.tree:
 			# Check for an opcode
 			if type(line[0]) == int:
@@ -855,6 +1168,7 @@ class Compiler:
 			elif line[0] == 'LABL':
 				# Add the label to the labels
 				self.labels[line[1]] = len(self.compiled)
+				self.label_sections[line[1]] = mode
 			# Check for a DATA definition
 			elif line[0] == 'DATA':
 				# Parse the arg
@@ -868,7 +1182,9 @@ class Compiler:
 					# Move to data section
 					self.data_index = len(self.compiled)
 
-		# Pass two (resolving labels/symbols)
+	def resolve_labels(self):
+
+		"""Resolves the labels/symbols used in the compiled code."""
 
 		self.labels = {**self.labels, **{'DATA' : self.data_index, 'CODE' : 0}}
 
@@ -878,5 +1194,414 @@ class Compiler:
 			# Place the label there
 			self.compiled[index : index + 4] = int.to_bytes(resolved, 4, byteorder='little')
 
+	def compile(self):
+
+		"""Compiles the code in the tree."""
+
+		# Pass one (compiling)
+		self.compile_tree()
+		# Pass two (resolving labels/symbols)
+		self.resolve_labels()
+
 		return self.compiled, self.data_index
 
+	def get_code_labels(self):
+
+		"""Get the offsets of the labels in the code section, after compiling."""
+
+		return {name : index for name, index in self.labels.items() if self.label_sections.get(name) == 'code'}
+
+	def compile_object(self):
+
+		"""Compiles the code in the tree into an object file, to be linked with other object files later."""
+
+		self.compile_tree()
+
+		code_length = self.data_index if self.data_index != None else len(self.compiled)
+
+		# Labels/symbols are given relative to the start of their section
+		symbols = {}
+		for name, index in self.labels.items():
+			if self.label_sections[name] == 'code':
+				symbols[name] = ('code', index)
+			else:
+				symbols[name] = ('data', index - code_length)
+
+		# Every label/symbol use has to be filled in when linking
+		relocations = []
+		for index, name in self.label_uses.items():
+			if index < code_length:
+				relocations.append(('code', index, name))
+			else:
+				relocations.append(('data', index - code_length, name))
+
+		return ObjectFile(bytes(self.compiled[ : code_length]), bytes(self.compiled[code_length : ]), symbols, relocations, self.data_index != None, self.encoding)
+
+
+class ObjectFile:
+
+	"""Compiled code with its labels/symbols left unresolved, so it can be linked with other object files."""
+
+	def __init__(self, code, data, symbols, relocations, has_data, encoding=1):
+
+		"""Create the object file.
+		   Args: code -> the compiled code section
+		         data -> the compiled data section
+		         symbols -> the labels/symbols defined, as a dictionary of names to (section, offset)
+		         relocations -> the labels/symbols used, as a list of (section, offset, name)
+		         has_data -> did the code declare a data section
+		         encoding -> the instruction encoding of the code"""
+
+		self.code = code
+		self.data = data
+		self.symbols = symbols
+		self.relocations = relocations
+		self.has_data = has_data
+		self.encoding = encoding
+
+	def get_exports(self):
+
+		"""Get the names of the labels/symbols this object file defines."""
+
+		return set(self.symbols)
+
+	def get_imports(self):
+
+		"""Get the names of the labels/symbols this object file uses but doesn't define."""
+
+		return set(name for section, offset, name in self.relocations if not (name in self.symbols or name in ('DATA', 'CODE')))
+
+	def to_bytes(self):
+
+		"""Get the object file as bytes."""
+
+		table = bytes(json.dumps({'symbols' : self.symbols, 'relocations' : self.relocations, 'has_data' : self.has_data, 'encoding' : self.encoding}), ENCODING)
+
+		return struct.pack(OBJECT_HEADER, OBJECT_MAGIC, len(self.code), len(self.data), len(table)) + self.code + self.data + table
+
+	@classmethod
+	def from_bytes(cls, data):
+
+		"""Load an object file from bytes.
+		   Args: data -> the object file bytes"""
+
+		data = bytes(data)
+		header_size = struct.calcsize(OBJECT_HEADER)
+
+		if len(data) < header_size:
+			raise ParseError("Invalid object file.")
+		magic, code_length, data_length, table_length = struct.unpack(OBJECT_HEADER, data[ : header_size])
+		if magic != OBJECT_MAGIC or len(data) != header_size + code_length + data_length + table_length:
+			raise ParseError("Invalid object file.")
+
+		code = data[header_size : header_size + code_length]
+		section_data = data[header_size + code_length : header_size + code_length + data_length]
+		table = json.loads(str(data[header_size + code_length + data_length : ], ENCODING))
+
+		symbols = {name : tuple(symbol) for name, symbol in table['symbols'].items()}
+		relocations = [tuple(relocation) for relocation in table['relocations']]
+
+		return cls(code, section_data, symbols, relocations, table['has_data'], table.get('encoding', 1))
+
+
+class Linker:
+
+	"""Links object files into a single executable, leaving out any object file none of the others use."""
+
+	def __init__(self, objects):
+
+		"""Create the linker.
+		   Args: objects -> the object files to link. The first one is the main object file, where the program starts"""
+
+		self.objects = objects
+		# Indices of the object files used by the last link
+		self.used = []
+
+	def link(self):
+
+		"""Link the object files. Returns the compiled code and the data index, like Compiler.compile."""
+
+		if not self.objects:
+			raise ParseError("Nothing to link.")
+
+		encoding = self.objects[0].encoding
+		if any(objectfile.encoding != encoding for objectfile in self.objects):
+			raise ParseError("Object files use different encodings.")
+
+		# Find where each label/symbol is defined
+		definitions = {}
+		for object_index, objectfile in enumerate(self.objects):
+			for name in objectfile.symbols:
+				if name in definitions:
+					raise ParseError("Symbol '" + name + "' is defined more than once.")
+				definitions[name] = object_index
+
+		# Find the object files used by the main object file, directly or not
+		used = {0}
+		unvisited = [0]
+		while unvisited:
+			for name in self.objects[unvisited.pop()].get_imports():
+				if not name in definitions:
+					raise ParseError("Undefined symbol '" + name + "'.")
+				if not definitions[name] in used:
+					used.add(definitions[name])
+					unvisited.append(definitions[name])
+		self.used = sorted(used)
+
+		# Lay out the code sections, followed by the data sections. Programs can end by running off the end of their code, so the main object file's code goes last, with a jump to it at the start
+		code_order = self.used[1 : ] + [0]
+		compiled = bytearray()
+		if len(self.used) > 1:
+			if encoding == 1:
+				compiled += bytearray([MNEMONIC_LIST.index('JMP'), 2, 4, 0, 0, 0, 0, 0])
+			else:
+				compiled += bytearray([MNEMONIC_LIST.index('JMP'), 0x14, 0, 0, 0, 0])
+
+		code_starts = {}
+		for object_index in code_order:
+			code_starts[object_index] = len(compiled)
+			compiled += self.objects[object_index].code
+		data_index = len(compiled) if any(self.objects[object_index].has_data for object_index in self.used) else None
+
+		data_starts = {}
+		for object_index in self.used:
+			data_starts[object_index] = len(compiled)
+			compiled += self.objects[object_index].data
+
+		if len(self.used) > 1:
+			# Jump to the main object file's code
+			jump_end = code_starts[code_order[0]]
+			compiled[jump_end - 4 : jump_end] = int.to_bytes(code_starts[0], 4, byteorder='little')
+
+		# Resolve the labels/symbols
+		section_starts = {'code' : code_starts, 'data' : data_starts}
+		for object_index in self.used:
+			objectfile = self.objects[object_index]
+			for section, offset, name in objectfile.relocations:
+				if name == 'DATA':
+					# Start of this object file's data
+					resolved = data_starts[object_index]
+				elif name == 'CODE':
+					# Start of this object file's code
+					resolved = code_starts[object_index]
+				else:
+					defined_in = object_index if name in objectfile.symbols else definitions[name]
+					symbol_section, symbol_offset = self.objects[defined_in].symbols[name]
+					resolved = section_starts[symbol_section][defined_in] + symbol_offset
+				index = section_starts[section][object_index] + offset
+				compiled[index : index + 4] = int.to_bytes(resolved, 4, byteorder='little')
+
+		return compiled, data_index
+
+
+class CompileCache:
+
+	"""Caches compiled code, keyed by the hash of the source and the hashes of every file it includes."""
+
+	def __init__(self, directory=None, max_size=COMPILE_CACHE_SIZE):
+
+		"""Create the compile cache.
+		   Args: directory -> a host directory to keep cache entries in across runs, or None to only cache in memory
+		         max_size -> the maximum number of entries to keep in memory"""
+
+		self.directory = directory
+		self.max_size = max_size
+
+		# Source hash -> (includes, compiled, data_index, removed instructions, code labels), least recently used first
+		self.entries = collections.OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+
+		if self.directory != None:
+			os.makedirs(self.directory, exist_ok=True)
+
+	def _entry_path(self, key):
+
+		"""Get the host path of a cache entry.
+		   Args: key -> the source hash of the entry"""
+
+		return os.path.join(self.directory, key + '.cache')
+
+	def _get_entry(self, key):
+
+		"""Get a cache entry, or None if there isn't one.
+		   Args: key -> the source hash of the entry"""
+
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		if self.directory == None:
+			return None
+
+		# Check the cache directory
+		try:
+			with open(self._entry_path(key), 'rb') as f:
+				entry = pickle.load(f)
+		except Exception:
+			return None
+
+		self._add_entry(key, entry)
+		return entry
+
+	def _add_entry(self, key, entry):
+
+		"""Add an entry to the in-memory cache.
+		   Args: key -> the source hash of the entry
+		         entry -> the entry"""
+
+		self.entries[key] = entry
+		self.entries.move_to_end(key)
+
+		# Evict the least recently used entries
+		while len(self.entries) > self.max_size:
+			self.entries.popitem(last=False)
+
+	def _put_entry(self, key, entry):
+
+		"""Store a cache entry.
+		   Args: key -> the source hash of the entry
+		         entry -> the entry"""
+
+		self._add_entry(key, entry)
+
+		if self.directory == None:
+			return
+
+		# Write the entry to the cache directory, replacing it atomically
+		path = self._entry_path(key)
+		with open(path + '.tmp', 'wb') as f:
+			pickle.dump(entry, f)
+		os.replace(path + '.tmp', path)
+
+	def _includes_unchanged(self, parser, includes):
+
+		"""Check if every file included by a cache entry still has the same code.
+		   Args: parser -> the compiler to read the included files with
+		         includes -> the included files and hashes of the entry"""
+
+		for filename, digest in includes:
+			try:
+				filedata = parser.read_include(filename)
+			except Exception:
+				return False
+			if hashlib.sha256(bytes(filedata, ENCODING)).hexdigest() != digest:
+				return False
+
+		return True
+
+	def compile(self, code, filesys='comp', emos=None, currentdir=None, optimize=False, encoding=1):
+
+		"""Compile code, using the cached result if neither the code nor any of its includes changed. Returns the compiled code, the data index, the number of instructions the optimizer removed and the offsets of the code section labels.
+		   Args: code -> code to parse and compile
+		         filesys -> the file system to load other files from. 'comp' is for computer, and 'emos' is for EMOS. 
+		         emos -> the operating system to retrieve files from
+		         currentdir -> the current working directory for emos
+		         optimize -> run the optimizer before compiling
+		         encoding -> the instruction encoding to compile to, 1 or 2"""
+
+		parser = Compiler(code, filesys, emos, currentdir, encoding)
+		key = hashlib.sha256(bytes(code, ENCODING)).hexdigest() + ('-optimized' if optimize else '') + ('-v' + str(encoding) if encoding != 1 else '')
+
+		# Check for a cached result
+		entry = self._get_entry(key)
+		if entry != None and len(entry) == 5 and self._includes_unchanged(parser, entry[0]):
+			self.hits += 1
+			return bytearray(entry[1]), entry[2], entry[3], entry[4]
+
+		# Compile the code
+		self.misses += 1
+		parser.parse()
+		if optimize:
+			parser.optimize()
+		compiled, data_index = parser.compile()
+		code_labels = parser.get_code_labels()
+
+		self._put_entry(key, (parser.includes, bytes(compiled), data_index, parser.removed_instructions, code_labels))
+
+		return compiled, data_index, parser.removed_instructions, code_labels
+
+	def clear(self):
+
+		"""Remove every cache entry."""
+
+		self.entries.clear()
+
+		if self.directory == None:
+			return
+
+		for name in os.listdir(self.directory):
+			if name.endswith('.cache'):
+				os.remove(os.path.join(self.directory, name))
+
+
+def _compile_source(job):
+
+	"""Compile a single source for compile_batch, returning its name, exitcode and executable or error message.
+	   Args: job -> the name, code, file system, current directory, given files, optimize flag, encoding, stack reservation, heap hint and entry point label of the source"""
+
+	name, code, filesys, currentdir, files, optimize, encoding, stack_size, heap_size, entry = job
+
+	try:
+		parser = Compiler(code, filesys, None, currentdir, encoding, files)
+		parser.parse()
+		if optimize:
+			parser.optimize()
+		compiled, data_index = parser.compile()
+		entry = find_entry(parser.get_code_labels(), entry) if entry != None else 0
+		return (name, 0, bytes(build_executable(compiled, data_index, encoding, stack_size, heap_size, entry)))
+	except MissingInclude as e:
+		# Ask for the included file
+		return (name, None, e.path)
+	except Exception as e:
+		return (name, 37, "Parse error. [" + str(e) + "]")
+
+
+def compile_batch(sources, filesys='comp', emos=None, currentdir=None, optimize=False, encoding=1, processes=None, stack_size=0, heap_size=0, entry=None):
+
+	"""Compile many sources at once in a pool of processes. Returns a dictionary of each source's name to its exitcode and its executable or error message.
+	   Args: sources -> a list of names and code to compile
+	         filesys -> the file system to load other files from. 'comp' is for computer, and 'emos' is for EMOS. 
+	         emos -> the operating system to retrieve files from
+	         currentdir -> the current working directory for emos
+	         optimize -> run the optimizer before compiling
+	         encoding -> the instruction encoding to compile to, 1 or 2
+	         processes -> the number of processes to compile with, or None for one per CPU
+	         stack_size -> the number of bytes of stack for the executables to reserve
+	         heap_size -> the size of the heap arena for the executables to preallocate
+	         entry -> the label for the executables to start running at, or None to start at the beginning"""
+
+	# The operating system can't be sent to other processes, so included EMOS files are read here and given to the compilers
+	files = {} if filesys == 'emos' else None
+	jobs = [(name, code, 'files' if filesys == 'emos' else filesys, currentdir, files, optimize, encoding, stack_size, heap_size, entry) for name, code in sources]
+	codes = dict(sources)
+	results = {}
+
+	pool = None
+	if len(jobs) > 1 and processes != 1:
+		# Start new processes instead of forking, as the emulator runs other threads
+		pool = multiprocessing.get_context('spawn').Pool(processes)
+
+	try:
+		while jobs:
+			outputs = pool.map(_compile_source, jobs) if pool else [_compile_source(job) for job in jobs]
+			jobs = []
+			for name, exitcode, output in outputs:
+				if exitcode != None:
+					results[name] = (exitcode, output)
+					continue
+				# Read the missing included file, and compile the source again
+				if not output in files:
+					exitcode, filedata = emos.computer.filesystem.read_file(output)
+					if exitcode != 0:
+						results[name] = (37, "Parse error. [Invalid path.]")
+						continue
+					files[output] = str(filedata, ENCODING)
+				jobs.append((name, codes[name], 'files', currentdir, files, optimize, encoding, stack_size, heap_size, entry))
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	return results
@@ -0,0 +1,334 @@
+"""
+
+- EMOS Behaviour Tests -
+
+(C) Cubeflix 2021 (EMOS)
+
+"""
+
+
+# Imports
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from emos import *
+from emos.computer import BLOB_CHUNK_SIZE
+import emos.parse
+
+
+def boot(directory):
+
+	"""Create a computer with a formatted file system and the process loop running, without any peripherals.
+	   Args: directory -> the host directory to put the file system in"""
+
+	memory = Memory()
+	computer = Computer()
+	computer.set_memory(memory)
+	operatingsystem = OperatingSystem(computer)
+	filesystem = FileSystem(computer, os.path.join(directory, 'test.fs'), durability='sync')
+	filesystem._format('test')
+	computer.set_filesystem(filesystem)
+	computer.set_os(operatingsystem)
+	cpu = CPU(computer, memory)
+	computer.set_cpu(cpu)
+	cpu.add_core(CPUCore(cpu))
+	threading.Thread(target=operatingsystem._process_mainloop, daemon=True).start()
+
+	return computer
+
+
+def compile_code(code, encoding=1):
+
+	"""Compile code, returning the compiler, the compiled code and the data index.
+	   Args: code -> the code to compile
+	         encoding -> the instruction encoding to compile to"""
+
+	compiler = emos.parse.Compiler(code, 'comp', encoding=encoding)
+	compiler.parse()
+	compiled, data_index = compiler.compile()
+
+	return compiler, compiled, data_index
+
+
+class BootedTestCase(unittest.TestCase):
+
+	"""A test case with a booted computer to run executables on."""
+
+	@classmethod
+	def setUpClass(cls):
+
+		cls.directory = tempfile.mkdtemp()
+		cls.computer = boot(cls.directory)
+		cls.operatingsystem = cls.computer.operatingsystem
+
+	@classmethod
+	def tearDownClass(cls):
+
+		cls.operatingsystem.running = False
+		cls.computer.filesystem.close()
+		shutil.rmtree(cls.directory)
+
+	def run_executable(self, data):
+
+		"""Run an executable until it stops, returning the process.
+		   Args: data -> the executable data"""
+
+		process = self.operatingsystem.run_executable_data(data)
+		exitcode, pid = self.operatingsystem.process_create(process)
+		self.assertEqual(exitcode, 0)
+		self.operatingsystem.process_await(pid)
+
+		return process
+
+
+class TestFork(BootedTestCase):
+
+	"""Copy-on-write forks of memory sections and processes."""
+
+	def test_memory_section_fork(self):
+
+		section = MemorySection('test', 4, b'abcd')
+		fork = section.fork()
+		self.assertIs(fork.data, section.data)
+
+		# Writes to either section are not seen by the other
+		fork.set_bytes(0, b'x')
+		section.write(4, b'e')
+		self.assertEqual(fork.data, b'xbcd')
+		self.assertEqual(section.data, b'abcde')
+
+	def test_process_memory_fork(self):
+
+		processmemory = ProcessMemory(b'\x00' * 4, bytearray(b'data'), b'')
+		fork = processmemory.fork()
+		fork.data.set_bytes(0, b'D')
+		fork.stack.push(b'1234')
+
+		self.assertEqual(processmemory.data.data, b'data')
+		self.assertEqual(processmemory.stack.data, b'')
+		self.assertEqual(fork.data.data, b'Data')
+
+	def test_process_fork_file_handles(self):
+
+		self.computer.filesystem.write_file('/fork.txt', b'0123456789')
+		process = self.operatingsystem.run_executable_data(emos.parse.build_executable(*compile_code('[.code]\nHLT [0]\n')[1 : ]))
+		exitcode, pid = self.operatingsystem.process_create(process)
+		self.operatingsystem.process_await(pid)
+		exitcode, fd = self.operatingsystem.file_open(pid, '/fork.txt', 0)
+		self.assertEqual(exitcode, 0)
+		process.open_files[fd].read(3)
+
+		exitcode, child_pid = self.operatingsystem.process_fork(pid)
+		self.assertEqual(exitcode, 0)
+		child = self.operatingsystem.processes[child_pid]
+
+		# The child has its own file position
+		self.assertEqual(child.open_files[fd].read(4), (0, b'3456'))
+		self.assertEqual(process.open_files[fd].position, 3)
+
+
+class TestFileSystem(unittest.TestCase):
+
+	"""File ranges and the journal of the file system."""
+
+	def setUp(self):
+
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'test.fs')
+		self.filesystem = FileSystem(None, self.path, durability='sync')
+		self.filesystem._format('test')
+
+	def tearDown(self):
+
+		self.filesystem.close()
+		shutil.rmtree(self.directory)
+
+	def reload(self):
+
+		"""Load the file system again from its output file and journal."""
+
+		self.filesystem.close()
+		self.filesystem = FileSystem(None, self.path, durability='sync')
+		self.filesystem._backend_load()
+
+	def test_write_file_range_past_end(self):
+
+		self.filesystem.write_file('/file', b'abc')
+		self.assertEqual(self.filesystem.write_file_range('/file', BLOB_CHUNK_SIZE + 5, b'xyz'), (0, None))
+
+		expected = b'abc' + bytes(BLOB_CHUNK_SIZE + 2) + b'xyz'
+		self.assertEqual(self.filesystem.get_file_size('/file'), (0, len(expected)))
+		self.assertEqual(self.filesystem.read_file('/file'), (0, expected))
+		self.assertEqual(self.filesystem.read_file_range('/file', BLOB_CHUNK_SIZE, 8), (0, bytes(5) + b'xyz'))
+
+	def test_journal_replay(self):
+
+		size = os.path.getsize(self.path)
+		self.filesystem.create_directory('/dir')
+		self.filesystem.write_file('/dir/file', b'hello')
+		self.filesystem.rename_file('/dir/file', 'renamed')
+		self.filesystem.write_file('/deleted', b'x' * 100)
+		self.filesystem.delete_file('/deleted')
+
+		# The changes are only in the journal
+		self.assertEqual(os.path.getsize(self.path), size)
+		self.reload()
+		self.assertEqual(self.filesystem.read_file('/dir/renamed'), (0, b'hello'))
+		self.assertNotEqual(self.filesystem.read_file('/deleted')[0], 0)
+
+	def test_journal_torn_record(self):
+
+		self.filesystem.write_file('/file', b'hello')
+		self.filesystem.close()
+		with open(self.path + '.journal', 'ab') as f:
+			f.write(b'\x10\x00\x00\x00abcd')
+
+		# The incomplete record is dropped
+		self.reload()
+		self.assertEqual(self.filesystem.read_file('/file'), (0, b'hello'))
+		self.assertEqual(self.filesystem.journal_size, os.path.getsize(self.path + '.journal'))
+
+	def test_journal_compaction(self):
+
+		generation = self.filesystem.generation
+		self.filesystem.journal_max_size = 100
+		self.filesystem.write_file('/file', b'y' * 200)
+
+		# The journal is written into the output file and started again
+		self.assertEqual(self.filesystem.generation, generation + 1)
+		self.assertLess(os.path.getsize(self.path + '.journal'), 100)
+		self.reload()
+		self.assertEqual(self.filesystem.read_file('/file'), (0, b'y' * 200))
+
+
+class TestCompiler(BootedTestCase):
+
+	"""The optimizer, the instruction encodings and the executable format."""
+
+	CODE = '''[.data]
+[value] [7]
+[zeros] [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+[.code]
+HLT [99]
+[start]
+PUSHN ["hi"]
+MOV R[RBX], U[ES]
+SUB R[RBX], [2], R[RBX]
+MOV R[RCX], [2]
+MOV R[RAX], [1]
+SYS
+ADD MEM[SYM[value] : [4]], MEM[SYM[zeros] : [4]], R[RAX]
+HLT R[RAX]
+'''
+
+	def test_optimizer(self):
+
+		code = '[.code]\nADDF [2], [3], R[RAX]\nMULF R[RAX], [4], R[RBX]\nJMP SYM[end]\nMOV R[RBX], [1]\n[end]\nHLT R[RBX]\n'
+		compiler = emos.parse.Compiler(code, 'comp')
+		compiler.parse()
+
+		# The jump to the next instruction and the code after it are removed
+		self.assertEqual(compiler.optimize(), 2)
+		instructions = [line for line in compiler.tree if type(line[0]) == int]
+		self.assertEqual([line[0] for line in instructions], [emos.parse.MNEMONIC_LIST.index(mnemonic) for mnemonic in ('MOV', 'BSLF', 'HLT')])
+		# The addition is folded into a move, and the multiplication is a shift
+		self.assertEqual(instructions[0][1][1], ['INT', [bytearray(int.to_bytes(5, 4, byteorder='little'))]])
+		self.assertEqual(instructions[1][1][1], ['INT', [bytearray(int.to_bytes(2, 4, byteorder='little'))]])
+
+		compiled, data_index = compiler.compile()
+		process = self.run_executable(emos.parse.build_executable(compiled, data_index))
+		self.assertEqual(process.output, (20, None))
+
+	def test_encoding_round_trip(self):
+
+		results = []
+		for encoding in emos.parse.ENCODINGS:
+			compiler, compiled, data_index = compile_code(self.CODE, encoding=encoding)
+			entry = emos.parse.find_entry(compiler.get_code_labels(), 'start')
+			process = self.run_executable(emos.parse.build_executable(compiled, data_index, encoding, entry=entry))
+			results.append((len(compiled), bytes(process.stdout.data), process.output))
+
+		# The second encoding is smaller, but runs the same way
+		self.assertLess(results[1][0], results[0][0])
+		self.assertEqual(results[0][1 : ], (b'hi', (7, None)))
+		self.assertEqual(results[1][1 : ], results[0][1 : ])
+
+	def test_extended_executable(self):
+
+		compiler, compiled, data_index = compile_code(self.CODE)
+		entry = emos.parse.find_entry(compiler.get_code_labels(), 'start')
+		data = emos.parse.build_executable(compiled, data_index, stack_size=64, heap_size=32, entry=entry)
+
+		# The zeros at the end of the data section are left out
+		self.assertEqual(bytes(data[0 : 4]), emos.parse.EXECUTABLE_MAGIC_EXTENDED)
+		self.assertLess(len(data), len(compiled))
+
+		process = self.operatingsystem.run_executable_data(data)
+		self.assertEqual(process.processmemory.code.data, compiled[ : data_index])
+		self.assertEqual(process.processmemory.data.data, compiled[data_index : ])
+		self.assertEqual(process.processmemory.entry, entry)
+		self.assertEqual(process.processmemory.stack_size, 64)
+		self.assertEqual(process.heap_size, 32)
+
+		process = self.run_executable(data)
+		self.assertEqual(process.output, (7, None))
+
+	def test_entry_outside_code(self):
+
+		compiled, data_index = compile_code(self.CODE)[1 : ]
+		process = self.operatingsystem.run_executable_data(emos.parse.build_executable(compiled, data_index, entry=data_index))
+		self.assertEqual(self.operatingsystem.process_create(process)[0], 55)
+
+
+class TestStreams(unittest.TestCase):
+
+	"""The standard output and input of processes."""
+
+	def test_stdout_trim(self):
+
+		stdout = STDOut(maxsize=16)
+		stdout.write(b'a' * 10, None)
+		stdout.write(b'b' * 10, None)
+
+		# The oldest output is dropped, with an extra quarter
+		self.assertEqual(stdout.data, b'a' * 2 + b'b' * 10)
+		self.assertEqual(stdout.pipe(), (0, stdout.data))
+
+	def test_stdout_spill(self):
+
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		stdout = STDOut(maxsize=16, spill=os.path.join(directory, 'out'))
+		for i in range(10):
+			stdout.write(bytes(str(i), ENCODING) * 10, None)
+
+		# The whole output is kept, partly in the spill file
+		self.assertLessEqual(len(stdout.data), 16)
+		self.assertEqual(stdout.pipe(), (0, b''.join(bytes(str(i), ENCODING) * 10 for i in range(10))))
+
+		stdout.set_data(b'new', None)
+		self.assertFalse(os.path.exists(stdout.spill))
+		self.assertEqual(stdout.pipe(), (0, b'new'))
+
+	def test_stdin_readn(self):
+
+		stdin = STDIn()
+		for chunk in (b'ab', b'cde', b'', b'f\ng'):
+			stdin.write(chunk)
+		self.assertEqual(stdin.get_size(), 8)
+
+		# Reads span the chunks
+		self.assertEqual(stdin.readn(4, None), (0, 'abcd'))
+		self.assertEqual(stdin.get_data(), b'ef\ng')
+		self.assertEqual(stdin.readline(None), (0, 'ef'))
+		self.assertEqual(stdin.get_size(), 1)
+		self.assertEqual(stdin.readn(2, None)[0], 24)
+		self.assertEqual(stdin.readn(1, None), (0, 'g'))
+		self.assertEqual(stdin.get_size(), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()